@@ -0,0 +1,65 @@
+"""
+PostgreSQL backend drawing its connections from a ConnectionPool.
+
+Configured through the `pool` entry of the database OPTIONS, any of which
+can be overridden per environment:
+
+    OPTIONS:
+      pool:
+        min_size: 2
+        max_size: 20
+        max_idle: 300
+        timeout: 10
+        check: true
+
+Each process opens at most max_size connections, so the processes of every
+deployment times max_size must stay below the server's max_connections.
+Keep CONN_MAX_AGE at 0: connections then go back to the pool at the end of
+each request, which is what makes the pool safe under ASGI, where the
+thread running a request isn't the one that will run the next.
+"""
+
+from django.db.backends.postgresql import base, creation
+
+from psys.db import pool
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # idle connections would keep the test database from being dropped
+        pool.close_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    @property
+    def pool(self) -> pool.ConnectionPool:
+        params = self.get_connection_params()
+        return pool.get_pool(
+            (self.alias, repr(sorted(params.items()))),
+            pool.PoolConfig.from_options(
+                self.settings_dict['OPTIONS'].get('pool') or {}
+            ),
+        )
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pool', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        # kept, so the connection goes back where it came from even if the
+        # settings change meanwhile, as they do around test databases
+        self.connection_pool = self.pool
+        return self.connection_pool.getconn(
+            lambda: super(DatabaseWrapper, self).get_new_connection(
+                conn_params
+            )
+        )
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.connection_pool.putconn(self.connection)
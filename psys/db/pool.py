@@ -0,0 +1,224 @@
+"""
+Process-wide pool of PostgreSQL connections.
+
+Django opens and closes a connection per thread, and with CONN_MAX_AGE set
+to 0 once per request, so every request pays for a new backend process on
+the server. The pool keeps closed connections around instead, hands them to
+whichever thread asks next, and caps how many this process ever opens at
+once, so a burst waits for a connection instead of exhausting the server's
+max_connections.
+
+One pool lives in each process, shared by every thread; under ASGI that
+includes the threads of sync_to_async. A pool inherited through fork is
+never reused, since its sockets belong to the parent.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import psycopg2
+from django.db import DatabaseError
+from psycopg2 import extensions
+
+
+class PoolTimeout(DatabaseError):
+    pass
+
+
+@dataclass(frozen=True)
+class PoolConfig:
+    min_size: int = 0
+    max_size: int = 10
+    # seconds an idle connection is kept above min_size
+    max_idle: float = 300.0
+    # seconds to wait for a connection once max_size are in use
+    timeout: float = 30.0
+    # runs a query on every connection handed out
+    check: bool = True
+
+    @classmethod
+    def from_options(cls, options: dict) -> 'PoolConfig':
+        config = cls(
+            **{name.lower(): value for name, value in options.items()}
+        )
+        if not 0 <= config.min_size <= config.max_size or config.max_size < 1:
+            raise ValueError(
+                'Pool sizes must satisfy 0 <= min_size <= max_size, 1 <= max_size'
+            )
+        return config
+
+
+class ConnectionPool:
+    def __init__(self, config: PoolConfig):
+        self.config = config
+        self.pid = os.getpid()
+        # (connection, returned at), most recently returned last
+        self.idle = deque()
+        self.size = 0
+        self.condition = threading.Condition()
+        self.stats = {
+            'requests': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'wait_time': 0.0,
+            'connections_opened': 0,
+            'connections_closed': 0,
+            'checks_failed': 0,
+        }
+
+    def getconn(self, connect):
+        """
+        Hands out an idle connection, or one made by `connect` while under
+        max_size, waiting up to `timeout` seconds for either otherwise.
+        """
+        started = time.monotonic()
+        deadline = started + self.config.timeout
+        with self.condition:
+            self.stats['requests'] += 1
+            waited = False
+            while True:
+                self.expire()
+                if self.idle:
+                    connection, _ = self.idle.pop()
+                    break
+                if self.size < self.config.max_size:
+                    self.size += 1
+                    connection = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats['timeouts'] += 1
+                    raise PoolTimeout(
+                        f'No connection available within {self.config.timeout} '
+                        f'seconds, all {self.config.max_size} are in use'
+                    )
+                if not waited:
+                    waited = True
+                    self.stats['waits'] += 1
+                self.condition.wait(remaining)
+            if waited:
+                self.stats['wait_time'] += time.monotonic() - started
+
+        if connection is not None and self.config.check:
+            if self.healthy(connection):
+                return connection
+            with self.condition:
+                self.stats['checks_failed'] += 1
+            self.discard(connection, release=False)
+            connection = None
+        if connection is None:
+            try:
+                connection = connect()
+            except BaseException:
+                self.release()
+                raise
+            with self.condition:
+                self.stats['connections_opened'] += 1
+        return connection
+
+    def putconn(self, connection):
+        # a connection given back mid-transaction, or in a state that can't
+        # be told, isn't handed out again
+        try:
+            if connection.closed:
+                raise psycopg2.InterfaceError
+            if (
+                connection.info.transaction_status
+                != extensions.TRANSACTION_STATUS_IDLE
+            ):
+                connection.rollback()
+            if not connection.autocommit:
+                connection.autocommit = True
+            with connection.cursor() as cursor:
+                # drops what the session set up: settings, held cursors,
+                # temporary tables, advisory locks
+                cursor.execute('DISCARD ALL')
+        except psycopg2.Error:
+            self.discard(connection)
+            return
+
+        with self.condition:
+            if os.getpid() != self.pid:
+                return
+            self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    def healthy(self, connection) -> bool:
+        if connection.closed:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except psycopg2.Error:
+            return False
+
+    def discard(self, connection, release=True):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+        with self.condition:
+            self.stats['connections_closed'] += 1
+        if release:
+            self.release()
+
+    def release(self):
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def expire(self):
+        # called with the condition held; oldest connections are first
+        now = time.monotonic()
+        while (
+            self.idle
+            and self.size > self.config.min_size
+            and now - self.idle[0][1] > self.config.max_idle
+        ):
+            connection, _ = self.idle.popleft()
+            self.size -= 1
+            self.stats['connections_closed'] += 1
+            connection.close()
+
+    def close(self):
+        # closes the idle connections; those in use are closed when returned
+        with self.condition:
+            while self.idle:
+                connection, _ = self.idle.popleft()
+                self.size -= 1
+                self.stats['connections_closed'] += 1
+                connection.close()
+
+    def get_stats(self) -> dict:
+        with self.condition:
+            return {
+                **self.stats,
+                'pool_min': self.config.min_size,
+                'pool_max': self.config.max_size,
+                'pool_size': self.size,
+                'pool_available': len(self.idle),
+            }
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(key, config: PoolConfig) -> ConnectionPool:
+    pid = os.getpid()
+    with pools_lock:
+        pool = pools.get(key)
+        if pool is None or pool.pid != pid:
+            pool = pools[key] = ConnectionPool(config)
+        return pool
+
+
+def close_pools():
+    with pools_lock:
+        for pool in pools.values():
+            if pool.pid == os.getpid():
+                pool.close()
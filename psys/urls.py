@@ -21,15 +21,18 @@ from django.contrib import admin
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from trees.urls import async_urlpatterns as tree_async_urlpatterns
 from trees.urls import router as tree_router
-from trees.views import LoginView
+from trees.views import LoginView, TokenView
 
 router = DefaultRouter()
 router.registry.extend(tree_router.registry)
 
 urlpatterns = [
+    path('', include(tree_async_urlpatterns)),
     path('', include(router.urls)),
     path('admin/', admin.site.urls),
     path('login/', LoginView.as_view(), name='login'),
     path('logout/', LoginView.as_view(), name='logout'),
+    path('token/', TokenView.as_view(), name='token'),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
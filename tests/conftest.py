@@ -3,6 +3,12 @@ import pytest
 from trees.models import Account, Profile, Tree, User
 
 
+@pytest.fixture(autouse=True)
+def primary_only(settings):
+    # tests that read from the replica ask for it, and list it in databases
+    settings.DATABASE_REPLICAS = []
+
+
 @pytest.fixture(autouse=True)
 def load_db(db):
     zeus = User.objects.create_user(username='Zeus', password='Olympus')
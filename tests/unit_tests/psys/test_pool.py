@@ -0,0 +1,49 @@
+import psycopg2
+import pytest
+from django.db import connection
+
+from psys.db.pool import ConnectionPool, PoolConfig, PoolTimeout
+
+
+def connect():
+    # a plain connection, not drawn from the pool of the test database
+    return psycopg2.connect(**connection.get_connection_params())
+
+
+@pytest.mark.django_db
+def test_pool_reuses_connections():
+    pool = ConnectionPool(PoolConfig(max_size=2))
+
+    first = pool.getconn(connect)
+    pool.putconn(first)
+    second = pool.getconn(connect)
+
+    assert second is first
+    assert pool.get_stats()['connections_opened'] == 1
+
+    second.close()
+    pool.putconn(second)
+    third = pool.getconn(connect)
+
+    assert third is not first
+    assert not third.closed
+    pool.putconn(third)
+    pool.close()
+    assert pool.get_stats()['pool_size'] == 0
+
+
+@pytest.mark.django_db
+def test_pool_waits_then_times_out():
+    pool = ConnectionPool(PoolConfig(max_size=1, timeout=0.1, check=False))
+
+    busy = pool.getconn(connect)
+    with pytest.raises(PoolTimeout):
+        pool.getconn(connect)
+
+    stats = pool.get_stats()
+    assert stats['waits'] == 1
+    assert stats['timeouts'] == 1
+    assert stats['pool_size'] == 1
+
+    pool.putconn(busy)
+    pool.close()
@@ -1,10 +1,20 @@
 from datetime import datetime, timedelta, timezone
+from io import StringIO
 
 import pytest
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.management import call_command
 from django.urls import reverse
 
-from trees.models import Account
+from trees.models import (
+    Account,
+    ArchivedPlantedTree,
+    PlantedTree,
+    PlantedTreeCluster,
+    PlantedTreeVersion,
+    Tree,
+    User,
+)
 
 
 @pytest.mark.django_db
@@ -97,6 +107,113 @@ def test_account_viewset_delete(client, django_user_model):
     client.force_login(user)
     response = client.delete(url)
 
-    assert response.status_code == 204
+    # marked right away, removed with its plantings by the purge
+    assert response.status_code == 202
+    assert not Account.objects.get(id=alpha.id).active
+    assert client.get(url).status_code == 404
+    client.force_login(User.objects.get(username='Zeus'))
+    own = client.get(reverse('plantedtree-own')).json()
+    assert own['results'] == []
+    assert not PlantedTree.objects.live().filter(account_id=alpha.id).exists()
+
+    out = StringIO()
+    call_command('purge_deleted', batch_size=1, stdout=out)
+
+    assert 'Purged 1 accounts and 0 users, with 2 planted trees.' in (
+        out.getvalue()
+    )
     with pytest.raises(ObjectDoesNotExist):
         Account.objects.get(id=alpha.id)
+    assert not PlantedTree.objects.filter(account_id=alpha.id).exists()
+    assert Tree.objects.get(name='Olive').planted_count == 0
+    assert User.objects.get(username='Zeus').planted_count == 0
+
+
+@pytest.mark.django_db
+def test_inactive_account_plantings_are_archived(client, settings):
+    settings.ARCHIVE_AFTER_DAYS = 0
+    zeus = User.objects.get(username='Zeus')
+    gods = Account.objects.get(name='Gods')
+    gods.active = False
+    gods.save()
+
+    gods.refresh_from_db()
+    assert gods.deactivated_at is not None
+    assert PlantedTree.objects.live().count() == 1
+    # hidden right away, flagged in the background
+    assert PlantedTree.objects.filter(account_active=True).count() == 3
+    client.force_login(zeus)
+    assert client.get(reverse('plantedtree-own')).json()['results'] == []
+
+    out = StringIO()
+    call_command('archive_plantings', batch_size=1, stdout=out)
+
+    assert 'Archived 2 planted trees, restored 0.' in out.getvalue()
+    assert not PlantedTree.objects.filter(account=gods).exists()
+    assert ArchivedPlantedTree.objects.filter(account=gods).count() == 2
+    assert Account.objects.get(id=gods.id).planted_count == 0
+
+    gods.active = True
+    gods.save()
+    out = StringIO()
+    call_command('archive_plantings', stdout=out)
+
+    assert 'Archived 0 planted trees, restored 2.' in out.getvalue()
+    assert PlantedTree.objects.live().filter(account=gods).count() == 2
+    assert not ArchivedPlantedTree.objects.exists()
+    assert Account.objects.get(id=gods.id).planted_count == 2
+    assert len(client.get(reverse('plantedtree-own')).json()['results']) == 1
+
+
+@pytest.mark.django_db
+def test_account_plantings_are_flagged_in_the_background(client):
+    zeus = User.objects.get(username='Zeus')
+    gods = Account.objects.get(name='Gods')
+    clusters = list(PlantedTreeCluster.objects.values().order_by('id'))
+    version = PlantedTreeVersion.objects.get(
+        scope=PlantedTreeVersion.USER, owner_id=zeus.id
+    ).version
+    gods.active = False
+    gods.save()
+
+    # the listings of its Users change at once
+    assert (
+        PlantedTreeVersion.objects.get(
+            scope=PlantedTreeVersion.USER, owner_id=zeus.id
+        ).version
+        > version
+    )
+    out = StringIO()
+    call_command('archive_plantings', batch_size=1, stdout=out)
+
+    assert 'Flagged 2 planted trees.' in out.getvalue()
+    assert not PlantedTree.objects.filter(
+        account=gods, account_active=True
+    ).exists()
+    assert list(PlantedTreeCluster.objects.values().order_by('id')) == clusters
+
+    gods.active = True
+    gods.save()
+    client.force_login(zeus)
+    assert client.get(reverse('plantedtree-own')).json()['results'] == []
+    out = StringIO()
+    call_command('archive_plantings', stdout=out)
+
+    assert 'Flagged 2 planted trees.' in out.getvalue()
+    assert PlantedTree.objects.live().filter(account=gods).count() == 2
+    assert len(client.get(reverse('plantedtree-own')).json()['results']) == 1
+    out = StringIO()
+    call_command('archive_plantings', stdout=out)
+    assert 'Flagged 0 planted trees.' in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_account_viewset_sparse_fields(client):
+    url = reverse('account-list')
+
+    response = client.get(url, data={'fields': 'name,planted_count'})
+
+    assert response.json() == [
+        {'name': 'Gods', 'planted_count': 2},
+        {'name': 'Humans', 'planted_count': 1},
+    ]
@@ -1,11 +1,43 @@
-from datetime import datetime, timedelta, timezone
+import asyncio
+import csv
+import json
+import re
+from datetime import date, datetime, timedelta, timezone
+from io import StringIO
+from pathlib import Path
+from random import uniform
 
 import pytest
+import rest_framework
+from asgiref.sync import async_to_sync
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connections
 from django.forms import model_to_dict
-from django.urls import reverse
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
 
-from trees.models import Account, PlantedTree, Tree, User
+from trees import (
+    heatmaps,
+    memberships,
+    nearest,
+    partitions,
+    points,
+    routers,
+    spatial,
+    views,
+)
+from trees.management.commands import import_plantings
+from trees.models import (
+    Account,
+    AuthToken,
+    PlantedTree,
+    PlantingRollup,
+    Tree,
+    User,
+)
+from trees.nearest import PointIndex
+from trees.serializers import PlantedTreeSerializer
 
 
 @pytest.mark.django_db
@@ -48,6 +80,11 @@ def test_planted_tree_viewset_get_tree(client):
     response = client.get(url)
 
     assert response.status_code == 200
+    # bookkeeping columns stay internal
+    assert not {'cell', 'account_active'} & set(response.json())
+    assert not {'deactivated_at', 'deleted_at'} & set(
+        response.json()['account']
+    )
 
 
 @pytest.mark.django_db
@@ -170,7 +207,7 @@ def test_list_plants_from_current_user(client):
         model_to_dict(tree)
         for tree in PlantedTree.objects.filter(user__username='Zeus').all()
     ]
-    results = response.json()
+    results = response.json().get('results')
     for tree, result in zip(trees, results):
         assert tree.get('id') == result.get('id')
 
@@ -190,7 +227,7 @@ def test_list_plants_from_account(client):
         model_to_dict(tree)
         for tree in PlantedTree.objects.filter(account__name=user_account.name)
     ]
-    results = response.json()
+    results = response.json().get('results')
     for tree, result in zip(trees, results):
         assert tree.get('id') == result.get('id')
 
@@ -206,3 +243,1219 @@ def test_list_plants_from_another_account(client):
     response = client.get(url, data={'account': another_account.name})
 
     assert response.status_code == 403
+
+
+@pytest.mark.django_db
+def test_list_plants_from_account_conditionally(client):
+    user = User.objects.get(username='Zeus')
+    account = Account.objects.get(name='Gods')
+    olive = Tree.objects.get(name='Olive')
+    client.force_login(user)
+
+    url = reverse('plantedtree-account')
+    data = {'account': 'Gods'}
+
+    response = client.get(url, data=data)
+
+    assert response.status_code == 200
+    etag = response['ETag']
+
+    response = client.get(url, data=data, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    # other pages and projections don't share it
+    for variant in ({'fields': 'id'}, {'expand': 'tree'}, {'limit': 1}):
+        response = client.get(
+            url, data={**data, **variant}, HTTP_IF_NONE_MATCH=etag
+        )
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+
+    # every write path bumps the counter, bulk and queryset ones included
+    user.plant_trees(account, [(olive, (40.01, 22.01))])
+    response = client.get(url, data=data, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    etag = response['ETag']
+
+    PlantedTree.objects.filter(account=account).update(tree=olive)
+    response = client.get(url, data=data, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert len(response.json().get('results')) == 3
+
+    # users' listings are versioned on their own, unless they render the
+    # Trees, Users and Accounts that other plantings count in
+    url = reverse('user-planted', kwargs={'pk': user.id})
+    data = {'fields': 'id,planted_at,location'}
+    response = client.get(url, data=data)
+    last_modified = response['Last-Modified']
+    nested = client.get(url)
+
+    response = client.get(url, data=data, HTTP_IF_MODIFIED_SINCE=last_modified)
+    assert response.status_code == 304
+
+    PlantedTree.objects.filter(user__username='Odin').delete()
+    response = client.get(url, data=data, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 304
+    response = client.get(url, HTTP_IF_NONE_MATCH=nested['ETag'])
+    assert response.status_code == 200
+    nested = response
+
+    olive.name = 'Wild olive'
+    olive.save()
+    response = client.get(url, HTTP_IF_NONE_MATCH=nested['ETag'])
+    assert response.status_code == 200
+    assert response.json()['results'][0]['tree']['name'] == 'Wild olive'
+
+
+@pytest.mark.django_db
+def test_planted_tree_viewset_bulk(client, django_assert_max_num_queries):
+    user = User.objects.get(username='Zeus')
+    account = Account.objects.get(name='Gods')
+    trees = list(Tree.objects.all())
+    data = [
+        {
+            'tree_id': trees[i % len(trees)].id,
+            'user_id': user.id,
+            'account_id': account.id,
+            'latitude': -22.0123,
+            'longitude': -47.8908,
+        }
+        for i in range(30)
+    ]
+    url = reverse('plantedtree-bulk')
+
+    client.force_login(user)
+    with django_assert_max_num_queries(12):
+        response = client.post(url, data=data, content_type='application/json')
+
+    assert response.status_code == 201
+    results = response.json()
+    assert len(results) == 30
+    assert all(result.get('status') == 'created' for result in results)
+    assert PlantedTree.objects.filter(user=user).count() == 31
+
+
+@pytest.mark.django_db
+def test_planted_tree_viewset_bulk_with_failed(client):
+    user = User.objects.get(username='Zeus')
+    gods = Account.objects.get(name='Gods')
+    humans = Account.objects.get(name='Humans')
+    tree = Tree.objects.get(name='Olive')
+    item = {'tree_id': tree.id, 'user_id': user.id, 'account_id': gods.id}
+    data = [
+        item,
+        {**item, 'account_id': humans.id},
+        {**item, 'tree_id': 0},
+        {**item, 'latitude': 'north'},
+    ]
+    url = reverse('plantedtree-bulk')
+
+    client.force_login(user)
+    response = client.post(url, data=data, content_type='application/json')
+
+    # nothing is planted unless partial success is allowed
+    assert response.status_code == 400
+    statuses = [result.get('status') for result in response.json()]
+    assert statuses == ['skipped', 'failed', 'failed', 'failed']
+    assert PlantedTree.objects.filter(user=user).count() == 1
+
+    response = client.post(
+        f'{url}?partial=true', data=data, content_type='application/json'
+    )
+
+    assert response.status_code == 207
+    results = response.json()
+    assert results[0].get('status') == 'created'
+    assert 'account_id' in results[1].get('errors')
+    assert 'tree_id' in results[2].get('errors')
+    assert 'latitude' in results[3].get('errors')
+    assert PlantedTree.objects.filter(user=user).count() == 2
+
+
+@pytest.mark.django_db
+def test_planted_tree_viewset_bulk_for_another_user(client):
+    user = User.objects.get(username='Zeus')
+    odin = User.objects.get(username='Odin')
+    account = Account.objects.get(name='Gods')
+    tree = Tree.objects.get(name='Olive')
+    data = [{'tree_id': tree.id, 'user_id': odin.id, 'account_id': account.id}]
+    url = reverse('plantedtree-bulk')
+
+    client.force_login(user)
+    response = client.post(url, data=data, content_type='application/json')
+
+    assert response.status_code == 400
+    assert 'user_id' in response.json()[0].get('errors')
+
+
+@pytest.mark.django_db
+def test_list_plants_with_cursor_pagination(client):
+    user = User.objects.get(username='Zeus')
+    account = Account.objects.get(name='Gods')
+    tree = Tree.objects.get(name='Olive')
+    user.plant_trees(account, [(tree, (10.0, 20.0))] * 6)
+    expected = list(
+        PlantedTree.objects.filter(user=user)
+        .order_by('planted_at', 'id')
+        .values_list('id', flat=True)
+    )
+    client.force_login(user)
+
+    url = reverse('plantedtree-own')
+
+    pages, next_url = [], f'{url}?limit=3'
+    while next_url:
+        response = client.get(next_url)
+        assert response.status_code == 200
+        pages.append([tree.get('id') for tree in response.json()['results']])
+        next_url = response.json().get('next')
+
+    assert pages == [expected[:3], expected[3:6], expected[6:]]
+
+    response = client.get(response.json().get('previous'))
+    assert [tree.get('id') for tree in response.json()['results']] == (
+        expected[3:6]
+    )
+
+    response = client.get(url, data={'cursor': 'not-a-cursor'})
+    assert response.status_code == 404
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('planted', [1, 20])
+def test_list_plants_takes_constant_queries(
+    client, django_assert_num_queries, planted
+):
+    user = User.objects.get(username='Zeus')
+    account = Account.objects.get(name='Gods')
+    tree = Tree.objects.get(name='Olive')
+    user.plant_trees(account, [(tree, (10.0, 20.0))] * (planted - 1))
+    client.force_login(user)
+
+    url = reverse('plantedtree-own')
+
+    # session, user, planted trees joined to their relations, user accounts
+    with django_assert_num_queries(4):
+        response = client.get(url)
+
+    assert len(response.json().get('results')) == planted
+
+
+@pytest.mark.django_db
+def test_export_plants_from_account(client):
+    user = User.objects.get(username='Zeus')
+    client.force_login(user)
+    expected = list(
+        PlantedTree.objects.filter(account__name='Gods')
+        .order_by('planted_at', 'id')
+        .values_list('id', flat=True)
+    )
+
+    url = reverse('plantedtree-export')
+
+    response = client.get(url, data={'account': 'Gods'})
+
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'application/x-ndjson'
+    lines = b''.join(response.streaming_content).decode().splitlines()
+    rows = [json.loads(line) for line in lines]
+    assert [row.get('id') for row in rows] == expected
+    assert rows[0].get('account_name') == 'Gods'
+
+    response = client.get(url, data={'account': 'Gods', 'output': 'csv'})
+
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'text/csv'
+    content = b''.join(response.streaming_content).decode()
+    rows = list(csv.DictReader(content.splitlines()))
+    assert [int(row.get('id')) for row in rows] == expected
+
+
+@pytest.mark.django_db
+def test_export_plants_from_another_account(client):
+    user = User.objects.get(username='Zeus')
+    client.force_login(user)
+
+    url = reverse('plantedtree-export')
+
+    response = client.get(url, data={'account': 'Humans'})
+    assert response.status_code == 403
+
+    response = client.get(url, data={'account': 'Gods', 'output': 'xml'})
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_list_plants_from_account_as_points(client):
+    user = User.objects.get(username='Zeus')
+    client.force_login(user)
+
+    url = reverse('plantedtree-account')
+
+    response = client.get(
+        url, data={'account': 'Gods'}, HTTP_ACCEPT=points.MEDIA_TYPE
+    )
+
+    assert response.status_code == 200
+    assert response['Content-Type'] == points.MEDIA_TYPE
+    planted_trees = PlantedTree.objects.filter(account__name='Gods').order_by(
+        'planted_at', 'id'
+    )
+    columns = points.parse_points(response.content)
+    assert list(columns['id']) == [tree.id for tree in planted_trees]
+    assert list(columns['tree_id']) == [tree.tree_id for tree in planted_trees]
+    assert list(columns['latitude']) == pytest.approx(
+        [float(tree.latitude) for tree in planted_trees]
+    )
+    assert list(columns['longitude']) == pytest.approx(
+        [float(tree.longitude) for tree in planted_trees]
+    )
+    assert len(response.content) == points.HEADER.size + 2 * 20
+    assert not response.has_header('Link')
+
+    # paged by the same cursors as the JSON, linked from the headers
+    response = client.get(
+        url,
+        data={'account': 'Gods', 'limit': 1},
+        HTTP_ACCEPT=points.MEDIA_TYPE,
+    )
+    assert list(points.parse_points(response.content)['id']) == [
+        planted_trees[0].id
+    ]
+    next_url = response['Link'].partition('>; rel="next"')[0].lstrip('<')
+    json_next = client.get(url, data={'account': 'Gods', 'limit': 1}).json()
+    assert next_url == json_next['next']
+    response = client.get(next_url, HTTP_ACCEPT=points.MEDIA_TYPE)
+    assert list(points.parse_points(response.content)['id']) == [
+        planted_trees[1].id
+    ]
+    assert 'rel="next"' not in response['Link']
+    previous_url = response['Link'].partition('>; rel="prev"')[0].lstrip('<')
+    response = client.get(previous_url, HTTP_ACCEPT=points.MEDIA_TYPE)
+    assert list(points.parse_points(response.content)['id']) == [
+        planted_trees[0].id
+    ]
+
+    # errors are still answered in JSON
+    response = client.get(
+        url, data={'account': 'Humans'}, HTTP_ACCEPT=points.MEDIA_TYPE
+    )
+    assert response.status_code == 403
+    assert response.json().get('error')
+
+
+@pytest.mark.django_db(transaction=True)
+def test_export_plants_under_asgi(async_client):
+    user = User.objects.get(username='Zeus')
+    url = reverse('plantedtree-export')
+
+    async def export():
+        await async_client.aforce_login(user)
+        response = await async_client.get(url, data={'account': 'Gods'})
+        return response, [chunk async for chunk in response]
+
+    response, chunks = async_to_sync(export)()
+
+    assert response.status_code == 200
+    lines = b''.join(chunks).decode().splitlines()
+    assert (
+        len(lines) == PlantedTree.objects.filter(account__name='Gods').count()
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+def test_list_plants_under_asgi(async_client):
+    user = User.objects.get(username='Zeus')
+    _, key = AuthToken.issue(user)
+    headers = {'Authorization': f'Token {key}'}
+    own_url = reverse('plantedtree-own')
+    account_url = reverse('plantedtree-account')
+    profile_url = reverse('profile-detail', args=[user.id])
+    # like UserViewSet, deleted users aren't found
+    odin = User.objects.get(username='Odin')
+    odin.deleted_at = datetime.now(timezone.utc)
+    odin.save()
+    deleted_url = reverse('user-planted', args=[odin.id])
+
+    # served natively, without holding a thread for the request
+    assert asyncio.iscoroutinefunction(resolve(own_url).func)
+
+    async def fetch():
+        own = await async_client.get(own_url, headers=headers)
+        account = await async_client.get(
+            account_url, data={'account': 'Gods'}, headers=headers
+        )
+        forbidden = await async_client.get(
+            account_url, data={'account': 'Humans'}, headers=headers
+        )
+        packed = await async_client.get(
+            own_url, headers={**headers, 'Accept': points.MEDIA_TYPE}
+        )
+        deleted = await async_client.get(deleted_url, headers=headers)
+        await async_client.aforce_login(user)
+        profile = await async_client.get(profile_url)
+        return own, account, forbidden, packed, deleted, profile
+
+    own, account, forbidden, packed, deleted, profile = async_to_sync(fetch)()
+
+    assert own.status_code == 200
+    assert [tree.get('id') for tree in own.json().get('results')] == list(
+        PlantedTree.objects.filter(user=user).values_list('id', flat=True)
+    )
+    assert len(account.json().get('results')) == 2
+    assert account['ETag']
+    assert forbidden.status_code == 403
+    assert forbidden.json() == views.not_a_member().data
+    assert deleted.status_code == 404
+    assert list(points.parse_points(packed.content)['id']) == [
+        tree.get('id') for tree in own.json().get('results')
+    ]
+    assert profile.json().get('user').get('username') == 'Zeus'
+
+
+@pytest.mark.django_db
+def test_import_plantings_from_csv(tmp_path):
+    plantings = tmp_path / 'plantings.csv'
+    plantings.write_text(
+        'user,account,tree,latitude,longitude,planted_at\n'
+        'Zeus,Gods,Olive,10.5,20.25,2020-01-02T03:04:05+00:00\n'
+        'Zeus,Gods,Stone pine,-10.1234567,-20,\n'
+        'Zeus,Humans,Olive,10,20,\n'
+        'Zeus,Gods,Baobab,10,20,\n'
+        'Nobody,Gods,Olive,10,20,\n'
+        'Zeus,Gods,Olive,north,20,\n'
+        'Zeus,Gods,Olive,95,20,\n'
+        'Zeus,Gods,Olive,10,20,someday\n'
+    )
+    out = StringIO()
+
+    call_command('import_plantings', plantings, batch_size=3, stdout=out)
+
+    assert 'Imported 2 planted trees, rejected 6.' in out.getvalue()
+    imported = PlantedTree.objects.filter(user__username='Zeus').order_by(
+        'id'
+    )[1:]
+    assert [planted.tree.name for planted in imported] == [
+        'Olive',
+        'Stone pine',
+    ]
+    assert imported[0].planted_at == datetime(
+        2020, 1, 2, 3, 4, 5, tzinfo=timezone.utc
+    )
+    assert imported[1].location == (-10.123457, -20.0)
+
+    with open(tmp_path / 'plantings.rejected.csv', newline='') as rejected:
+        rows = list(csv.DictReader(rejected))
+    assert [row.get('line') for row in rows] == ['3', '4', '5', '6', '7', '8']
+    assert all(row.get('error') for row in rows)
+
+
+@pytest.mark.django_db
+def test_import_plantings_from_ndjson(tmp_path):
+    plantings = tmp_path / 'plantings.ndjson'
+    plantings.write_text(
+        '{"user": "Odin", "account": "Gods", "tree": "Olive", '
+        '"latitude": 1.5, "longitude": 2.5}\n'
+        'not json\n'
+        '{"user": "Odin", "account": "Gods", "tree": "Olive", '
+        '"latitude": 3, "longitude": 4, "planted_at": "2021-05-06"}\n'
+    )
+    out = StringIO()
+
+    call_command('import_plantings', plantings, stdout=out)
+
+    assert 'Imported 2 planted trees, rejected 1.' in out.getvalue()
+    assert PlantedTree.objects.filter(user__username='Odin').count() == 3
+
+
+@pytest.mark.django_db(transaction=True)
+def test_import_plantings_commits_each_batch(tmp_path, monkeypatch):
+    odin = User.objects.get(username='Odin')
+    odin.delete_later()
+    plantings = tmp_path / 'plantings.csv'
+    plantings.write_text(
+        'user,account,tree,latitude,longitude\n'
+        'Zeus,Gods,Olive,1,1\n'
+        'Odin,Gods,Olive,2,2\n'
+        'Zeus,Gods,Olive,3,3\n'
+    )
+    insert_batch = import_plantings.Command.insert_batch
+
+    def failing_batch(self, cursor, start, end):
+        if start:
+            raise DatabaseError('connection lost')
+        return insert_batch(self, cursor, start, end)
+
+    monkeypatch.setattr(
+        import_plantings.Command, 'insert_batch', failing_batch
+    )
+
+    with pytest.raises(CommandError) as error:
+        call_command('import_plantings', plantings, batch_size=2)
+
+    assert str(error.value) == (
+        'Lines 3 to 3 failed: connection lost. '
+        'Imported 1 planted trees before them, rejected 1.'
+    )
+    # the batches before it stay imported
+    assert PlantedTree.objects.filter(latitude=1).exists()
+    with open(tmp_path / 'plantings.rejected.csv', newline='') as rejected:
+        rows = list(csv.DictReader(rejected))
+    # Users pending purge can't plant, like through the API
+    assert [(row['line'], row['error']) for row in rows] == [
+        ('2', 'This User is inactive.')
+    ]
+    serializer = PlantedTreeSerializer(
+        data={
+            'tree_id': Tree.objects.get(name='Olive').id,
+            'user_id': odin.id,
+            'account_id': Account.objects.get(name='Gods').id,
+        }
+    )
+    assert not serializer.is_valid()
+    assert 'user_id' in serializer.errors
+
+
+@pytest.mark.django_db
+def test_planted_trees_have_spatial_cell():
+    zeus = User.objects.get(username='Zeus')
+    olive = Tree.objects.get(name='Olive')
+
+    result = zeus.plant_trees(zeus.accounts.first(), [(olive, (10.5, 20.5))])
+    planted = PlantedTree.objects.get(id=result.get('success')[0].id)
+    assert planted.cell == spatial.cell(planted.latitude, planted.longitude)
+
+    PlantedTree.objects.filter(id=planted.id).update(latitude=-33.9)
+    planted.refresh_from_db()
+    assert planted.cell == spatial.cell(planted.latitude, planted.longitude)
+
+
+@pytest.mark.django_db
+def test_cell_ranges_cover_bounding_box():
+    bbox = (-10.0, 20.0, 15.0, 35.0)
+    ranges = spatial.cell_ranges(*bbox)
+
+    assert 0 < len(ranges) <= spatial.MAX_RANGES
+    for _ in range(500):
+        lat, lon = uniform(bbox[0], bbox[2]), uniform(bbox[1], bbox[3])
+        cell = spatial.cell(lat, lon)
+        assert any(start <= cell <= end for start, end in ranges)
+
+
+@pytest.mark.django_db
+def test_list_plants_within_bounding_box(client):
+    user = User.objects.get(username='Zeus')
+    account = Account.objects.get(name='Gods')
+    olive = Tree.objects.get(name='Olive')
+    user.plant_trees(
+        account,
+        [
+            (olive, (-22.9, -43.2)),
+            (olive, (-23.5, -46.6)),
+            (olive, (48.8, 2.3)),
+        ],
+    )
+    client.force_login(user)
+
+    url = reverse('plantedtree-within')
+
+    response = client.get(url, data={'bbox': '-50,-25,-40,-20'})
+
+    assert response.status_code == 200
+    locations = [tree.get('location') for tree in response.json()['results']]
+    assert sorted(locations) == [[-23.5, -46.6], [-22.9, -43.2]]
+
+    # Francis's tree in Rome belongs to an account Zeus isn't part of
+    response = client.get(url, data={'bbox': '0,30,30,70'})
+    locations = [tree.get('location') for tree in response.json()['results']]
+    assert sorted(locations) == [
+        [40.0834, 22.3499],
+        [48.8, 2.3],
+        [63.0106, 8.2941],
+    ]
+
+    # crossing the antimeridian
+    response = client.get(url, data={'bbox': '170,-90,10,90'})
+    assert len(response.json()['results']) == 4
+
+    response = client.get(url, data={'bbox': '10,20'})
+    assert response.status_code == 400
+
+
+def test_point_index_matches_brute_force():
+    points = [
+        (pk, uniform(-90, 90), uniform(-180, 180)) for pk in range(1, 3001)
+    ]
+    index = PointIndex(points)
+    index.remove(1)
+    index.add(2, 0.0, 0.0)
+    index.add(5000, 0.1, 0.1)
+    expected_points = {pk: (lat, lon) for pk, lat, lon in points}
+    del expected_points[1]
+    expected_points[2] = (0.0, 0.0)
+    expected_points[5000] = (0.1, 0.1)
+
+    for latitude, longitude in [(0, 0), (89.9, 179.9), (-45, -179.99)]:
+        found = index.nearest(latitude, longitude, 10)
+        expected = sorted(
+            (nearest.distance((latitude, longitude), location), pk)
+            for pk, location in expected_points.items()
+        )[:10]
+        assert [pk for _, pk in found] == [pk for _, pk in expected]
+        assert [meters for meters, _ in found] == pytest.approx(
+            [meters for meters, _ in expected]
+        )
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('backend', ['memory', 'sql'])
+def test_list_nearest_plants(
+    client, settings, monkeypatch, backend, django_capture_on_commit_callbacks
+):
+    settings.NEAREST_BACKEND = backend
+    nearest.registry.invalidate()
+    # built right away instead of by the background thread
+    scheduled = []
+    monkeypatch.setattr(
+        nearest.registry,
+        'schedule',
+        lambda account_id: scheduled.append(account_id)
+        or nearest.registry.build(account_id),
+    )
+    user = User.objects.get(username='Zeus')
+    account = Account.objects.get(name='Gods')
+    olive = Tree.objects.get(name='Olive')
+    client.force_login(user)
+
+    url = reverse('plantedtree-nearest')
+
+    response = client.get(url, data={'lat': 40, 'lon': 22, 'k': 2})
+
+    assert response.status_code == 200
+    results = response.json().get('results')
+    # Francis's tree in Rome belongs to an account Zeus isn't part of
+    assert [tree.get('location') for tree in results] == [
+        [40.0834, 22.3499],
+        [63.0106, 8.2941],
+    ]
+    assert results[0].get('distance') < results[1].get('distance')
+    # answered from the database until the indexes are built
+    assert sorted(scheduled) == sorted(
+        memberships.account_ids(user) if backend == 'memory' else []
+    )
+
+    # new plantings are picked up by the index without a rebuild, once
+    # they commit
+    with django_capture_on_commit_callbacks(execute=True):
+        user.plant_trees(account, [(olive, (40.01, 22.01))])
+        PlantedTree.objects.filter(latitude='40.083400').delete()
+
+    response = client.get(url, data={'lat': 40, 'lon': 22, 'k': 2})
+
+    results = response.json().get('results')
+    assert [tree.get('location') for tree in results] == [
+        [40.01, 22.01],
+        [63.0106, 8.2941],
+    ]
+
+    # narrowed down like the other listings
+    response = client.get(
+        url, data={'lat': 40, 'lon': 22, 'k': 1, 'fields': 'id,tree'}
+    )
+    assert list(response.json().get('results')[0]) == [
+        'id',
+        'tree',
+        'distance',
+    ]
+
+    response = client.get(url, data={'lat': 'north', 'lon': 22})
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_nearest_index_replays_changes_made_while_building(
+    monkeypatch, django_capture_on_commit_callbacks
+):
+    nearest.registry.invalidate()
+    gods = Account.objects.get(name='Gods')
+    humans = Account.objects.get(name='Humans')
+    planted = PlantedTree.objects.filter(account=gods).first()
+
+    class PlantedWhileBuilding(PointIndex):
+        def __init__(self, points):
+            super().__init__(points)
+            # committed after the index read the database
+            with django_capture_on_commit_callbacks(execute=True):
+                planted.latitude, planted.longitude = 1, 1
+                planted.save()
+
+    monkeypatch.setattr(nearest, 'PointIndex', PlantedWhileBuilding)
+    index = nearest.registry.build(gods.id)
+    monkeypatch.undo()
+
+    assert index.nearest(1, 1, 1) == [(0, planted.id)]
+
+    # moving a tree drops it from the Account it left
+    with django_capture_on_commit_callbacks(execute=True):
+        planted.account = humans
+        planted.save()
+    assert planted.id not in [pk for _, pk in index.nearest(1, 1, 10)]
+    assert nearest.registry.build(humans.id).nearest(1, 1, 1) == [
+        (0, planted.id)
+    ]
+
+
+@pytest.mark.django_db
+def test_nearest_indexes_are_built_in_the_background_and_capped(
+    settings, monkeypatch
+):
+    nearest.registry.invalidate()
+    gods = Account.objects.get(name='Gods')
+    humans = Account.objects.get(name='Humans')
+    scheduled = []
+    monkeypatch.setattr(nearest.registry, 'schedule', scheduled.append)
+
+    # looked up in the database meanwhile, and scheduled once
+    assert nearest.registry.get(gods.id) is None
+    assert nearest.registry.get(gods.id) is None
+    assert scheduled == [gods.id]
+    found = nearest.registry.nearest([gods.id], 40, 22, 1)
+    assert found == nearest.nearest_sql([gods.id], 40, 22, 1)
+
+    assert nearest.registry.build(gods.id) is nearest.registry.get(gods.id)
+    # the least recently used index goes first
+    settings.NEAREST_MAX_POINTS = PlantedTree.objects.filter(
+        account=humans
+    ).count()
+    nearest.registry.build(humans.id)
+    assert gods.id not in nearest.registry.indexes
+    assert nearest.registry.get(humans.id) is not None
+
+    # and Accounts too large for it are never kept
+    settings.NEAREST_MAX_POINTS = 0
+    assert nearest.registry.build(humans.id) is None
+    assert nearest.registry.get(humans.id) is None
+    # until NEAREST_INDEX_TTL has passed
+    assert scheduled == [gods.id]
+
+
+@pytest.mark.django_db
+def test_list_plant_clusters(client):
+    user = User.objects.get(username='Zeus')
+    account = Account.objects.get(name='Gods')
+    olive = Tree.objects.get(name='Olive')
+    pine = Tree.objects.get(name='Stone pine')
+    user.plant_trees(
+        account,
+        [(olive, (40.1, 22.1)), (olive, (40.2, 22.2)), (pine, (40.3, 22.3))],
+    )
+    client.force_login(user)
+
+    url = reverse('plantedtree-clusters')
+
+    # at zoom 0 the whole world is a single tile
+    response = client.get(url, data={'zoom': 0, 'x': 0, 'y': 0})
+
+    assert response.status_code == 200
+    clusters = response.json().get('clusters')
+    assert sum(cluster.get('count') for cluster in clusters) == 5
+
+    # the XYZ tile around Mount Olympus, with Zeus's trees only
+    x, y = int((22.1 + 180) / 360 * 2**5), spatial.tile_row(40.1, 5)
+    assert (x, y) == (17, 12)
+    response = client.get(url, data={'zoom': 5, 'x': x, 'y': y})
+
+    clusters = response.json().get('clusters')
+    assert len(clusters) == 1
+    assert clusters[0].get('count') == 4
+    assert clusters[0].get('tree').get('name') == 'Olive'
+    assert clusters[0].get('location') == pytest.approx(
+        [
+            (40.0834 + 40.1 + 40.2 + 40.3) / 4,
+            (22.3499 + 22.1 + 22.2 + 22.3) / 4,
+        ]
+    )
+
+    # clusters follow updates and deletes
+    PlantedTree.objects.filter(tree=olive).update(tree=pine)
+    PlantedTree.objects.filter(latitude='40.300000').delete()
+    response = client.get(url, data={'zoom': 5, 'x': x, 'y': y})
+
+    clusters = response.json().get('clusters')
+    assert clusters[0].get('count') == 3
+    assert clusters[0].get('tree').get('name') == 'Stone pine'
+
+    response = client.get(url, data={'zoom': 1, 'x': 2, 'y': 0})
+    assert response.status_code == 400
+
+
+def test_tile_cluster_cells_cover_web_mercator_tiles():
+    for zoom in range(0, spatial.CLUSTER_MAX_ZOOM + 1, 3):
+        for y in {0, 2**zoom // 3, 2**zoom - 1}:
+            (
+                min_latitude,
+                min_longitude,
+                max_latitude,
+                max_longitude,
+            ) = spatial.tile_bounds(zoom, 0, y)
+            cells = set(spatial.tile_cluster_cells(zoom, 0, y))
+            for latitude in (min_latitude + 1e-6, max_latitude - 1e-6):
+                assert spatial.tile_row(latitude, zoom) == y
+                point = spatial.cell(latitude, min_longitude)
+                assert spatial.cluster_cell(point, zoom) in cells
+    # rows are counted from the north
+    assert spatial.tile_row(60, 1) == 0
+    assert spatial.tile_row(-90, 3) == 7
+
+
+@pytest.mark.django_db
+def test_plant_heatmap(client):
+    heatmaps.cache.invalidate()
+    user = User.objects.get(username='Zeus')
+    account = Account.objects.get(name='Gods')
+    olive = Tree.objects.get(name='Olive')
+    client.force_login(user)
+
+    url = reverse('plantedtree-heatmap')
+
+    response = client.get(url, data={'resolution': 2})
+
+    assert response.status_code == 200
+    # Zeus's trees are all in the north-east quarter of the world
+    assert response.json().get('counts') == [[0, 0], [0, 2]]
+
+    # the grid is cached until a planting lands inside it
+    response = client.get(url, data={'resolution': 2, 'tree': olive.id})
+    assert response.json().get('total') == 1
+    assert len(heatmaps.cache.grids) == 2
+
+    user.plant_trees(account, [(olive, (-40, -22))])
+    assert len(heatmaps.cache.grids) == 0
+
+    response = client.get(url, data={'resolution': 2, 'tree': olive.id})
+    assert response.json().get('counts') == [[1, 0], [0, 1]]
+
+    # the box around Mount Olympus, and one across the antimeridian
+    response = client.get(
+        url, data={'resolution': 4, 'bbox': '22,40,23,41', 'account': 'Gods'}
+    )
+    assert response.json().get('total') == 1
+    assert response.json().get('counts')[0][1] == 1
+
+    user.plant_trees(account, [(olive, (0, 179.5)), (olive, (0, -179.5))])
+    response = client.get(url, data={'resolution': 2, 'bbox': '179,-1,-179,1'})
+    assert response.json().get('counts') == [[0, 0], [1, 1]]
+
+    response = client.get(url, data={'resolution': 2, 'account': 'Humans'})
+    assert response.status_code == 403
+
+    response = client.get(url, data={'resolution': 0})
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db(transaction=True, databases=['default', 'replica'])
+def test_list_plants_from_replica(client, settings, monkeypatch):
+    settings.DATABASE_REPLICAS = ['replica']
+    routers.lag.invalidate()
+    user = User.objects.get(username='Zeus')
+    olive = Tree.objects.get(name='Olive')
+    client.force_login(user)
+    url = reverse('plantedtree-own')
+
+    with CaptureQueriesContext(connections['replica']) as replica:
+        response = client.get(url)
+    assert len(response.json().get('results')) == 1
+    assert len(replica) > 0
+
+    # exports stream after the request returned, from the same replica
+    response = client.get(
+        reverse('plantedtree-export'), data={'account': 'Gods'}
+    )
+    with CaptureQueriesContext(connections['replica']) as replica:
+        lines = b''.join(response.streaming_content).splitlines()
+    assert len(lines) == 2
+    assert len(replica) > 0
+
+    # a write pins the client to the primary for a while
+    response = client.post(
+        reverse('plantedtree-list'),
+        data={
+            'tree_id': olive.id,
+            'user_id': user.id,
+            'account_id': Account.objects.get(name='Gods').id,
+            'latitude': 1,
+            'longitude': 1,
+        },
+        content_type='application/json',
+    )
+    assert response.status_code == 201
+    assert response.cookies['primary_pin']['max-age'] == 10
+
+    with CaptureQueriesContext(connections['replica']) as replica:
+        response = client.get(url)
+    assert len(response.json().get('results')) == 2
+    assert len(replica) == 0
+
+    # replicas too far behind are left out
+    del client.cookies['primary_pin']
+    monkeypatch.setattr(routers.lag, 'measure', lambda alias: 60.0)
+    routers.lag.invalidate()
+    with CaptureQueriesContext(connections['replica']) as replica:
+        response = client.get(url)
+    assert response.status_code == 200
+    assert len(replica) == 0
+
+
+@pytest.mark.django_db
+def test_planting_counters(tmp_path):
+    def counts():
+        return (
+            Account.objects.get(name='Gods').planted_count,
+            Tree.objects.get(name='Olive').planted_count,
+            User.objects.get(username='Zeus').planted_count,
+        )
+
+    zeus = User.objects.get(username='Zeus')
+    gods = Account.objects.get(name='Gods')
+    olive = Tree.objects.get(name='Olive')
+    pine = Tree.objects.get(name='Stone pine')
+    assert counts() == (2, 1, 1)
+
+    zeus.plant_tree(gods, olive, (1, 1))
+    zeus.plant_trees(gods, [(olive, (2, 2)), (olive, (3, 3)), (pine, (4, 4))])
+    assert counts() == (6, 4, 5)
+
+    # a copy loaded before the plantings doesn't write its count back
+    zeus.first_name = 'Jupiter'
+    zeus.save()
+    assert counts() == (6, 4, 5)
+
+    planted = PlantedTree.objects.filter(tree=olive).last()
+    planted.tree = pine
+    planted.save()
+    assert counts() == (6, 3, 5)
+    assert Tree.objects.get(name='Stone pine').planted_count == 3
+
+    PlantedTree.objects.filter(tree=pine, user=zeus).delete()
+    assert counts() == (4, 3, 3)
+
+    plantings = tmp_path / 'plantings.csv'
+    plantings.write_text('user,account,tree,latitude,longitude\n')
+    with open(plantings, 'a') as planting_file:
+        planting_file.writelines(['Zeus,Gods,Olive,5,5\n'] * 3)
+    call_command('import_plantings', plantings, stdout=StringIO())
+    assert counts() == (7, 6, 6)
+
+    # cascades count too
+    User.objects.get(username='Odin').delete()
+    assert counts() == (6, 6, 6)
+
+    # paths without signals drift, until repaired
+    PlantedTree.objects.filter(user=zeus).update(tree=pine)
+    out = StringIO()
+    call_command('recount_plantings', stdout=out)
+    assert 'Trees: 2 repaired' in out.getvalue()
+    assert counts() == (6, 0, 6)
+
+
+@pytest.mark.django_db
+def test_planting_counters_are_serialized(client):
+    client.force_login(User.objects.get(username='Zeus'))
+
+    accounts = client.get(reverse('account-list')).json()
+    # left out of the cached catalog, which plantings don't change
+    trees = [
+        client.get(reverse('tree-detail', args=[tree_id])).json()
+        for tree_id in Tree.objects.values_list('id', flat=True)
+    ]
+    user = client.get(
+        reverse('user-detail', args=[User.objects.get(username='Zeus').id])
+    ).json()
+
+    assert {
+        account.get('name'): account.get('planted_count')
+        for account in accounts
+    } == {'Gods': 2, 'Humans': 1}
+    assert all(tree.get('planted_count') == 1 for tree in trees)
+    assert user.get('planted_count') == 1
+
+
+@pytest.mark.django_db
+def test_plant_stats(client):
+    zeus = User.objects.get(username='Zeus')
+    gods = Account.objects.get(name='Gods')
+    olive = Tree.objects.get(name='Olive')
+    spruce = Tree.objects.get(name='Norway spruce')
+    PlantedTree.objects.all().delete()
+    for day, tree in [(1, olive), (1, olive), (2, spruce), (9, olive)]:
+        PlantedTree.objects.create(
+            user=zeus,
+            account=gods,
+            tree=tree,
+            planted_at=datetime(2024, 1, day, 12, tzinfo=timezone.utc),
+        )
+    planted_spruce = PlantedTree.objects.filter(tree=spruce).get()
+    client.force_login(zeus)
+    url = reverse('plantedtree-stats')
+
+    response = client.get(
+        url, data={'since': '2024-01-01', 'until': '2024-01-03'}
+    )
+
+    assert response.json().get('buckets') == [
+        '2024-01-01',
+        '2024-01-02',
+        '2024-01-03',
+    ]
+    assert response.json().get('series') == [{'counts': [2, 1, 0]}]
+
+    # weeks start on Mondays, and rollups follow moves and deletes
+    planted_spruce.planted_at = datetime(2024, 1, 10, tzinfo=timezone.utc)
+    planted_spruce.save()
+    PlantedTree.objects.filter(planted_at__day=1).first().delete()
+    response = client.get(
+        url,
+        data={
+            'period': 'week',
+            'since': '2024-01-01',
+            'until': '2024-01-14',
+            'group': 'tree',
+        },
+    )
+    assert response.json().get('buckets') == ['2024-01-01', '2024-01-08']
+    assert response.json().get('series') == [
+        {'tree': olive.id, 'counts': [1, 1]},
+        {'tree': spruce.id, 'counts': [0, 1]},
+    ]
+
+    response = client.get(
+        url, data={'period': 'month', 'until': '2024-02-01', 'tree': olive.id}
+    )
+    assert len(response.json().get('buckets')) == 30
+    assert response.json().get('series')[0].get('counts')[-2:] == [2, 0]
+
+    response = client.get(url, data={'account': 'Humans'})
+    assert response.status_code == 403
+
+    response = client.get(url, data={'period': 'year'})
+    assert response.status_code == 400
+
+    response = client.get(url, data={'since': '2000-01-01'})
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_emptied_rollups_are_removed():
+    zeus = User.objects.get(username='Zeus')
+    gods = Account.objects.get(name='Gods')
+    olive = Tree.objects.get(name='Olive')
+    planted = PlantedTree.objects.create(
+        user=zeus,
+        account=gods,
+        tree=olive,
+        planted_at=datetime(2001, 1, 1, 12, tzinfo=timezone.utc),
+    )
+    old_rollups = PlantingRollup.objects.filter(bucket__year=2001)
+    assert old_rollups.count() == 3
+
+    # moving its last planting leaves none behind
+    planted.planted_at = datetime(2003, 6, 18, 12, tzinfo=timezone.utc)
+    planted.save()
+    assert not old_rollups.exists()
+    assert not PlantingRollup.objects.filter(count__lte=0).exists()
+
+    planted.delete()
+    assert not PlantingRollup.objects.filter(bucket__year=2003).exists()
+    assert not PlantingRollup.objects.filter(count__lte=0).exists()
+
+
+@pytest.mark.django_db
+def test_partitioned_plantings(client, settings):
+    settings.PLANTINGS_PARTITIONS_AHEAD = 2
+    zeus = User.objects.get(username='Zeus')
+    gods = Account.objects.get(name='Gods')
+    olive = Tree.objects.get(name='Olive')
+    old = PlantedTree.objects.create(
+        user=zeus,
+        account=gods,
+        tree=olive,
+        planted_at=datetime(2024, 1, 1, 12, tzinfo=timezone.utc),
+    )
+
+    out = StringIO()
+    call_command('partition_plantings', convert=True, stdout=out)
+
+    assert 'Partitioned the Planted Trees table.' in out.getvalue()
+    with connections['default'].cursor() as cursor:
+        assert partitions.is_partitioned(cursor)
+        attached = partitions.partitions(cursor)
+    assert min(attached) == date(2024, 1, 1)
+    assert len(PlantedTree.objects.all()) == 4
+
+    # the ORM doesn't notice, and date-bounded queries skip other months
+    zeus.plant_tree(gods, olive, (1, 1))
+    client.force_login(zeus)
+    response = client.get(reverse('plantedtree-own'))
+    assert len(response.json().get('results')) == 3
+    plan = PlantedTree.objects.filter(
+        planted_at__gte=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        planted_at__lt=datetime(2024, 2, 1, tzinfo=timezone.utc),
+    ).explain()
+    assert 'trees_plantedtree_2024_01' in plan
+    assert 'trees_plantedtree_2024_02' not in plan
+
+    settings.PLANTINGS_RETENTION_MONTHS = 12
+    out = StringIO()
+    call_command('partition_plantings', stdout=out)
+
+    assert 'Detached trees_plantedtree_2024_01, with 1 planted trees.' in (
+        out.getvalue()
+    )
+    assert not PlantedTree.objects.filter(id=old.id).exists()
+    assert Account.objects.get(name='Gods').planted_count == 3
+    assert Tree.objects.get(name='Olive').planted_count == 2
+
+
+@pytest.mark.django_db
+def test_partitions_take_plantings_from_the_default_one(settings):
+    settings.PLANTINGS_PARTITIONS_AHEAD = 0
+    call_command('partition_plantings', convert=True, stdout=StringIO())
+    gods = Account.objects.get(name='Gods')
+    olive = Tree.objects.get(name='Olive')
+    month = partitions.bucket_start(PlantingRollup.MONTH, date.today())
+    ahead = partitions.shift(PlantingRollup.MONTH, month, 3)
+    planted = PlantedTree.objects.create(
+        user=User.objects.get(username='Zeus'),
+        account=gods,
+        tree=olive,
+        planted_at=datetime(ahead.year, ahead.month, 15, tzinfo=timezone.utc),
+    )
+    gods.refresh_from_db()
+    olive.refresh_from_db()
+    counted = list(
+        PlantingRollup.objects.order_by('pk').values_list('pk', 'count')
+    ), (gods.planted_count, olive.planted_count)
+
+    settings.PLANTINGS_PARTITIONS_AHEAD = 3
+    out = StringIO()
+    call_command('partition_plantings', stdout=out)
+
+    name = partitions.partition_name(ahead)
+    assert f'Created {name}.' in out.getvalue()
+    with connections['default'].cursor() as cursor:
+        cursor.execute(f'SELECT id FROM {name}')
+        assert cursor.fetchall() == [(planted.id,)]
+        cursor.execute(f'SELECT count(*) FROM {partitions.DEFAULT_PARTITION}')
+        assert cursor.fetchone() == (0,)
+    assert PlantedTree.objects.get(id=planted.id).planted_at == (
+        planted.planted_at
+    )
+    gods.refresh_from_db()
+    olive.refresh_from_db()
+    assert counted == (
+        list(PlantingRollup.objects.order_by('pk').values_list('pk', 'count')),
+        (gods.planted_count, olive.planted_count),
+    )
+
+
+@pytest.mark.django_db
+def test_sql_json_listings_match_serializer(client, settings):
+    zeus = User.objects.get(username='Zeus')
+    gods = Account.objects.get(name='Gods')
+    odd = Account.objects.create(name='Odd "\\ \u2028 é\n')
+    Account.objects.create(name='Gone').users.add(zeus)
+    Account.objects.filter(name='Gone').update(active=False)
+    odd.users.add(zeus)
+    tree = Tree.objects.create(name='Ipê', scientific_name='Handroanthus\t')
+    planted = [
+        (gods, datetime(2018, 12, 1, 3, tzinfo=timezone.utc), (10, -47)),
+        (odd, datetime(2024, 1, 2, 3, 4, 5, 6, tzinfo=timezone.utc), (0, 0)),
+        (odd, datetime(1900, 1, 1, tzinfo=timezone.utc), (-0.00001, 0.5)),
+        (gods, datetime(2024, 6, 1, tzinfo=timezone.utc), (-22.0123, 180)),
+    ]
+    for account, planted_at, (latitude, longitude) in planted:
+        PlantedTree.objects.create(
+            user=zeus,
+            account=account,
+            tree=tree,
+            planted_at=planted_at,
+            latitude=latitude,
+            longitude=longitude,
+        )
+    client.force_login(zeus)
+
+    def listings():
+        responses = []
+        for url, data in [
+            (reverse('plantedtree-own'), {}),
+            (reverse('plantedtree-own'), {'limit': 2}),
+            (reverse('plantedtree-account'), {'account': odd.name}),
+            (reverse('user-planted', args=[zeus.id]), {}),
+            (reverse('plantedtree-within'), {'bbox': '-180,-90,180,90'}),
+            (reverse('plantedtree-own'), {'fields': 'id,location,user.id'}),
+            (reverse('plantedtree-own'), {'expand': 'user'}),
+        ]:
+            response = client.get(url, data=data)
+            assert response.status_code == 200
+            responses.append(response)
+            next_url = response.json().get('next')
+            if next_url:
+                responses.append(client.get(next_url))
+        return [
+            (response['Content-Type'], response.content)
+            for response in responses
+        ]
+
+    settings.PLANTED_TREE_SQL_JSON = False
+    serialized = listings()
+    settings.PLANTED_TREE_SQL_JSON = True
+    with CaptureQueriesContext(connections['default']) as queries:
+        rendered = listings()
+
+    assert rendered == serialized
+    assert b'"results":[]' not in rendered[0][1]
+    assert any('rendered_0' in query['sql'] for query in queries)
+
+
+def test_sql_json_listings_run_against_the_locked_drf():
+    # the listings above must hold for the DRF deployments install
+    locked = re.search(
+        r'name = "djangorestframework"\nversion = "(.+)"',
+        (Path(__file__).parents[3] / 'poetry.lock').read_text(),
+    )
+
+    assert rest_framework.VERSION == locked[1]
+
+
+@pytest.mark.django_db
+def test_list_plants_sparse_fields(client):
+    zeus = User.objects.get(username='Zeus')
+    client.force_login(zeus)
+    url = reverse('plantedtree-own')
+
+    with CaptureQueriesContext(connections['default']) as queries:
+        response = client.get(url, data={'fields': 'id,location,planted_at'})
+
+    planted = PlantedTree.objects.get(user=zeus)
+    assert list(response.json()['results'][0]) == [
+        'id',
+        'location',
+        'planted_at',
+    ]
+    assert response.json()['results'][0]['id'] == planted.id
+    assert not any('trees_tree' in query['sql'] for query in queries)
+    # only joined by live(), never selected
+    assert not any(
+        '"trees_account"."name"' in query['sql'] for query in queries
+    )
+
+    response = client.get(url, data={'expand': 'tree'})
+    result = response.json()['results'][0]
+    assert result['tree']['name'] == 'Olive'
+    assert result['user'] == zeus.id
+    assert result['account'] == planted.account_id
+
+    response = client.get(url, data={'expand': 'user'})
+    assert response.json()['results'][0]['user']['accounts'] == [
+        planted.account_id
+    ]
@@ -99,3 +99,32 @@ def test_profile_viewset_delete(client, django_user_model):
     assert response.status_code == 204
     with pytest.raises(ObjectDoesNotExist):
         Profile.objects.get(user_id=1)
+
+
+@pytest.mark.django_db
+def test_profile_viewset_get_takes_constant_queries(
+    client, django_assert_num_queries
+):
+    url = reverse('profile-list')
+
+    # profiles joined to their users, users accounts
+    with django_assert_num_queries(2):
+        response = client.get(url)
+
+    assert len(response.json()) == 3
+
+
+@pytest.mark.django_db
+def test_profile_viewset_sparse_fields(client, django_assert_num_queries):
+    url = reverse('profile-list')
+
+    # users are joined, their accounts are left alone
+    with django_assert_num_queries(1):
+        response = client.get(url, data={'fields': 'about,user.username'})
+
+    assert {'about': 'I am the Allfather', 'user': {'username': 'Odin'}} in (
+        response.json()
+    )
+
+    response = client.get(url, data={'expand': ''})
+    assert all(isinstance(profile['user'], int) for profile in response.json())
@@ -2,7 +2,9 @@ import pytest
 from django.core.exceptions import ObjectDoesNotExist
 from django.urls import reverse
 
-from trees.models import Tree
+from trees import catalog
+from trees.models import Tree, User
+from trees.serializers import PlantedTreeSerializer
 
 
 @pytest.mark.django_db
@@ -86,3 +88,56 @@ def test_tree_viewset_delete(client, django_user_model):
     assert response.status_code == 204
     with pytest.raises(ObjectDoesNotExist):
         Tree.objects.get(id=tree.id)
+
+
+@pytest.mark.django_db
+def test_tree_catalog_is_cached(client, django_assert_num_queries):
+    url = reverse('tree-list')
+
+    response = client.get(url)
+
+    assert response.status_code == 200
+    etag = response['ETag']
+    assert 'max-age' in response['Cache-Control']
+
+    # clients with an up to date catalog are answered from memory
+    with django_assert_num_queries(0):
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    # even once weakened by a proxy on the way
+    response = client.get(url, HTTP_IF_NONE_MATCH=f'W/{etag}')
+    assert response.status_code == 304
+    with django_assert_num_queries(0):
+        response = client.get(url)
+    assert response['ETag'] == etag
+
+    Tree.objects.create(
+        name='Brazilwood', scientific_name='Paubrasilia echinata'
+    )
+
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+    assert len(response.json()) == 4
+
+
+@pytest.mark.django_db
+def test_tree_catalog_leaves_out_planting_counts(client):
+    url = reverse('tree-list')
+    zeus = User.objects.get(username='Zeus')
+    olive = Tree.objects.get(name='Olive')
+
+    response = client.get(url)
+    etag = response['ETag']
+
+    assert all('planted_count' not in tree for tree in response.json())
+
+    zeus.plant_tree(zeus.accounts.first(), olive, (10, 20))
+    # resolved from the catalog, yet neither shared nor stale
+    field = PlantedTreeSerializer().fields['tree_id']
+    tree = field.to_internal_value(olive.id)
+
+    assert tree is not catalog.catalog.get().trees[olive.id]
+    assert tree.planted_count == Tree.objects.get(pk=olive.id).planted_count
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
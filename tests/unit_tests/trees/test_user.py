@@ -1,12 +1,15 @@
 from datetime import datetime, timedelta, timezone
+from io import StringIO
 from random import uniform
 
 import pytest
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.management import call_command
 from django.forms import model_to_dict
 from django.urls import reverse
 
-from trees.models import Account, PlantedTree, Tree, User
+from trees import authentication
+from trees.models import Account, AuthToken, PlantedTree, Tree, User
 
 
 @pytest.mark.django_db
@@ -106,9 +109,14 @@ def test_user_viewset_delete(client, django_user_model):
     client.force_login(zeus)
     response = client.delete(url)
 
-    assert response.status_code == 204
+    assert response.status_code == 202
+    assert not User.objects.get(id=zeus.id).is_active
+
+    call_command('purge_deleted', stdout=StringIO())
+
     with pytest.raises(ObjectDoesNotExist):
         User.objects.get(id=zeus.id)
+    assert Account.objects.get(name='Gods').planted_count == 1
 
 
 @pytest.mark.django_db
@@ -125,7 +133,7 @@ def test_user_viewset_planted(client):
         model_to_dict(tree)
         for tree in PlantedTree.objects.filter(user__username='Zeus')
     ]
-    results = response.json()
+    results = response.json().get('results')
     for tree, result in zip(trees, results):
         assert tree.get('id') == result.get('id')
 
@@ -170,6 +178,26 @@ def test_user_plant_tree_wrong_account():
         zeus.plant_tree(humans, tree, (27.9811, 86.9250))
 
 
+@pytest.mark.django_db
+def test_user_memberships_are_cached(django_assert_num_queries):
+    zeus = User.objects.get(username='Zeus')
+    gods = Account.objects.get(name='Gods')
+    humans = Account.objects.get(name='Humans')
+    olive = Tree.objects.get(name='Olive')
+    zeus.plant_tree(gods, olive, (27.9811, 86.9250))
+
+    # only the insert and the counters are left once memberships are known
+    with django_assert_num_queries(4):
+        zeus.plant_tree(gods, olive, (27.9811, 86.9250))
+
+    # changes on either side of the relation are picked up right away
+    humans.users.add(zeus)
+    zeus.plant_tree(humans, olive, (27.9811, 86.9250))
+    zeus.accounts.remove(gods)
+    with pytest.raises(ValueError):
+        zeus.plant_tree(gods, olive, (27.9811, 86.9250))
+
+
 @pytest.mark.django_db
 def test_user_plant_trees():
     zeus = User.objects.get(username='Zeus')
@@ -203,3 +231,127 @@ def test_user_plant_trees_with_failed():
 
     result = zeus.plant_trees(humans, trees_to_plant)
     assert len(result.get('failed')) == 3
+
+
+@pytest.mark.django_db
+def test_user_plant_trees_reports_failure_reasons():
+    zeus = User.objects.get(username='Zeus')
+    olive = Tree.objects.get(name='Olive')
+    missing = Tree(name='Brazilwood', scientific_name='Paubrasilia echinata')
+    trees_to_plant = [
+        (olive, (10.0, 20.0)),
+        (missing, (10.0, 20.0)),
+        (olive, (1000.0, 20.0)),
+        (olive, (30.0, 40.0)),
+    ]
+
+    result = zeus.plant_trees(zeus.accounts.first(), trees_to_plant)
+
+    assert [planted.location for planted in result.get('success')] == [
+        (10.0, 20.0),
+        (30.0, 40.0),
+    ]
+    assert all(planted.pk for planted in result.get('success'))
+    assert result.get('failed') == [trees_to_plant[1], trees_to_plant[2]]
+    assert len(result.get('errors')) == 2
+
+
+@pytest.mark.django_db
+def test_user_plant_trees_checks_account_once(django_assert_max_num_queries):
+    zeus = User.objects.get(username='Zeus')
+    account = zeus.accounts.first()
+    trees = list(Tree.objects.all())
+    trees_to_plant = [
+        (trees[i % len(trees)], (uniform(-90, 90), uniform(-180, 180)))
+        for i in range(50)
+    ]
+
+    # and one update per planting counter
+    with django_assert_max_num_queries(8):
+        result = zeus.plant_trees(account, trees_to_plant)
+
+    assert len(result.get('success')) == 50
+    assert PlantedTree.objects.filter(user=zeus).count() == 51
+
+
+@pytest.mark.django_db
+def test_user_viewset_get_takes_constant_queries(
+    client, django_assert_num_queries
+):
+    for index in range(10):
+        user = User.objects.create(username=f'user{index}')
+        user.accounts.set(Account.objects.all())
+
+    url = reverse('user-list')
+
+    # users and their accounts
+    with django_assert_num_queries(2):
+        response = client.get(url)
+
+    assert len(response.json()) == 13
+
+
+@pytest.mark.django_db
+def test_user_token_authentication(client, django_assert_num_queries):
+    authentication.cache.invalidate()
+    url = reverse('token')
+
+    response = client.post(url, {'username': 'Zeus', 'password': 'Hades'})
+    assert response.status_code == 401
+
+    response = client.post(url, {'username': 'Zeus', 'password': 'Olympus'})
+
+    assert response.status_code == 201
+    key = response.json().get('token')
+    assert AuthToken.objects.get(user__username='Zeus').digest != key
+
+    # verified tokens are cached, so only the view itself queries
+    own_url = reverse('plantedtree-own')
+    header = {'HTTP_AUTHORIZATION': f'Token {key}'}
+    response = client.get(own_url, **header)
+    assert response.status_code == 200
+    with django_assert_num_queries(2):
+        response = client.get(own_url, **header)
+    assert len(response.json().get('results')) == 1
+
+    response = client.put(url, **header)
+
+    assert response.status_code == 201
+    rotated = response.json().get('token')
+    assert client.get(own_url, **header).status_code == 403
+    header = {'HTTP_AUTHORIZATION': f'Token {rotated}'}
+    assert client.get(own_url, **header).status_code == 200
+
+    # deactivated users lose access right away
+    user = User.objects.get(username='Zeus')
+    user.is_active = False
+    user.save()
+    assert client.get(own_url, **header).status_code == 403
+    user.is_active = True
+    user.save()
+
+    response = client.delete(url, **header)
+
+    assert response.status_code == 200
+    assert client.get(own_url, **header).status_code == 403
+    assert not AuthToken.objects.filter(user__username='Zeus').exists()
+
+
+@pytest.mark.django_db
+def test_user_viewset_sparse_fields(client, django_assert_num_queries):
+    zeus = User.objects.get(username='Zeus')
+    client.force_login(zeus)
+    url = reverse('user-detail', args=[zeus.id])
+
+    response = client.get(url, data={'fields': 'id,username'})
+    assert response.json() == {'id': zeus.id, 'username': 'Zeus'}
+
+    # accounts collapse to their ids, still prefetched
+    with django_assert_num_queries(4):
+        response = client.get(url, data={'expand': ''})
+    assert response.json()['accounts'] == [
+        account.id for account in zeus.accounts.all()
+    ]
+
+    response = client.get(url, data={'fields': 'accounts.name'})
+    assert response.json() == {'accounts': [{'name': 'Gods'}]}
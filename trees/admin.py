@@ -4,9 +4,27 @@ from django.contrib.auth.hashers import make_password
 from trees.models import Account, PlantedTree, Tree, User
 
 
+class DeleteLaterAdmin(admin.ModelAdmin):
+    """
+    Only marks deleted objects, leaving their removal with their Planted
+    Trees to trees.purge
+    """
+
+    def get_deleted_objects(self, objs, request):
+        # the collector would load every Planted Tree just to list them
+        return [str(obj) for obj in objs], {}, set(), []
+
+    def delete_model(self, request, obj):
+        obj.delete_later()
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            obj.delete_later()
+
+
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
-    list_display = ['username', 'date_joined']
+class UserAdmin(DeleteLaterAdmin):
+    list_display = ['username', 'date_joined', 'planted_count']
     search_help_text = 'Name of the account the user is a part of'
     search_fields = ['accounts__name']
 
@@ -36,8 +54,8 @@ class UserInline(admin.TabularInline):
 
 
 @admin.register(Account)
-class AccountAdmin(admin.ModelAdmin):
-    list_display = ['name', 'created', 'active']
+class AccountAdmin(DeleteLaterAdmin):
+    list_display = ['name', 'created', 'active', 'planted_count']
     list_editable = ['active']
     inlines = [UserInline]
 
@@ -53,5 +71,5 @@ class PlantedTreeInline(admin.TabularInline):
 
 @admin.register(Tree)
 class TreeAdmin(admin.ModelAdmin):
-    list_display = ['name', 'scientific_name']
+    list_display = ['name', 'scientific_name', 'planted_count']
     inlines = [PlantedTreeInline]
@@ -0,0 +1,164 @@
+"""
+Archiving of the Planted Trees of long inactive Accounts.
+
+Deactivating an Account hides its Planted Trees right away, through
+PlantedTreeQuerySet.live(), while their account_active flag, which the
+partial indexes of the listings follow, is set ARCHIVE_BATCH_SIZE at a time
+here, so the request never updates them. Trees of a reactivated Account
+show again once their flag is set back.
+
+Planted Trees of Accounts inactive for more than ARCHIVE_AFTER_DAYS days
+are moved to the ArchivedPlantedTree table, ARCHIVE_BATCH_SIZE at a time,
+each batch a single statement in its own transaction, so the Planted Trees
+table and its indexes only hold live data. They are moved back once their
+Account is active again.
+
+Archived trees aren't counted, charted or clustered: the triggers and the
+planting counters treat moving them like deleting and planting them.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.timezone import now
+
+from trees import counters, heatmaps
+from trees.models import Account, ArchivedPlantedTree, PlantedTree
+from trees.nearest import registry
+
+COLUMNS = 'id, user_id, account_id, tree_id, planted_at, latitude, longitude'
+
+ARCHIVE_BATCH = f"""
+    WITH moved AS (
+        DELETE FROM {PlantedTree._meta.db_table}
+        WHERE id IN (
+            SELECT id FROM {PlantedTree._meta.db_table}
+            WHERE account_id = %(account_id)s
+            ORDER BY id
+            LIMIT %(batch_size)s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING {COLUMNS}, cell
+    ),
+    archived AS (
+        INSERT INTO {ArchivedPlantedTree._meta.db_table} (
+            {COLUMNS}, cell, account_active, archived_at
+        )
+        SELECT {COLUMNS}, cell, false, now() FROM moved
+    ),
+    {counters.counted_sql('moved', '-')}
+    SELECT count(*) FROM moved
+"""
+
+FLAG_BATCH = f"""
+    UPDATE {PlantedTree._meta.db_table} SET account_active = %(active)s
+    WHERE id IN (
+        SELECT id FROM {PlantedTree._meta.db_table}
+        WHERE account_id = %(account_id)s
+            AND account_active <> %(active)s
+        LIMIT %(batch_size)s
+        FOR UPDATE
+    )
+"""
+
+# Accounts whose Planted Trees aren't flagged like them, by the
+# plantings_active column of the database
+CHANGED = f"""
+    SELECT id, active FROM {Account._meta.db_table}
+    WHERE deleted_at IS NULL AND plantings_active <> active
+"""
+
+# unless the Account changed again meanwhile
+FLAGGED = f"""
+    UPDATE {Account._meta.db_table} SET plantings_active = %(active)s
+    WHERE id = %(account_id)s AND active = %(active)s
+"""
+
+RESTORE_BATCH = f"""
+    WITH restored AS (
+        DELETE FROM {ArchivedPlantedTree._meta.db_table}
+        WHERE id IN (
+            SELECT id FROM {ArchivedPlantedTree._meta.db_table}
+            WHERE account_id = %(account_id)s
+            ORDER BY id
+            LIMIT %(batch_size)s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING {COLUMNS}
+    ),
+    inserted AS (
+        INSERT INTO {PlantedTree._meta.db_table} ({COLUMNS}, account_active)
+        SELECT {COLUMNS}, true FROM restored
+        RETURNING account_id, tree_id, user_id
+    ),
+    {counters.counted_sql('inserted')}
+    SELECT count(*) FROM inserted
+"""
+
+
+def move(statement: str, account_id: int, batch_size: int) -> int:
+    moved = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                statement, {'account_id': account_id, 'batch_size': batch_size}
+            )
+            (batch,) = cursor.fetchone()
+        if not batch:
+            return moved
+        moved += batch
+
+
+def flag(account_id: int, active: bool, batch_size: int) -> int:
+    flagged = 0
+    parameters = {
+        'account_id': account_id,
+        'active': active,
+        'batch_size': batch_size,
+    }
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(FLAG_BATCH, parameters)
+            batch = cursor.rowcount
+            if not batch:
+                cursor.execute(FLAGGED, parameters)
+                return flagged
+        flagged += batch
+
+
+def archive(batch_size: int | None = None) -> dict[str, int]:
+    """
+    Sets the account_active flag of the Planted Trees of changed Accounts,
+    archives those of long inactive Accounts and restores those of
+    reactivated ones, returning how many were flagged and moved each way.
+    """
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    moved = {'flagged': 0, 'archived': 0, 'restored': 0}
+
+    with connection.cursor() as cursor:
+        cursor.execute(CHANGED)
+        changed = cursor.fetchall()
+    for account_id, active in changed:
+        moved['flagged'] += flag(account_id, active, batch_size)
+
+    inactive = Account.objects.filter(
+        active=False,
+        deleted_at__isnull=True,
+        deactivated_at__lte=now()
+        - timedelta(days=settings.ARCHIVE_AFTER_DAYS),
+    )
+    for account_id in inactive.values_list('id', flat=True):
+        moved['archived'] += move(ARCHIVE_BATCH, account_id, batch_size)
+
+    reactivated = Account.objects.filter(
+        active=True,
+        id__in=ArchivedPlantedTree.objects.values('account_id'),
+    )
+    for account_id in reactivated.values_list('id', flat=True):
+        moved['restored'] += move(RESTORE_BATCH, account_id, batch_size)
+
+    if moved['flagged'] or moved['restored']:
+        registry.invalidate()
+        heatmaps.cache.invalidate()
+    return moved
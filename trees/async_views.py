@@ -0,0 +1,171 @@
+"""
+Native async versions of the read-heavy listings.
+
+DRF views are synchronous, so under ASGI each of their requests holds a
+thread while waiting on the database. These views run DRF's own content
+negotiation, permission checks and exception handling, but authenticate,
+query and paginate through Django's async interfaces, reusing the querysets
+and helpers of the viewset actions whose URLs they take over.
+
+Authenticators with an `aauthenticate` method are awaited, others run in a
+thread, like Basic authentication and its password hasher.
+"""
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404
+from django.utils.cache import get_conditional_response
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from trees import memberships
+from trees.points import PointsRenderer
+from trees.serializers import ProfileSerializer, optimize_queryset
+from trees.views import (
+    CURRENT_VERSION,
+    PLANTED_TREE_RENDERERS,
+    PlantedTreeViewSet,
+    ProfileViewSet,
+    UserViewSet,
+    account_planted_trees,
+    account_versions,
+    listing_validators,
+    listing_versions,
+    not_a_member,
+    own_planted_trees,
+    paginated_planted_trees,
+    planted_trees_listing,
+    set_validators,
+    user_planted_trees,
+    user_versions,
+)
+
+
+class AsyncAPIView(APIView):
+    """
+    Serves GET requests asynchronously, and hands any other method to the
+    synchronous DRF `fallback` view.
+    """
+
+    fallback: callable
+    permission_classes = PlantedTreeViewSet.permission_classes
+    renderer_classes = PLANTED_TREE_RENDERERS
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return await sync_to_async(self.fallback)(request, *args, **kwargs)
+
+        # APIView.dispatch, with the handler and authentication awaited
+        self.args, self.kwargs = args, kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await self.authenticate(request)
+            self.initial(request, *args, **kwargs)
+            response = await self.get(request, *args, **kwargs)
+        except Exception as error:
+            response = self.handle_exception(error)
+        self.response = self.finalize_response(
+            request, response, *args, **kwargs
+        )
+        return self.response
+
+    async def authenticate(self, request):
+        # done before APIView.initial, which then finds the user set
+        for authenticator in request.authenticators:
+            if hasattr(authenticator, 'aauthenticate'):
+                user_auth = await authenticator.aauthenticate(request)
+            else:
+                user_auth = await sync_to_async(authenticator.authenticate)(
+                    request
+                )
+            if user_auth is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth
+                return
+        request.user, request.auth = AnonymousUser(), None
+
+    async def paginated(self, request, queryset):
+        if isinstance(request.accepted_renderer, PointsRenderer):
+            # a single statement packs the whole page
+            return await sync_to_async(paginated_planted_trees)(
+                request, queryset, view=self
+            )
+        paginator, rows, render = planted_trees_listing(request, queryset)
+        return render(
+            await paginator.apaginate_queryset(rows, request, view=self)
+        )
+
+    async def conditional(self, request, queryset, versions):
+        etag, last_modified = listing_validators(
+            request,
+            await listing_versions(request, versions).aaggregate(
+                **CURRENT_VERSION
+            ),
+        )
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = await self.paginated(request, queryset)
+        return set_validators(response, etag, last_modified)
+
+
+class OwnPlantedTreesView(AsyncAPIView):
+    fallback = staticmethod(PlantedTreeViewSet.as_view({'get': 'own'}))
+
+    async def get(self, request):
+        return await self.paginated(request, own_planted_trees(request))
+
+
+class AccountPlantedTreesView(AsyncAPIView):
+    fallback = staticmethod(PlantedTreeViewSet.as_view({'get': 'account'}))
+
+    async def get(self, request):
+        account_id = None
+        if not request.user.is_superuser:
+            account_id = await memberships.aaccount_id(
+                request.user, request.GET.get('account')
+            )
+        trees_queryset = account_planted_trees(request, account_id)
+        if trees_queryset is None:
+            return not_a_member()
+        return await self.conditional(
+            request, trees_queryset, account_versions(request)
+        )
+
+
+class UserPlantedTreesView(AsyncAPIView):
+    fallback = staticmethod(UserViewSet.as_view({'get': 'planted'}))
+    permission_classes = UserViewSet.permission_classes
+
+    async def get(self, request, pk=None):
+        user = await UserViewSet.queryset.filter(pk=pk).afirst()
+        if user is None:
+            raise Http404
+        self.check_object_permissions(request, user)
+        return await self.conditional(
+            request, user_planted_trees(pk), user_versions(pk)
+        )
+
+
+class ProfileDetailView(AsyncAPIView):
+    fallback = staticmethod(
+        ProfileViewSet.as_view(
+            {'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}
+        )
+    )
+    permission_classes = ProfileViewSet.permission_classes
+    renderer_classes = ProfileViewSet.renderer_classes
+
+    async def get(self, request, pk=None):
+        # retrieves profile based on user, like ProfileViewSet.retrieve
+        context = {'request': request, 'view': self}
+        profile = await optimize_queryset(
+            ProfileViewSet.queryset.filter(user__id=pk),
+            ProfileSerializer(context=context),
+        ).afirst()
+        if profile is None:
+            raise Http404
+        return Response(ProfileSerializer(profile, context=context).data)
@@ -0,0 +1,141 @@
+"""
+Token authentication that skips the password hasher.
+
+Requests carry `Authorization: Token <key>`. Keys are looked up by their
+SHA-256 digest, and the result is kept in an in-process LRU cache for
+TOKEN_CACHE_TTL seconds, so most requests never touch the database.
+Revoking a token, or changing its User, drops it from the cache of this
+process; other processes notice once their entry expires.
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework import authentication, exceptions
+
+from trees.models import AuthToken, token_digest
+
+
+class TokenCache:
+    """
+    AuthTokens with their User by digest, least recently used ones evicted
+    first
+    """
+
+    def __init__(self):
+        self.tokens = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, digest: str) -> AuthToken | None:
+        token = self.cached(digest)
+        if token is None:
+            token = self.store(
+                digest,
+                AuthToken.objects.select_related('user')
+                .filter(digest=digest)
+                .first(),
+            )
+        return token
+
+    async def aget(self, digest: str) -> AuthToken | None:
+        token = self.cached(digest)
+        if token is None:
+            token = self.store(
+                digest,
+                await AuthToken.objects.select_related('user')
+                .filter(digest=digest)
+                .afirst(),
+            )
+        return token
+
+    def cached(self, digest: str) -> AuthToken | None:
+        with self.lock:
+            entry = self.tokens.get(digest)
+            if entry is not None and entry[1] > time.monotonic():
+                self.tokens.move_to_end(digest)
+                return entry[0]
+        return None
+
+    def store(self, digest: str, token: AuthToken | None) -> AuthToken | None:
+        if token is None:
+            return None
+        with self.lock:
+            self.tokens[digest] = (
+                token,
+                time.monotonic() + settings.TOKEN_CACHE_TTL,
+            )
+            self.tokens.move_to_end(digest)
+            while len(self.tokens) > settings.TOKEN_CACHE_SIZE:
+                self.tokens.popitem(last=False)
+        return token
+
+    def revoke(self, digest: str):
+        with self.lock:
+            self.tokens.pop(digest, None)
+
+    def revoke_user(self, user_id: int):
+        with self.lock:
+            for digest, (token, _) in list(self.tokens.items()):
+                if token.user_id == user_id:
+                    del self.tokens[digest]
+
+    def invalidate(self):
+        with self.lock:
+            self.tokens.clear()
+
+
+cache = TokenCache()
+
+
+class SessionAuthentication(authentication.SessionAuthentication):
+    """
+    DRF session authentication that async views can await
+    """
+
+    async def aauthenticate(self, request):
+        user = await request._request.auser()
+        if not user or not user.is_active:
+            return None
+        # async views only serve safe methods, which CSRF doesn't cover
+        return user, None
+
+
+class TokenAuthentication(authentication.BaseAuthentication):
+    keyword = 'Token'
+
+    def authenticate(self, request):
+        digest = self.digest(request)
+        if digest is None:
+            return None
+        return self.authenticated(cache.get(digest))
+
+    async def aauthenticate(self, request):
+        digest = self.digest(request)
+        if digest is None:
+            return None
+        return self.authenticated(await cache.aget(digest))
+
+    def digest(self, request) -> str | None:
+        header = authentication.get_authorization_header(request).split()
+        if not header or header[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(header) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+        try:
+            return token_digest(header[1].decode())
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+
+    def authenticated(self, token: AuthToken | None):
+        if token is None:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        # requests may set attributes on their user, so they get their own
+        return copy.copy(token.user), token
+
+    def authenticate_header(self, request):
+        return self.keyword
@@ -0,0 +1,68 @@
+"""
+In-process copy of the Tree catalog.
+
+The catalog is loaded and rendered once, then served from memory, with a
+strong ETag computed from the rendered bytes so every process agrees on it.
+Saving or deleting a Tree drops the copy of this process; other processes
+notice after TREE_CATALOG_TTL seconds. It leaves out the planting counts,
+which change with every planting, so its bytes only follow the Trees. Their
+counts are rendered by the Tree detail.
+"""
+
+import hashlib
+import threading
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+
+from trees import serializers
+from trees.models import Tree
+
+
+@dataclass(frozen=True)
+class Catalog:
+    trees: dict[int, Tree]
+    content: bytes
+    etag: str
+
+
+class TreeCatalog:
+    def __init__(self):
+        self.catalog = None
+        self.expires_at = 0.0
+        self.lock = threading.Lock()
+        # bumped by every change, so a catalog loaded meanwhile isn't kept
+        self.version = 0
+
+    def get(self) -> Catalog:
+        now = time.monotonic()
+        with self.lock:
+            if self.catalog is not None and self.expires_at > now:
+                return self.catalog
+            version = self.version
+
+        # so Trees resolved from it load their current count when rendered
+        trees = list(Tree.objects.defer('planted_count').order_by('id'))
+        content = JSONRenderer().render(
+            serializers.TreeCatalogSerializer(trees, many=True).data
+        )
+        catalog = Catalog(
+            trees={tree.pk: tree for tree in trees},
+            content=content,
+            etag=f'"{hashlib.sha256(content).hexdigest()[:32]}"',
+        )
+        with self.lock:
+            if version == self.version:
+                self.catalog = catalog
+                self.expires_at = now + settings.TREE_CATALOG_TTL
+        return catalog
+
+    def invalidate(self):
+        with self.lock:
+            self.version += 1
+            self.catalog = None
+
+
+catalog = TreeCatalog()
@@ -0,0 +1,142 @@
+"""
+Planting counters of Accounts, Trees and Users.
+
+Counters are moved with F() updates by the signal receivers of Planted
+Trees, in the transaction that plants or deletes them, so concurrent
+plantings never lose an increment. A bulk planting costs a single UPDATE
+per counted model, however many owners it touches.
+
+Statements writing Planted Trees in raw SQL move the counters themselves,
+through the common table expressions of `counted_sql`. Other paths that
+send no signals, like `QuerySet.update()`, leave the counters behind;
+`manage.py recount_plantings` repairs them.
+"""
+
+from collections import Counter, defaultdict
+
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    IntegerField,
+    OuterRef,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
+
+from trees.models import Account, PlantedTree, Tree, User
+
+# counted model by PlantedTree field, in the order their rows are locked
+OWNERS = {'account_id': Account, 'tree_id': Tree, 'user_id': User}
+
+
+def adjust(deltas: dict[str, Counter]):
+    for field, model in OWNERS.items():
+        owner_deltas = {
+            owner_id: delta
+            for owner_id, delta in sorted(deltas.get(field, {}).items())
+            if owner_id is not None and delta
+        }
+        if not owner_deltas:
+            continue
+        if len(set(owner_deltas.values())) == 1:
+            increment = Value(next(iter(owner_deltas.values())))
+        else:
+            increment = Case(
+                *[
+                    When(pk=owner_id, then=Value(delta))
+                    for owner_id, delta in owner_deltas.items()
+                ],
+                output_field=IntegerField(),
+            )
+        model.objects.filter(pk__in=list(owner_deltas)).update(
+            planted_count=F('planted_count') + increment
+        )
+
+
+def planted(planted_trees, sign=1):
+    adjust(
+        {
+            field: Counter(
+                {
+                    owner_id: sign * count
+                    for owner_id, count in Counter(
+                        getattr(planted_tree, field)
+                        for planted_tree in planted_trees
+                    ).items()
+                }
+            )
+            for field in OWNERS
+        }
+    )
+    for planted_tree in planted_trees:
+        planted_tree.counted = planted_tree.counted_owners()
+
+
+def removed(planted_trees):
+    planted(planted_trees, sign=-1)
+
+
+def moved(planted_tree):
+    # a saved Planted Tree may have changed Account, Tree or User
+    counted = getattr(planted_tree, 'counted', None)
+    current = planted_tree.counted_owners()
+    if counted is None or counted == current:
+        return
+    deltas = defaultdict(Counter)
+    for field, before, after in zip(
+        planted_tree.counted_fields, counted, current
+    ):
+        # an owner that was never loaded can't be told
+        if before is not None and before != after:
+            deltas[field][before] -= 1
+            deltas[field][after] += 1
+    adjust(deltas)
+    planted_tree.counted = current
+
+
+def recount(model, field: str) -> int:
+    """
+    Sets the counters of `model` that drifted from the Planted Trees they
+    count, and returns how many were repaired. Plantings committed while it
+    runs may need another pass.
+    """
+    actual = Coalesce(
+        Subquery(
+            PlantedTree.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(count=Count('*'))
+            .values('count')
+        ),
+        Value(0),
+    )
+    return (
+        model.objects.annotate(actual=actual)
+        .exclude(planted_count=F('actual'))
+        .update(planted_count=actual)
+    )
+
+
+def counted_sql(rows: str, sign: str = '+') -> str:
+    """
+    Common table expressions adding, or with `sign='-'` subtracting, the
+    Planted Trees of the `rows` expression of the same statement, which must
+    return account_id, tree_id and user_id.
+    """
+    return ',\n'.join(
+        f"""
+            counted_{model._meta.model_name} AS (
+                UPDATE {model._meta.db_table} AS owner
+                SET planted_count = owner.planted_count {sign} batch.count
+                FROM (
+                    SELECT {field}, count(*) AS count
+                    FROM {rows}
+                    GROUP BY {field}
+                ) AS batch
+                WHERE owner.id = batch.{field}
+            )"""
+        for field, model in OWNERS.items()
+    )
@@ -0,0 +1,88 @@
+import csv
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+EXPORT_FIELDS = [
+    'id',
+    'planted_at',
+    'latitude',
+    'longitude',
+    'tree_id',
+    'tree__name',
+    'tree__scientific_name',
+    'user_id',
+    'user__username',
+    'account_id',
+    'account__name',
+]
+EXPORT_COLUMNS = [field.replace('__', '_') for field in EXPORT_FIELDS]
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class _Echo:
+    # lets csv.writer hand back each line instead of writing it somewhere
+    def write(self, value):
+        return value
+
+
+class _Renderer:
+    def __init__(self, output: str):
+        self.output = output
+        self.encoder = DjangoJSONEncoder()
+        self.writer = csv.writer(_Echo())
+
+    def header(self) -> bytes:
+        if self.output == 'csv':
+            return self.writer.writerow(EXPORT_COLUMNS).encode()
+        return b''
+
+    def rows(self, rows: list) -> bytes:
+        if self.output == 'csv':
+            return ''.join(self.writer.writerow(row) for row in rows).encode()
+        return ''.join(
+            self.encoder.encode(dict(zip(EXPORT_COLUMNS, row))) + '\n'
+            for row in rows
+        ).encode()
+
+
+def _export_queryset(queryset):
+    return queryset.order_by('planted_at', 'id').values_list(*EXPORT_FIELDS)
+
+
+def iter_export(queryset, output: str):
+    """
+    Renders the Planted Trees of `queryset` as NDJSON or CSV while reading
+    them from a server-side cursor, one chunk at a time.
+    """
+    renderer = _Renderer(output)
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    rows = _export_queryset(queryset).iterator(chunk_size=chunk_size)
+
+    yield renderer.header()
+    while chunk := list(islice(rows, chunk_size)):
+        yield renderer.rows(chunk)
+
+
+async def aiter_export(queryset, output: str):
+    """
+    Asynchronous version of `iter_export`, so that ASGI servers can stream
+    the export without loading it all into memory first.
+    """
+    renderer = _Renderer(output)
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    # the cursor is only ever touched from the sync thread, one chunk at a time
+    rows = _export_queryset(queryset).iterator(chunk_size=chunk_size)
+
+    def next_chunk():
+        return list(islice(rows, chunk_size))
+
+    yield renderer.header()
+    while chunk := await sync_to_async(next_chunk)():
+        yield renderer.rows(chunk)
@@ -0,0 +1,150 @@
+"""
+Planting density grids for the heatmaps of the dashboards.
+
+The coordinates of every matching Planted Tree are fetched as two arrays in
+a single query and binned by NumPy, so no model instance is ever built.
+Grids are cached per filter and resolution for HEATMAP_CACHE_TTL seconds,
+and dropped as soon as a planting lands inside one of them.
+
+Writes made by other processes, or by paths that send no signals, are only
+picked up once the cached grid expires.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import numpy as np
+from django.conf import settings
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+
+from trees.models import PlantedTree
+
+WHOLE_WORLD = (-90.0, -180.0, 90.0, 180.0)
+
+
+class HeatmapKey(NamedTuple):
+    # None stands for every Account
+    account_ids: tuple | None
+    tree_id: int | None
+    min_latitude: float
+    min_longitude: float
+    max_latitude: float
+    max_longitude: float
+    resolution: int
+
+    @property
+    def wraps(self) -> bool:
+        # crosses the antimeridian
+        return self.min_longitude > self.max_longitude
+
+    def covers(self, planted_tree) -> bool:
+        if (
+            self.account_ids is not None
+            and planted_tree.account_id not in self.account_ids
+        ):
+            return False
+        if self.tree_id is not None and planted_tree.tree_id != self.tree_id:
+            return False
+        latitude = float(planted_tree.latitude)
+        longitude = float(planted_tree.longitude)
+        if not self.min_latitude <= latitude <= self.max_latitude:
+            return False
+        if self.wraps:
+            return (
+                longitude >= self.min_longitude
+                or longitude <= self.max_longitude
+            )
+        return self.min_longitude <= longitude <= self.max_longitude
+
+
+def density(key: HeatmapKey) -> np.ndarray:
+    """
+    Counts the Planted Trees matching `key` in a resolution x resolution
+    grid, with rows going from south to north and columns from west to east.
+    """
+    queryset = PlantedTree.objects.live()
+    if key.account_ids is not None:
+        queryset = queryset.filter(account_id__in=key.account_ids)
+    if key.tree_id is not None:
+        queryset = queryset.filter(tree_id=key.tree_id)
+    if key[2:6] != WHOLE_WORLD:
+        queryset = queryset.within(*key[2:6])
+
+    columns = queryset.aggregate(
+        latitudes=ArrayAgg(Cast('latitude', FloatField()), default=[]),
+        longitudes=ArrayAgg(Cast('longitude', FloatField()), default=[]),
+    )
+    latitudes = np.asarray(columns['latitudes'], dtype=np.float64)
+    longitudes = np.asarray(columns['longitudes'], dtype=np.float64)
+
+    east = key.max_longitude
+    if key.wraps:
+        # unrolls the map so the box becomes contiguous
+        longitudes = np.where(
+            longitudes < key.min_longitude, longitudes + 360, longitudes
+        )
+        east += 360
+
+    counts, _, _ = np.histogram2d(
+        latitudes,
+        longitudes,
+        bins=key.resolution,
+        range=[
+            [key.min_latitude, key.max_latitude],
+            [key.min_longitude, east],
+        ],
+    )
+    return counts.astype(np.int64)
+
+
+class HeatmapCache:
+    """
+    Density grids by HeatmapKey, least recently used ones evicted first
+    """
+
+    def __init__(self):
+        self.grids = OrderedDict()
+        self.lock = threading.Lock()
+        # bumped whenever grids are dropped, so that a grid computed while
+        # trees were being planted isn't cached
+        self.generation = 0
+
+    def get(self, key: HeatmapKey) -> np.ndarray:
+        now = time.monotonic()
+        with self.lock:
+            entry = self.grids.get(key)
+            if entry is not None and entry[1] > now:
+                self.grids.move_to_end(key)
+                return entry[0]
+            generation = self.generation
+
+        grid = density(key)
+        with self.lock:
+            if generation != self.generation:
+                return grid
+            self.grids[key] = (grid, now + settings.HEATMAP_CACHE_TTL)
+            self.grids.move_to_end(key)
+            while len(self.grids) > settings.HEATMAP_CACHE_SIZE:
+                self.grids.popitem(last=False)
+        return grid
+
+    def planted(self, planted_trees):
+        with self.lock:
+            self.generation += 1
+            for key in list(self.grids):
+                if any(key.covers(tree) for tree in planted_trees):
+                    del self.grids[key]
+
+    removed = planted
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.grids.clear()
+
+
+cache = HeatmapCache()
@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from trees import archive
+
+
+class Command(BaseCommand):
+    help = (
+        'Flags the Planted Trees of Accounts deactivated or reactivated, '
+        'archives those of Accounts inactive for more than ARCHIVE_AFTER_DAYS '
+        'days, and restores those of reactivated ones, once or every '
+        'ARCHIVE_INTERVAL seconds with --watch.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.ARCHIVE_BATCH_SIZE
+        )
+        parser.add_argument(
+            '--watch',
+            action='store_true',
+            help='Keep running, as an archive worker.',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            moved = archive.archive(options['batch_size'])
+            if any(moved.values()) or not options['watch']:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f'Flagged {moved["flagged"]} planted trees. '
+                        f'Archived {moved["archived"]} planted trees, '
+                        f'restored {moved["restored"]}.'
+                    )
+                )
+            if not options['watch']:
+                return
+            close_old_connections()
+            time.sleep(settings.ARCHIVE_INTERVAL)
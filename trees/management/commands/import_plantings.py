@@ -0,0 +1,304 @@
+import csv
+import io
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+
+from trees import counters
+from trees.models import Account, PlantedTree, Tree, User
+
+# file column -> staging table column
+COLUMNS = {
+    'tree': 'tree',
+    'user': 'username',
+    'account': 'account',
+    'latitude': 'latitude',
+    'longitude': 'longitude',
+    'planted_at': 'planted_at',
+}
+REQUIRED_COLUMNS = ['tree', 'user', 'account', 'latitude', 'longitude']
+REJECTED_COLUMNS = ['line', *COLUMNS, 'error']
+
+STAGING_TABLE = 'trees_import_staging'
+COORDINATE_PATTERN = r'^\s*[+-]?[0-9]{1,3}(\.[0-9]*)?\s*$'
+
+
+class NDJSONReader(io.TextIOBase):
+    """
+    Turns NDJSON lines into CSV rows as COPY reads them, so the file never
+    has to be converted in memory. Lines that can't be parsed are still
+    staged, carrying the parse error, so they end up in the rejected file.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.buffer = ''
+        self.output = io.StringIO()
+        self.writer = csv.writer(self.output)
+
+    def readable(self):
+        return True
+
+    def next_row(self, line):
+        try:
+            planting = json.loads(line)
+            if not isinstance(planting, dict):
+                raise ValueError('Expected a JSON object')
+        except ValueError as error:
+            return ['', '', '', '', '', '', f'Invalid JSON: {error}']
+        return [
+            *(
+                '' if planting.get(column) is None else planting[column]
+                for column in COLUMNS
+            ),
+            '',
+        ]
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            if not line.strip():
+                continue
+            self.writer.writerow(self.next_row(line))
+            self.buffer += self.output.getvalue()
+            self.output.seek(0)
+            self.output.truncate()
+
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports Planted Trees from a CSV or NDJSON file with tree, user, '
+        'account, latitude, longitude and optionally planted_at columns.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=Path)
+        parser.add_argument(
+            '--input',
+            choices=['csv', 'ndjson'],
+            help='File format, guessed from the file extension by default',
+        )
+        parser.add_argument(
+            '--rejected',
+            type=Path,
+            help='Where to write rejected rows, next to the file by default',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.IMPORT_BATCH_SIZE
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Importing requires a PostgreSQL database.')
+
+        path = options['path']
+        if not path.is_file():
+            raise CommandError(f'{path} is not a file.')
+        input_format = options['input'] or (
+            'ndjson' if path.suffix in ('.ndjson', '.jsonl') else 'csv'
+        )
+        rejected_path = options['rejected'] or path.with_name(
+            f'{path.stem}.rejected.csv'
+        )
+
+        imported = rejected = 0
+        with connection.cursor() as cursor:
+            self.create_staging(cursor)
+            try:
+                with transaction.atomic():
+                    with open(path, newline='') as planting_file:
+                        self.copy_to_staging(
+                            cursor, planting_file, input_format
+                        )
+                cursor.execute(
+                    f'SELECT coalesce(max(line), 0) FROM {STAGING_TABLE}'
+                )
+                (total,) = cursor.fetchone()
+
+                with open(rejected_path, 'w', newline='') as rejected_file:
+                    writer = csv.writer(rejected_file)
+                    writer.writerow(REJECTED_COLUMNS)
+                    for start in range(0, total, options['batch_size']):
+                        end = min(start + options['batch_size'], total)
+                        # each batch commits on its own, so a failure only
+                        # loses that batch and locks nothing for long
+                        try:
+                            with transaction.atomic():
+                                rejects = self.insert_batch(cursor, start, end)
+                        except DatabaseError as error:
+                            raise CommandError(
+                                f'Lines {start + 1} to {end} failed: '
+                                f'{str(error).strip()}. Imported {imported} '
+                                f'planted trees before them, rejected '
+                                f'{rejected}.'
+                            ) from error
+                        writer.writerows(rejects)
+                        rejected += len(rejects)
+                        imported += end - start - len(rejects)
+            finally:
+                cursor.execute(f'DROP TABLE IF EXISTS {STAGING_TABLE}')
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Imported {imported} planted trees, rejected {rejected}.'
+            )
+        )
+        if rejected:
+            self.stdout.write(f'Rejected rows written to {rejected_path}')
+
+    def create_staging(self, cursor):
+        cursor.execute(
+            f"""
+            CREATE TEMPORARY TABLE {STAGING_TABLE} (
+                line bigserial PRIMARY KEY,
+                tree text,
+                username text,
+                account text,
+                latitude text,
+                longitude text,
+                planted_at text,
+                error text
+            )
+            """
+        )
+        # casting a bad timestamp raises, which would abort the whole batch
+        cursor.execute(
+            """
+            CREATE OR REPLACE FUNCTION pg_temp.parse_planted_at(value text)
+            RETURNS timestamptz AS $$
+            BEGIN
+                RETURN value::timestamptz;
+            EXCEPTION WHEN others THEN
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+            """
+        )
+
+    def copy_to_staging(self, cursor, planting_file, input_format):
+        if input_format == 'ndjson':
+            columns = [*COLUMNS.values(), 'error']
+            source = NDJSONReader(iter(planting_file))
+        else:
+            header = next(csv.reader([planting_file.readline()]), [])
+            header = [column.strip() for column in header]
+            unknown = set(header) - set(COLUMNS)
+            if unknown:
+                raise CommandError(
+                    f'Unknown columns: {", ".join(sorted(unknown))}'
+                )
+            missing = set(REQUIRED_COLUMNS) - set(header)
+            if missing:
+                raise CommandError(
+                    f'Missing columns: {", ".join(sorted(missing))}'
+                )
+            columns = [COLUMNS[column] for column in header]
+            # the rest of the file goes to COPY untouched
+            source = planting_file
+
+        cursor.copy_expert(
+            f'COPY {STAGING_TABLE} ({", ".join(columns)}) '
+            'FROM STDIN WITH (FORMAT csv)',
+            source,
+        )
+
+    def insert_batch(self, cursor, start, end):
+        # resolves names with joins, inserts the valid rows and returns the
+        # rejected ones, all in a single statement
+        cursor.execute(
+            f"""
+            WITH resolved AS (
+                SELECT
+                    staging.*,
+                    tree.id AS tree_id,
+                    member.user_id,
+                    member.account_id,
+                    CASE
+                        WHEN coalesce(staging.planted_at, '') = '' THEN now()
+                        ELSE pg_temp.parse_planted_at(staging.planted_at)
+                    END AS parsed_planted_at,
+                    CASE
+                        WHEN staging.error IS NOT NULL
+                            THEN staging.error
+                        WHEN tree.id IS NULL
+                            THEN 'This Tree does not exist.'
+                        WHEN planter.id IS NULL
+                            THEN 'This User does not exist.'
+                        WHEN NOT planter.is_active
+                            OR planter.deleted_at IS NOT NULL
+                            THEN 'This User is inactive.'
+                        WHEN account.id IS NULL
+                            THEN 'This Account does not exist.'
+                        WHEN NOT account.active
+                            THEN 'This Account is inactive.'
+                        WHEN member.id IS NULL
+                            THEN 'This Account is not associated with this User.'
+                        WHEN coalesce(staging.latitude, '') !~ %(coordinate)s
+                            THEN 'Invalid latitude.'
+                        WHEN coalesce(staging.longitude, '') !~ %(coordinate)s
+                            THEN 'Invalid longitude.'
+                        -- only cast once the pattern is known to match
+                        WHEN abs(staging.latitude::numeric) > 90
+                            THEN 'Invalid latitude.'
+                        WHEN abs(staging.longitude::numeric) > 180
+                            THEN 'Invalid longitude.'
+                    END AS reason
+                FROM {STAGING_TABLE} AS staging
+                LEFT JOIN {Tree._meta.db_table} AS tree
+                    ON tree.name = staging.tree
+                LEFT JOIN {User._meta.db_table} AS planter
+                    ON planter.username = staging.username
+                LEFT JOIN {Account._meta.db_table} AS account
+                    ON account.name = staging.account
+                LEFT JOIN {User.accounts.through._meta.db_table} AS member
+                    ON member.user_id = planter.id
+                    AND member.account_id = account.id
+                WHERE staging.line > %(start)s AND staging.line <= %(end)s
+            ),
+            validated AS (
+                SELECT
+                    *,
+                    CASE
+                        WHEN reason IS NULL AND parsed_planted_at IS NULL
+                            THEN 'Invalid planted_at.'
+                        ELSE reason
+                    END AS error_reason
+                FROM resolved
+            ),
+            inserted AS (
+                INSERT INTO {PlantedTree._meta.db_table} (
+                    user_id, account_id, tree_id, planted_at, latitude, longitude
+                )
+                SELECT
+                    user_id,
+                    account_id,
+                    tree_id,
+                    parsed_planted_at,
+                    round(latitude::numeric, 6),
+                    round(longitude::numeric, 6)
+                FROM validated
+                WHERE error_reason IS NULL
+                ORDER BY line
+                RETURNING account_id, tree_id, user_id
+            ),
+            {counters.counted_sql('inserted')}
+            SELECT
+                line, tree, username, account, latitude, longitude,
+                planted_at, error_reason
+            FROM validated
+            WHERE error_reason IS NOT NULL
+            ORDER BY line
+            """,
+            {'start': start, 'end': end, 'coordinate': COORDINATE_PATTERN},
+        )
+        return cursor.fetchall()
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from trees import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates the monthly partitions of the Planted Trees for the next '
+        'PLANTINGS_PARTITIONS_AHEAD months, and detaches those older than '
+        'PLANTINGS_RETENTION_MONTHS.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--convert',
+            action='store_true',
+            help='Partition the Planted Trees table first, if it is not.',
+        )
+
+    def handle(self, *args, **options):
+        if options['convert'] and partitions.convert():
+            self.stdout.write('Partitioned the Planted Trees table.')
+        with connection.cursor() as cursor:
+            if not partitions.is_partitioned(cursor):
+                raise CommandError(
+                    'The Planted Trees table is not partitioned, see --convert.'
+                )
+
+        maintained = partitions.maintain()
+        for name in maintained['created']:
+            self.stdout.write(f'Created {name}.')
+        for name, count in maintained['detached'].items():
+            self.stdout.write(f'Detached {name}, with {count} planted trees.')
+        self.stdout.write(self.style.SUCCESS('Partitions are current.'))
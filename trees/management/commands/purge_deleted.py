@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from trees import purge
+
+
+class Command(BaseCommand):
+    help = (
+        'Removes deleted Accounts and Users with their Planted Trees, in '
+        'batches, once or every PURGE_INTERVAL seconds with --watch.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.PURGE_BATCH_SIZE
+        )
+        parser.add_argument(
+            '--watch',
+            action='store_true',
+            help='Keep running, as a purge worker.',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            purged = purge.purge(options['batch_size'])
+            if any(purged.values()) or not options['watch']:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f'Purged {purged["accounts"]} accounts and '
+                        f'{purged["users"]} users, with '
+                        f'{purged["planted_trees"]} planted trees.'
+                    )
+                )
+            if not options['watch']:
+                return
+            close_old_connections()
+            time.sleep(settings.PURGE_INTERVAL)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from trees import counters
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes the planting counters of Accounts, Trees and Users, '
+        'repairing those that drifted.'
+    )
+
+    def handle(self, *args, **options):
+        for field, model in counters.OWNERS.items():
+            repaired = counters.recount(model, field)
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural.capitalize()}: '
+                f'{repaired} repaired'
+            )
+        self.stdout.write(self.style.SUCCESS('Planting counters are current.'))
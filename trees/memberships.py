@@ -0,0 +1,99 @@
+"""
+Active Accounts each User is a member of.
+
+Memberships are loaded once per User, with the Account names, and shared by
+every request of this process for MEMBERSHIP_CACHE_TTL seconds. Changes to
+`User.accounts` and to Accounts drop the affected Users right away; other
+processes notice once their entry expires.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+
+
+class MembershipCache:
+    """
+    Account ids by name of every User, by User id
+    """
+
+    def __init__(self):
+        self.accounts = {}
+        self.lock = threading.Lock()
+
+    def get(self, user) -> dict[str, int]:
+        accounts = self.cached(user)
+        if accounts is None:
+            accounts = self.store(
+                user,
+                dict(
+                    user.accounts.filter(active=True).values_list('name', 'id')
+                ),
+            )
+        return accounts
+
+    async def aget(self, user) -> dict[str, int]:
+        accounts = self.cached(user)
+        if accounts is None:
+            accounts = self.store(
+                user,
+                {
+                    name: pk
+                    async for name, pk in user.accounts.filter(
+                        active=True
+                    ).values_list('name', 'id')
+                },
+            )
+        return accounts
+
+    def cached(self, user) -> dict[str, int] | None:
+        with self.lock:
+            entry = self.accounts.get(user.pk)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        return None
+
+    def store(self, user, accounts: dict[str, int]) -> dict[str, int]:
+        with self.lock:
+            self.accounts[user.pk] = (
+                accounts,
+                time.monotonic() + settings.MEMBERSHIP_CACHE_TTL,
+            )
+        return accounts
+
+    def invalidate(self, user_ids=None):
+        with self.lock:
+            if user_ids is None:
+                self.accounts.clear()
+            else:
+                for user_id in user_ids:
+                    self.accounts.pop(user_id, None)
+
+
+cache = MembershipCache()
+
+
+def account_ids(user) -> set[int]:
+    if not user.is_authenticated:
+        return set()
+    return set(cache.get(user).values())
+
+
+def account_id(user, name: str) -> int | None:
+    # id of the Account with this name, if the user is one of its members
+    if not user.is_authenticated:
+        return None
+    return cache.get(user).get(name)
+
+
+async def aaccount_id(user, name: str) -> int | None:
+    if not user.is_authenticated:
+        return None
+    return (await cache.aget(user)).get(name)
+
+
+def is_member(user, account) -> bool:
+    if not user.is_authenticated:
+        return False
+    return getattr(account, 'pk', account) in cache.get(user).values()
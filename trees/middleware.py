@@ -0,0 +1,66 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+
+from trees.routers import Routing, routing
+
+PRIMARY_PIN_COOKIE = 'primary_pin'
+
+
+class ReplicaMiddleware:
+    """
+    Lets the safe requests of the trees views read from the replicas, and
+    pins a client that wrote to the primary for PRIMARY_PIN_SECONDS
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = Routing()
+        token = routing.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routing.reset(token)
+        return self.pin(response, state)
+
+    async def __acall__(self, request):
+        state = Routing()
+        token = routing.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routing.reset(token)
+        return self.pin(response, state)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None) or getattr(
+            view_func, 'view_class', None
+        )
+        state = routing.get()
+        if state is not None:
+            state.replica_reads = (
+                request.method in SAFE_METHODS
+                and PRIMARY_PIN_COOKIE not in request.COOKIES
+                and view_class is not None
+                and view_class.__module__.startswith('trees.')
+            )
+
+    def pin(self, response, state):
+        if state.wrote:
+            response.set_cookie(
+                PRIMARY_PIN_COOKIE,
+                '1',
+                max_age=settings.PRIMARY_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
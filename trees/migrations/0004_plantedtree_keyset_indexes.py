@@ -0,0 +1,21 @@
+# Generated by Django 5.0.14 on 2026-10-17 11:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trees', '0003_alter_plantedtree_account'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='plantedtree',
+            index=models.Index(fields=['user', 'planted_at', 'id'], name='trees_plant_user_id_35c245_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='plantedtree',
+            index=models.Index(fields=['account', 'planted_at', 'id'], name='trees_plant_account_207d5a_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.0.14 on 2026-10-17 11:28
+
+import trees.spatial
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trees', '0004_plantedtree_keyset_indexes'),
+    ]
+
+    operations = [
+        # mirrors trees.spatial.cell, keep both in sync
+        migrations.RunSQL(
+            sql=[
+                """
+                CREATE OR REPLACE FUNCTION trees_spread_bits(value bigint)
+                RETURNS bigint AS $$
+                BEGIN
+                    value := (value | (value << 16)) & x'0000FFFF0000FFFF'::bigint;
+                    value := (value | (value << 8)) & x'00FF00FF00FF00FF'::bigint;
+                    value := (value | (value << 4)) & x'0F0F0F0F0F0F0F0F'::bigint;
+                    value := (value | (value << 2)) & x'3333333333333333'::bigint;
+                    value := (value | (value << 1)) & x'5555555555555555'::bigint;
+                    RETURN value;
+                END
+                $$ LANGUAGE plpgsql IMMUTABLE STRICT PARALLEL SAFE
+                """,
+                """
+                CREATE OR REPLACE FUNCTION trees_spatial_cell(latitude numeric, longitude numeric)
+                RETURNS bigint AS $$
+                    SELECT
+                        trees_spread_bits(
+                            least(greatest(floor((longitude + 180) * 16777216 / 360), 0), 16777215)::bigint
+                        )
+                        | (
+                            trees_spread_bits(
+                                least(greatest(floor((latitude + 90) * 16777216 / 180), 0), 16777215)::bigint
+                            ) << 1
+                        )
+                $$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+                """,
+            ],
+            reverse_sql=[
+                'DROP FUNCTION IF EXISTS trees_spatial_cell(numeric, numeric)',
+                'DROP FUNCTION IF EXISTS trees_spread_bits(bigint)',
+            ],
+        ),
+        migrations.AddField(
+            model_name='plantedtree',
+            name='cell',
+            field=models.GeneratedField(db_index=True, db_persist=True, expression=trees.spatial.SpatialCell('latitude', 'longitude'), output_field=models.BigIntegerField()),
+        ),
+    ]
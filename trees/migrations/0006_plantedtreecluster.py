@@ -0,0 +1,120 @@
+# Generated by Django 5.0.14 on 2026-10-17 11:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# rows of {rows} grouped into the cluster of every zoom level, mirroring
+# trees.spatial.cluster_cell with CELL_BITS = 24, CLUSTER_DETAIL = 3 and
+# CLUSTER_MAX_ZOOM = 12
+CLUSTERED = """
+    SELECT
+        zoom,
+        planted.cell >> (2 * (24 - zoom - 3)) AS cell,
+        planted.account_id,
+        planted.tree_id,
+        count(*) AS count,
+        sum(planted.latitude)::float8 AS latitude_sum,
+        sum(planted.longitude)::float8 AS longitude_sum
+    FROM {rows} AS planted
+    CROSS JOIN generate_series(0, 12) AS zoom
+    GROUP BY 1, 2, 3, 4
+"""
+
+ADD_CLUSTERS = f"""
+    INSERT INTO trees_plantedtreecluster (
+        zoom, cell, account_id, tree_id, count, latitude_sum, longitude_sum
+    )
+    {CLUSTERED}
+    ON CONFLICT (zoom, cell, account_id, tree_id) DO UPDATE SET
+        count = trees_plantedtreecluster.count + EXCLUDED.count,
+        latitude_sum = trees_plantedtreecluster.latitude_sum + EXCLUDED.latitude_sum,
+        longitude_sum = trees_plantedtreecluster.longitude_sum + EXCLUDED.longitude_sum
+"""
+
+# only updates existing clusters, so a cascade deleting the Account or Tree
+# of the clusters never recreates them
+REMOVE_CLUSTERS = f"""
+    UPDATE trees_plantedtreecluster AS cluster SET
+        count = cluster.count - removed.count,
+        latitude_sum = cluster.latitude_sum - removed.latitude_sum,
+        longitude_sum = cluster.longitude_sum - removed.longitude_sum
+    FROM ({CLUSTERED}) AS removed
+    WHERE cluster.zoom = removed.zoom
+        AND cluster.cell = removed.cell
+        AND cluster.account_id = removed.account_id
+        AND cluster.tree_id = removed.tree_id;
+    DELETE FROM trees_plantedtreecluster WHERE count <= 0;
+"""
+
+CREATE_TRIGGERS = f"""
+CREATE OR REPLACE FUNCTION trees_plantedtree_clusters() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        {REMOVE_CLUSTERS.format(rows='old_rows')}
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        {ADD_CLUSTERS.format(rows='new_rows')};
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trees_plantedtree_clusters_insert
+    AFTER INSERT ON trees_plantedtree
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trees_plantedtree_clusters();
+
+CREATE TRIGGER trees_plantedtree_clusters_update
+    AFTER UPDATE ON trees_plantedtree
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trees_plantedtree_clusters();
+
+CREATE TRIGGER trees_plantedtree_clusters_delete
+    AFTER DELETE ON trees_plantedtree
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trees_plantedtree_clusters();
+"""
+
+DROP_TRIGGERS = """
+DROP TRIGGER IF EXISTS trees_plantedtree_clusters_insert ON trees_plantedtree;
+DROP TRIGGER IF EXISTS trees_plantedtree_clusters_update ON trees_plantedtree;
+DROP TRIGGER IF EXISTS trees_plantedtree_clusters_delete ON trees_plantedtree;
+DROP FUNCTION IF EXISTS trees_plantedtree_clusters();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trees', '0005_plantedtree_cell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlantedTreeCluster',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.PositiveSmallIntegerField()),
+                ('cell', models.BigIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('latitude_sum', models.FloatField(default=0)),
+                ('longitude_sum', models.FloatField(default=0)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='trees.account')),
+                ('tree', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='trees.tree')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('count__lte', 0)), fields=['count'], name='empty_cluster')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='plantedtreecluster',
+            constraint=models.UniqueConstraint(fields=('zoom', 'cell', 'account', 'tree'), name='unique_cluster'),
+        ),
+        migrations.RunSQL(
+            sql=[
+                ADD_CLUSTERS.format(rows='trees_plantedtree'),
+                CREATE_TRIGGERS,
+            ],
+            reverse_sql=[DROP_TRIGGERS],
+        ),
+    ]
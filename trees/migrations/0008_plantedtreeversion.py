@@ -0,0 +1,88 @@
+# Generated by Django 5.0.14 on 2026-10-17 11:58
+
+import django.utils.timezone
+from django.db import migrations, models
+
+# bumps the counters of every Account and User found in {rows}, in a fixed
+# order so that concurrent statements can't deadlock
+BUMP_VERSIONS = """
+    INSERT INTO trees_plantedtreeversion (scope, owner_id, version, modified)
+    SELECT scope, owner_id, 1, now()
+    FROM (
+        SELECT 'account' AS scope, account_id AS owner_id FROM {rows} AS changed
+        UNION
+        SELECT 'user' AS scope, user_id AS owner_id FROM {rows} AS changed
+    ) AS owners
+    ORDER BY scope, owner_id
+    ON CONFLICT (scope, owner_id) DO UPDATE SET
+        version = trees_plantedtreeversion.version + 1,
+        modified = EXCLUDED.modified
+"""
+
+# rows may have moved to another Account or User
+MOVED_ROWS = """(
+    SELECT account_id, user_id FROM old_rows
+    UNION SELECT account_id, user_id FROM new_rows
+)"""
+
+CREATE_TRIGGERS = f"""
+CREATE OR REPLACE FUNCTION trees_plantedtree_versions() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        {BUMP_VERSIONS.format(rows='new_rows')};
+    ELSIF TG_OP = 'DELETE' THEN
+        {BUMP_VERSIONS.format(rows='old_rows')};
+    ELSE
+        {BUMP_VERSIONS.format(rows=MOVED_ROWS)};
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trees_plantedtree_versions_insert
+    AFTER INSERT ON trees_plantedtree
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trees_plantedtree_versions();
+
+CREATE TRIGGER trees_plantedtree_versions_update
+    AFTER UPDATE ON trees_plantedtree
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trees_plantedtree_versions();
+
+CREATE TRIGGER trees_plantedtree_versions_delete
+    AFTER DELETE ON trees_plantedtree
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trees_plantedtree_versions();
+"""
+
+DROP_TRIGGERS = """
+DROP TRIGGER IF EXISTS trees_plantedtree_versions_insert ON trees_plantedtree;
+DROP TRIGGER IF EXISTS trees_plantedtree_versions_update ON trees_plantedtree;
+DROP TRIGGER IF EXISTS trees_plantedtree_versions_delete ON trees_plantedtree;
+DROP FUNCTION IF EXISTS trees_plantedtree_versions();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trees', '0007_authtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlantedTreeVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('account', 'Account'), ('user', 'User')], max_length=7)),
+                ('owner_id', models.BigIntegerField()),
+                ('version', models.BigIntegerField(default=0)),
+                ('modified', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='plantedtreeversion',
+            constraint=models.UniqueConstraint(fields=('scope', 'owner_id'), name='unique_planted_tree_version'),
+        ),
+        migrations.RunSQL(sql=[CREATE_TRIGGERS], reverse_sql=[DROP_TRIGGERS]),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.0.14 on 2026-10-17 12:18
+
+from django.db import migrations, models
+
+# counts the Planted Trees already there
+COUNT_PLANTINGS = """
+    UPDATE {table} AS owner
+    SET planted_count = counted.count
+    FROM (
+        SELECT {field}, count(*) AS count
+        FROM trees_plantedtree
+        GROUP BY {field}
+    ) AS counted
+    WHERE owner.id = counted.{field}
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trees', '0008_plantedtreeversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='planted_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tree',
+            name='planted_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='planted_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(
+            [
+                COUNT_PLANTINGS.format(table=table, field=field)
+                for table, field in [
+                    ('trees_account', 'account_id'),
+                    ('trees_tree', 'tree_id'),
+                    ('trees_user', 'user_id'),
+                ]
+            ],
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,115 @@
+# Generated by Django 5.0.14 on 2026-10-17 12:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# rows of {rows} counted per UTC day, week and month, Account and Tree
+BUCKETED = """
+    SELECT
+        period,
+        date_trunc(period, planted.planted_at AT TIME ZONE 'UTC')::date AS bucket,
+        planted.account_id,
+        planted.tree_id,
+        count(*) AS count
+    FROM {rows} AS planted
+    CROSS JOIN unnest(ARRAY['day', 'week', 'month']) AS period
+    GROUP BY 1, 2, 3, 4
+"""
+
+# in a fixed order, so that concurrent statements can't deadlock
+ADD_ROLLUPS = f"""
+    INSERT INTO trees_plantingrollup (period, bucket, account_id, tree_id, count)
+    SELECT * FROM ({BUCKETED}) AS added
+    ORDER BY period, account_id, bucket, tree_id
+    ON CONFLICT (period, account_id, bucket, tree_id) DO UPDATE SET
+        count = trees_plantingrollup.count + EXCLUDED.count
+"""
+
+# only updates existing rollups, so a cascade deleting the Account or Tree
+# of the rollups never recreates them
+REMOVE_ROLLUPS = f"""
+    WITH removed AS ({BUCKETED}),
+    updated AS (
+        UPDATE trees_plantingrollup AS rollup SET
+            count = rollup.count - removed.count
+        FROM removed
+        WHERE rollup.period = removed.period
+            AND rollup.account_id = removed.account_id
+            AND rollup.bucket = removed.bucket
+            AND rollup.tree_id = removed.tree_id
+        RETURNING rollup.id, rollup.count
+    )
+    DELETE FROM trees_plantingrollup
+    WHERE id IN (SELECT id FROM updated WHERE count <= 0);
+"""
+
+CREATE_TRIGGERS = f"""
+CREATE OR REPLACE FUNCTION trees_plantedtree_rollups() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        {REMOVE_ROLLUPS.format(rows='old_rows')}
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        {ADD_ROLLUPS.format(rows='new_rows')};
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trees_plantedtree_rollups_insert
+    AFTER INSERT ON trees_plantedtree
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trees_plantedtree_rollups();
+
+CREATE TRIGGER trees_plantedtree_rollups_update
+    AFTER UPDATE ON trees_plantedtree
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trees_plantedtree_rollups();
+
+CREATE TRIGGER trees_plantedtree_rollups_delete
+    AFTER DELETE ON trees_plantedtree
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trees_plantedtree_rollups();
+"""
+
+DROP_TRIGGERS = """
+DROP TRIGGER IF EXISTS trees_plantedtree_rollups_insert ON trees_plantedtree;
+DROP TRIGGER IF EXISTS trees_plantedtree_rollups_update ON trees_plantedtree;
+DROP TRIGGER IF EXISTS trees_plantedtree_rollups_delete ON trees_plantedtree;
+DROP FUNCTION IF EXISTS trees_plantedtree_rollups();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trees', '0009_planting_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlantingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('week', 'Week'), ('month', 'Month')], max_length=5)),
+                ('bucket', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='trees.account')),
+                ('tree', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='trees.tree')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'bucket'], name='planting_rollup_bucket')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='plantingrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'account', 'bucket', 'tree'), name='unique_planting_rollup'),
+        ),
+        migrations.RunSQL(
+            sql=[
+                ADD_ROLLUPS.format(rows='trees_plantedtree'),
+                CREATE_TRIGGERS,
+            ],
+            reverse_sql=[DROP_TRIGGERS],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-17 12:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trees', '0010_plantingrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='deleted_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='deleted_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+    ]
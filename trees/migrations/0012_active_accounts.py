@@ -0,0 +1,107 @@
+# Generated by Django 5.0.14 on 2026-10-17 12:29
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+# deleted Accounts are left alone, their Planted Trees are purged instead
+CREATE_TRIGGER = """
+CREATE OR REPLACE FUNCTION trees_account_active() RETURNS trigger AS $$
+BEGIN
+    IF OLD.active IS NOT DISTINCT FROM NEW.active THEN
+        NEW.deactivated_at := OLD.deactivated_at;
+        RETURN NEW;
+    END IF;
+    NEW.deactivated_at := CASE WHEN NEW.active THEN NULL ELSE now() END;
+    IF NEW.deleted_at IS NULL THEN
+        UPDATE trees_plantedtree SET account_active = NEW.active
+        WHERE account_id = NEW.id AND account_active IS DISTINCT FROM NEW.active;
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trees_account_active
+    BEFORE UPDATE ON trees_account
+    FOR EACH ROW EXECUTE FUNCTION trees_account_active();
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS trees_account_active ON trees_account;
+DROP FUNCTION IF EXISTS trees_account_active();
+"""
+
+COPY_INACTIVE = """
+UPDATE trees_account SET deactivated_at = now() WHERE NOT active;
+UPDATE trees_plantedtree AS planted SET account_active = false
+FROM trees_account AS account
+WHERE account.id = planted.account_id AND NOT account.active;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trees', '0011_deleted_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPlantedTree',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('planted_at', models.DateTimeField()),
+                ('latitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('longitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('cell', models.BigIntegerField()),
+                ('account_active', models.BooleanField(default=False)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='plantedtree',
+            name='trees_plant_user_id_35c245_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='plantedtree',
+            name='trees_plant_account_207d5a_idx',
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='deactivated_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='plantedtree',
+            name='account_active',
+            field=models.BooleanField(db_default=True, default=True, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='plantedtree',
+            index=models.Index(condition=models.Q(('account_active', True)), fields=['user', 'planted_at', 'id'], name='live_user_planted'),
+        ),
+        migrations.AddIndex(
+            model_name='plantedtree',
+            index=models.Index(condition=models.Q(('account_active', True)), fields=['account', 'planted_at', 'id'], name='live_account_planted'),
+        ),
+        migrations.AddField(
+            model_name='archivedplantedtree',
+            name='account',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='trees.account'),
+        ),
+        migrations.AddField(
+            model_name='archivedplantedtree',
+            name='tree',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='trees.tree'),
+        ),
+        migrations.AddField(
+            model_name='archivedplantedtree',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunSQL(
+            sql=[COPY_INACTIVE, CREATE_TRIGGER],
+            reverse_sql=[DROP_TRIGGER],
+        ),
+    ]
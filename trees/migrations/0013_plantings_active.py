@@ -0,0 +1,116 @@
+# Generated by Django 5.0.14 on 2026-10-17 13:05
+
+import importlib
+
+from django.db import migrations
+
+clusters = importlib.import_module('trees.migrations.0006_plantedtreecluster')
+rollups = importlib.import_module('trees.migrations.0010_plantingrollup')
+active_accounts = importlib.import_module('trees.migrations.0012_active_accounts')
+
+# the account_active flag of the Planted Trees is now set by trees.archive,
+# in batches, so changing an Account only bumps the versions of its
+# listings and of those of its Users, which hide or show its trees at once
+CREATE_ACCOUNT_TRIGGER = """
+CREATE OR REPLACE FUNCTION trees_account_active() RETURNS trigger AS $$
+BEGIN
+    IF OLD.active IS NOT DISTINCT FROM NEW.active THEN
+        NEW.deactivated_at := OLD.deactivated_at;
+    ELSE
+        NEW.deactivated_at := CASE WHEN NEW.active THEN NULL ELSE now() END;
+    END IF;
+    IF (OLD.active, OLD.deleted_at) IS NOT DISTINCT FROM (NEW.active, NEW.deleted_at) THEN
+        RETURN NEW;
+    END IF;
+    INSERT INTO trees_plantedtreeversion (scope, owner_id, version, modified)
+    SELECT scope, owner_id, 1, now()
+    FROM (
+        SELECT 'account' AS scope, NEW.id AS owner_id
+        UNION
+        SELECT 'user' AS scope, user_id AS owner_id
+        FROM trees_user_accounts WHERE account_id = NEW.id
+    ) AS owners
+    ORDER BY scope, owner_id
+    ON CONFLICT (scope, owner_id) DO UPDATE SET
+        version = trees_plantedtreeversion.version + 1,
+        modified = EXCLUDED.modified;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+# rows of an UPDATE whose cluster or rollup changed, leaving out those
+# whose account_active flag alone was set
+MOVED = """(
+    SELECT {side}.* FROM old_rows JOIN new_rows USING (id)
+    WHERE (old_rows.account_id, old_rows.tree_id, old_rows.planted_at,
+        old_rows.latitude, old_rows.longitude)
+    IS DISTINCT FROM (new_rows.account_id, new_rows.tree_id,
+        new_rows.planted_at, new_rows.latitude, new_rows.longitude)
+)"""
+
+CREATE_COUNTING_TRIGGERS = f"""
+CREATE OR REPLACE FUNCTION trees_plantedtree_clusters() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        IF NOT EXISTS {MOVED.format(side='old_rows')} THEN
+            RETURN NULL;
+        END IF;
+        {clusters.REMOVE_CLUSTERS.format(rows=MOVED.format(side='old_rows'))}
+        {clusters.ADD_CLUSTERS.format(rows=MOVED.format(side='new_rows'))};
+    ELSIF TG_OP = 'DELETE' THEN
+        {clusters.REMOVE_CLUSTERS.format(rows='old_rows')}
+    ELSE
+        {clusters.ADD_CLUSTERS.format(rows='new_rows')};
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trees_plantedtree_rollups() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        IF NOT EXISTS {MOVED.format(side='old_rows')} THEN
+            RETURN NULL;
+        END IF;
+        {rollups.REMOVE_ROLLUPS.format(rows=MOVED.format(side='old_rows'))}
+        {rollups.ADD_ROLLUPS.format(rows=MOVED.format(side='new_rows'))};
+    ELSIF TG_OP = 'DELETE' THEN
+        {rollups.REMOVE_ROLLUPS.format(rows='old_rows')}
+    ELSE
+        {rollups.ADD_ROLLUPS.format(rows='new_rows')};
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+# the functions as 0006, 0010 and 0012 created them; their triggers stay
+REVERSE_SQL = [
+    active_accounts.CREATE_TRIGGER.split('CREATE TRIGGER')[0],
+    clusters.CREATE_TRIGGERS.split('CREATE TRIGGER')[0],
+    rollups.CREATE_TRIGGERS.split('CREATE TRIGGER')[0],
+]
+
+# what the account_active flag of the Planted Trees of each Account was last
+# set to, left out of the model so that saving a stale Account can't undo it
+ADD_COLUMN = """
+ALTER TABLE trees_account ADD COLUMN plantings_active boolean NOT NULL DEFAULT true;
+UPDATE trees_account SET plantings_active = active;
+"""
+
+DROP_COLUMN = 'ALTER TABLE trees_account DROP COLUMN plantings_active'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trees', '0012_active_accounts'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[ADD_COLUMN, CREATE_ACCOUNT_TRIGGER, CREATE_COUNTING_TRIGGERS],
+            reverse_sql=[*REVERSE_SQL, DROP_COLUMN],
+        ),
+    ]
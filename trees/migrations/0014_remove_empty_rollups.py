@@ -0,0 +1,65 @@
+# Generated by Django 5.0.14 on 2026-10-17 15:40
+
+import importlib
+
+from django.db import migrations
+
+rollups = importlib.import_module('trees.migrations.0010_plantingrollup')
+plantings_active = importlib.import_module('trees.migrations.0013_plantings_active')
+
+# a statement can't delete the rows its own UPDATE changed, so the rollups
+# emptied by REMOVE_ROLLUPS of 0010 were kept; like the clusters, they are
+# now updated and deleted by two statements
+REMOVE_ROLLUPS = f"""
+    UPDATE trees_plantingrollup AS rollup SET
+        count = rollup.count - removed.count
+    FROM ({rollups.BUCKETED}) AS removed
+    WHERE rollup.period = removed.period
+        AND rollup.account_id = removed.account_id
+        AND rollup.bucket = removed.bucket
+        AND rollup.tree_id = removed.tree_id;
+    DELETE FROM trees_plantingrollup WHERE count <= 0;
+"""
+
+CREATE_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION trees_plantedtree_rollups() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        IF NOT EXISTS {plantings_active.MOVED.format(side='old_rows')} THEN
+            RETURN NULL;
+        END IF;
+        {REMOVE_ROLLUPS.format(rows=plantings_active.MOVED.format(side='old_rows'))}
+        {rollups.ADD_ROLLUPS.format(rows=plantings_active.MOVED.format(side='new_rows'))};
+    ELSIF TG_OP = 'DELETE' THEN
+        {REMOVE_ROLLUPS.format(rows='old_rows')}
+    ELSE
+        {rollups.ADD_ROLLUPS.format(rows='new_rows')};
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+# the function as 0013 created it
+REVERSE_SQL = (
+    'CREATE OR REPLACE FUNCTION trees_plantedtree_rollups()'
+    + plantings_active.CREATE_COUNTING_TRIGGERS.split(
+        'CREATE OR REPLACE FUNCTION trees_plantedtree_rollups()'
+    )[1]
+)
+
+DELETE_EMPTY = 'DELETE FROM trees_plantingrollup WHERE count <= 0'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trees', '0013_plantings_active'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[CREATE_FUNCTION, DELETE_EMPTY],
+            reverse_sql=[REVERSE_SQL],
+        ),
+    ]
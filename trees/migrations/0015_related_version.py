@@ -0,0 +1,56 @@
+# Generated by Django 5.0.14 on 2026-10-17 15:52
+
+from django.db import migrations, models
+
+# the Trees, Users and Accounts nested in the listings, by the columns
+# their serializers render, and the memberships listing the Accounts of Users
+RENDERED = {
+    'trees_tree': 'UPDATE OF name, scientific_name, planted_count',
+    'trees_user': 'UPDATE OF username, is_active, date_joined, planted_count',
+    'trees_account': 'UPDATE OF name, created, active, planted_count',
+    'trees_user_accounts': 'INSERT OR UPDATE OR DELETE',
+}
+
+CREATE_TRIGGERS = """
+CREATE OR REPLACE FUNCTION trees_related_version() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO trees_plantedtreeversion (scope, owner_id, version, modified)
+    VALUES ('related', 0, 1, now())
+    ON CONFLICT (scope, owner_id) DO UPDATE SET
+        version = trees_plantedtreeversion.version + 1,
+        modified = EXCLUDED.modified;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+""" + ''.join(
+    f"""
+CREATE TRIGGER {table}_related_version
+    AFTER {events} ON {table}
+    FOR EACH STATEMENT EXECUTE FUNCTION trees_related_version();
+"""
+    for table, events in RENDERED.items()
+)
+
+DROP_TRIGGERS = ''.join(
+    f'DROP TRIGGER IF EXISTS {table}_related_version ON {table};\n'
+    for table in RENDERED
+) + """
+DROP FUNCTION IF EXISTS trees_related_version();
+DELETE FROM trees_plantedtreeversion WHERE scope = 'related';
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trees', '0014_remove_empty_rollups'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='plantedtreeversion',
+            name='scope',
+            field=models.CharField(choices=[('account', 'Account'), ('user', 'User'), ('related', 'Related')], max_length=7),
+        ),
+        migrations.RunSQL(sql=[CREATE_TRIGGERS], reverse_sql=[DROP_TRIGGERS]),
+    ]
@@ -1,13 +1,53 @@
+import hashlib
+import secrets
 from decimal import Decimal
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
-from django.db import IntegrityError, models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Q
+from django.dispatch import Signal
 from django.utils.timezone import now
 
+from trees import memberships
+from trees.spatial import SpatialCell, cell_ranges
 
-class Account(models.Model):
+
+def _clean_coordinate(field_name: str, value) -> Decimal:
+    # rounds like the database would, so bad values fail before inserting
+    field = PlantedTree._meta.get_field(field_name)
+    coordinate = field.to_python(value)
+    if coordinate is None:
+        raise ValidationError(f'The {field_name} is required.')
+    coordinate = coordinate.quantize(Decimal(1).scaleb(-field.decimal_places))
+    field.run_validators(coordinate)
+    return coordinate
+
+
+class PlantingCounter(models.Model):
+    """
+    Number of Planted Trees, kept current by trees.counters
+    """
+
+    planted_count = models.IntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        # the counter only moves through F() updates, so a copy loaded
+        # before one of them must not write its stale value back
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'planted_count'
+            ]
+        super().save(*args, **kwargs)
+
+
+class Account(PlantingCounter):
     """
     This defines a Group of Users that are able to access the Tree Everywhere application
     """
@@ -17,15 +57,24 @@ class Account(models.Model):
     )
     created = models.DateTimeField(auto_now_add=True)
     active = models.BooleanField(default=True)
+    # set by the database whenever active turns false, see trees.archive
+    deactivated_at = models.DateTimeField(null=True, editable=False)
+    # set when deleted, until trees.purge removes it with its plantings
+    deleted_at = models.DateTimeField(null=True, editable=False)
 
     class Meta:
         ordering = ['created']
 
+    def delete_later(self):
+        self.active = False
+        self.deleted_at = now()
+        self.save(update_fields=['active', 'deleted_at'])
+
     def __str__(self) -> str:
         return f"{self.name}, {'active' if self.active else 'inactive'}"
 
 
-class Tree(models.Model):
+class Tree(PlantingCounter):
     name = models.CharField(
         max_length=settings.CHAR_FIELD_MAX_LENGTH, unique=True
     )
@@ -35,12 +84,19 @@ class Tree(models.Model):
         return f'{self.name}, {self.scientific_name}'
 
 
-class User(AbstractUser):
+class User(PlantingCounter, AbstractUser):
     accounts = models.ManyToManyField(Account, related_name='users')
+    # set when deleted, until trees.purge removes it with its plantings
+    deleted_at = models.DateTimeField(null=True, editable=False)
 
     class Meta:
         ordering = ['username']
 
+    def delete_later(self):
+        self.is_active = False
+        self.deleted_at = now()
+        self.save(update_fields=['is_active', 'deleted_at'])
+
     def __str__(self) -> str:
         return self.username
 
@@ -50,7 +106,7 @@ class User(AbstractUser):
         tree: Tree,
         location: tuple[Decimal, Decimal],
     ):
-        if account not in self.accounts.all():
+        if not memberships.is_member(self, account):
             raise ValueError('This Account is not associated with this User.')
 
         latitude, longitude = location
@@ -69,29 +125,116 @@ class User(AbstractUser):
         account: Account,
         trees: list[tuple[Tree, tuple[Decimal, Decimal]]],
     ) -> dict:
-        success, failed = [], []
+        """
+        Plants many trees at once, checking the Account membership once,
+        resolving every Tree in a single query and inserting in batches.
+
+        Entries that can't be planted are returned in `failed`, with the
+        matching reason at the same position in `errors`.
+        """
+        success, failed, errors = [], [], []
+
+        if not memberships.is_member(self, account):
+            return {
+                'success': success,
+                'failed': list(trees),
+                'errors': ['This Account is not associated with this User.']
+                * len(trees),
+            }
+
+        tree_ids = {
+            getattr(tree_entry[0], 'pk', None)
+            for tree_entry in trees
+            if isinstance(tree_entry, (tuple, list)) and tree_entry
+        }
+        tree_ids.discard(None)
+        existing_tree_ids = set(
+            Tree.objects.filter(pk__in=tree_ids).values_list('pk', flat=True)
+        )
+
+        pending = []
         for tree_entry in trees:
-            tree, location = tree_entry
             try:
-                success.append(
-                    self.plant_tree(
-                        account=account, tree=tree, location=location
-                    )
+                tree, (latitude, longitude) = tree_entry
+                if getattr(tree, 'pk', None) not in existing_tree_ids:
+                    raise ObjectDoesNotExist('This Tree does not exist.')
+                planted_tree = PlantedTree(
+                    account=account,
+                    user=self,
+                    tree=tree,
+                    latitude=_clean_coordinate('latitude', latitude),
+                    longitude=_clean_coordinate('longitude', longitude),
                 )
             except (
+                TypeError,
                 ValueError,
                 ValidationError,
-                IntegrityError,
                 ObjectDoesNotExist,
-            ):
+            ) as error:
                 failed.append(tree_entry)
+                errors.append(
+                    '; '.join(error.messages)
+                    if isinstance(error, ValidationError)
+                    else str(error)
+                )
+                continue
+            pending.append((tree_entry, planted_tree))
+
+        batch_size = settings.BULK_BATCH_SIZE
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start : start + batch_size]
+            try:
+                with transaction.atomic():
+                    PlantedTree.objects.bulk_create(
+                        [planted_tree for _, planted_tree in batch]
+                    )
+                success.extend(planted_tree for _, planted_tree in batch)
+            except IntegrityError:
+                # a bad row rejects the whole batch, so find it row by row
+                for tree_entry, planted_tree in batch:
+                    try:
+                        with transaction.atomic():
+                            planted_tree.save()
+                        success.append(planted_tree)
+                    except IntegrityError as error:
+                        failed.append(tree_entry)
+                        errors.append(str(error))
 
         return {
             'success': success,
             'failed': failed,
+            'errors': errors,
         }
 
 
+class AuthToken(models.Model):
+    """
+    API token of a User. Only the SHA-256 digest of the key is stored, see
+    trees.authentication
+    """
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='auth_tokens'
+    )
+    digest = models.CharField(max_length=64, unique=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f'Token of {self.user}, created {self.created}'
+
+    @classmethod
+    def issue(cls, user: User) -> tuple['AuthToken', str]:
+        # the key is only ever known by whoever it is handed to
+        key = secrets.token_urlsafe(32)
+        token = cls.objects.create(user=user, digest=token_digest(key))
+        return token, key
+
+
+def token_digest(key: str) -> str:
+    # keys are random, so a fast digest is as good as a password hasher
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     about = models.TextField()
@@ -101,6 +244,49 @@ class Profile(models.Model):
         return self.user.date_joined
 
 
+# sent after PlantedTrees are inserted by bulk_create, which skips post_save
+bulk_planted = Signal()
+
+
+class PlantedTreeQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # receivers update counters, which must commit with the rows
+        with transaction.atomic(using=self.db, savepoint=False):
+            planted_trees = super().bulk_create(objs, *args, **kwargs)
+            bulk_planted.send(sender=self.model, instances=planted_trees)
+        return planted_trees
+
+    def live(self):
+        # Planted Trees of active Accounts, served by the partial indexes;
+        # the flag follows the Account in the background, so the Account
+        # itself hides them as soon as it's deactivated or deleted
+        return self.filter(account_active=True, account__active=True)
+
+    def within(self, min_latitude, min_longitude, max_latitude, max_longitude):
+        """
+        Planted Trees inside the bounding box, found through the indexed
+        spatial cell. Boxes crossing the antimeridian have
+        `min_longitude > max_longitude`.
+        """
+        if min_longitude > max_longitude:
+            boxes = [(min_longitude, 180), (-180, max_longitude)]
+        else:
+            boxes = [(min_longitude, max_longitude)]
+
+        condition = Q()
+        for west, east in boxes:
+            cells = Q()
+            for start, end in cell_ranges(
+                min_latitude, west, max_latitude, east
+            ):
+                cells |= Q(cell__range=(start, end))
+            condition |= cells & Q(
+                latitude__range=(min_latitude, max_latitude),
+                longitude__range=(west, east),
+            )
+        return self.filter(condition)
+
+
 class PlantedTree(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     account = models.ForeignKey(Account, on_delete=models.CASCADE)
@@ -110,6 +296,53 @@ class PlantedTree(models.Model):
     # location stored in latitude and longitude with less than a meter precision
     latitude = models.DecimalField(max_digits=9, decimal_places=6, default=0)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, default=0)
+    # computed by the database on every write, see trees.spatial
+    cell = models.GeneratedField(
+        expression=SpatialCell('latitude', 'longitude'),
+        output_field=models.BigIntegerField(),
+        db_persist=True,
+        db_index=True,
+    )
+    # copy of account.active, kept by a trigger on the Accounts table
+    account_active = models.BooleanField(
+        default=True, db_default=True, editable=False
+    )
+
+    objects = PlantedTreeQuerySet.as_manager()
+
+    # what the planting counters last counted this tree for
+    counted_fields = ('account_id', 'tree_id', 'user_id')
+
+    class Meta:
+        indexes = [
+            # keyset pagination of user and account listings, which only
+            # ever show the trees of active Accounts
+            models.Index(
+                fields=['user', 'planted_at', 'id'],
+                name='live_user_planted',
+                condition=Q(account_active=True),
+            ),
+            models.Index(
+                fields=['account', 'planted_at', 'id'],
+                name='live_account_planted',
+                condition=Q(account_active=True),
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.counted = instance.counted_owners()
+        return instance
+
+    def counted_owners(self) -> tuple:
+        # deferred fields are left out rather than fetched
+        return tuple(self.__dict__.get(field) for field in self.counted_fields)
+
+    def save(self, *args, **kwargs):
+        # post_save receivers update counters, which must commit with the row
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            super().save(*args, **kwargs)
 
     @property
     def age(self):
@@ -128,3 +361,124 @@ class PlantedTree(models.Model):
     @property
     def location(self):
         return (float(self.latitude), float(self.longitude))
+
+
+class PlantedTreeCluster(models.Model):
+    """
+    Rollup of Planted Trees per zoom level, cluster cell, Account and Tree,
+    see trees.spatial for the cells.
+
+    Rows are maintained by database triggers on the Planted Trees table, so
+    every write path, bulk and raw SQL ones included, keeps them current.
+    """
+
+    zoom = models.PositiveSmallIntegerField()
+    cell = models.BigIntegerField()
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    tree = models.ForeignKey(Tree, on_delete=models.CASCADE)
+    count = models.IntegerField(default=0)
+    latitude_sum = models.FloatField(default=0)
+    longitude_sum = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['zoom', 'cell', 'account', 'tree'],
+                name='unique_cluster',
+            ),
+        ]
+        indexes = [
+            # emptied clusters are found and removed through this
+            models.Index(
+                fields=['count'],
+                name='empty_cluster',
+                condition=Q(count__lte=0),
+            ),
+        ]
+
+
+class PlantedTreeVersion(models.Model):
+    """
+    Change counter of the Planted Trees of an Account or a User, used to
+    answer conditional requests for their listings.
+
+    Rows are bumped by database triggers on the Planted Trees table, so
+    inserts, updates and deletes count whatever path they come from. The
+    single RELATED row is bumped by changes to the Trees, Users and
+    Accounts rendered along with them, planting counts included.
+    """
+
+    ACCOUNT = 'account'
+    USER = 'user'
+    RELATED = 'related'
+
+    scope = models.CharField(
+        max_length=7,
+        choices=[(ACCOUNT, 'Account'), (USER, 'User'), (RELATED, 'Related')],
+    )
+    owner_id = models.BigIntegerField()
+    version = models.BigIntegerField(default=0)
+    modified = models.DateTimeField(default=now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['scope', 'owner_id'],
+                name='unique_planted_tree_version',
+            ),
+        ]
+
+
+class PlantingRollup(models.Model):
+    """
+    Plantings per day, week and month, Account and Tree, with buckets
+    starting on UTC dates and weeks on Mondays.
+
+    Rows are maintained by database triggers on the Planted Trees table, so
+    every write path, bulk and raw SQL ones included, keeps them current.
+    """
+
+    DAY = 'day'
+    WEEK = 'week'
+    MONTH = 'month'
+
+    period = models.CharField(
+        max_length=5, choices=[(DAY, 'Day'), (WEEK, 'Week'), (MONTH, 'Month')]
+    )
+    bucket = models.DateField()
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    tree = models.ForeignKey(Tree, on_delete=models.CASCADE)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # also serves the series of an Account
+            models.UniqueConstraint(
+                fields=['period', 'account', 'bucket', 'tree'],
+                name='unique_planting_rollup',
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['period', 'bucket'], name='planting_rollup_bucket'
+            ),
+        ]
+
+
+class ArchivedPlantedTree(models.Model):
+    """
+    Planted Trees of Accounts inactive for longer than ARCHIVE_AFTER_DAYS,
+    moved out of the Planted Trees table by trees.archive, with the same
+    columns and ids.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    tree = models.ForeignKey(Tree, on_delete=models.CASCADE)
+    planted_at = models.DateTimeField()
+    latitude = models.DecimalField(max_digits=9, decimal_places=6)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    cell = models.BigIntegerField()
+    account_active = models.BooleanField(default=False)
+    archived_at = models.DateTimeField(default=now)
@@ -0,0 +1,429 @@
+"""
+k-nearest-neighbour lookups of Planted Trees.
+
+Each Account gets an in-process KD-tree of its trees, built from the
+database in the background the first time it's looked up, and kept
+current by the PlantedTree signals and bulk paths, once their transactions
+commit. Until it's built, lookups are answered by `nearest_sql`. Points
+are stored as unit vectors, so the straight-line (chord) distance between
+them orders trees exactly like the great-circle distance, with no special
+cases at the poles or the antimeridian.
+
+Writes made by other processes, or by paths that send no signals, are only
+picked up after NEAREST_INDEX_TTL seconds, when the index is rebuilt. The
+`nearest_sql` fallback always reads from the database instead.
+"""
+
+import heapq
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from math import asin, cos, radians, sin, sqrt
+
+import numpy as np
+from django.conf import settings
+from django.db import connections, transaction
+
+from trees.models import PlantedTree
+
+EARTH_RADIUS = 6_371_008.8  # meters
+LEAF_SIZE = 64
+
+
+def to_vector(latitude, longitude) -> tuple[float, float, float]:
+    latitude, longitude = radians(float(latitude)), radians(float(longitude))
+    return (
+        cos(latitude) * cos(longitude),
+        cos(latitude) * sin(longitude),
+        sin(latitude),
+    )
+
+
+def chord_to_meters(squared_chord: float) -> float:
+    return 2 * EARTH_RADIUS * asin(min(sqrt(squared_chord) / 2, 1.0))
+
+
+def distance(first: tuple, second: tuple) -> float:
+    # great-circle distance in meters between two (latitude, longitude)
+    a, b = to_vector(*first), to_vector(*second)
+    return chord_to_meters(sum((i - j) ** 2 for i, j in zip(a, b)))
+
+
+class PointIndex:
+    """
+    Static KD-tree over unit vectors with a small write buffer.
+
+    Points are sorted into KD order inside flat arrays, so the tree costs
+    a few bytes per point. Added points go to the buffer and removed ones
+    are masked, until the buffer grows enough to be worth a rebuild.
+    """
+
+    def __init__(self, points):
+        rows = np.fromiter(
+            points,
+            dtype=[('id', 'i8'), ('latitude', 'f8'), ('longitude', 'f8')],
+        )
+        latitudes = np.radians(rows['latitude'])
+        longitudes = np.radians(rows['longitude'])
+        axes = (
+            np.cos(latitudes) * np.cos(longitudes),
+            np.cos(latitudes) * np.sin(longitudes),
+            np.sin(latitudes),
+        )
+        self.buffer = {}
+        self.masked = set()
+        self.lock = threading.Lock()
+
+        # sorts a permutation, then lays the points out in that order once,
+        # in flat arrays which the lookups read faster than NumPy's
+        order = np.arange(len(rows))
+        self._sort(order, axes, 0, len(order), 0)
+        self.ids = array('q', rows['id'][order].tobytes())
+        self.axes = tuple(array('d', axis[order].tobytes()) for axis in axes)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def stale(self) -> bool:
+        return len(self.buffer) + len(self.masked) > max(
+            1000, len(self.ids) // 10
+        )
+
+    def _sort(self, order, axes, low: int, high: int, axis: int):
+        if high - low <= LEAF_SIZE:
+            return
+        # the median in the middle, lower values before it, higher after
+        middle = (low + high) // 2
+        segment = order[low:high]
+        order[low:high] = segment[
+            np.argpartition(axes[axis][segment], middle - low)
+        ]
+        self._sort(order, axes, low, middle, (axis + 1) % 3)
+        self._sort(order, axes, middle + 1, high, (axis + 1) % 3)
+
+    def add(self, pk: int, latitude, longitude):
+        with self.lock:
+            # hides any previous position of this tree in the static part
+            self.masked.add(pk)
+            self.buffer[pk] = to_vector(latitude, longitude)
+
+    def remove(self, pk: int):
+        with self.lock:
+            self.masked.add(pk)
+            self.buffer.pop(pk, None)
+
+    def nearest(self, latitude, longitude, k: int) -> list[tuple[float, int]]:
+        """
+        Returns up to `k` (meters, id) pairs, closest first.
+        """
+        query = to_vector(latitude, longitude)
+        xs, ys, zs = self.axes
+
+        def squared(index):
+            return (
+                (xs[index] - query[0]) ** 2
+                + (ys[index] - query[1]) ** 2
+                + (zs[index] - query[2]) ** 2
+            )
+
+        def box_distance(box):
+            total = 0.0
+            for axis in range(3):
+                if query[axis] < box[axis]:
+                    total += (box[axis] - query[axis]) ** 2
+                elif query[axis] > box[axis + 3]:
+                    total += (query[axis] - box[axis + 3]) ** 2
+            return total
+
+        with self.lock:
+            masked = set(self.masked)
+            buffered = list(self.buffer.items())
+
+        # best-first search: points come out of the heap closest first
+        heap = [
+            (sum((i - j) ** 2 for i, j in zip(vector, query)), 0, pk)
+            for pk, vector in buffered
+        ]
+        if self.ids:
+            heap.append(
+                (0.0, 1, (0, len(self.ids), 0, [-1.0] * 3 + [1.0] * 3))
+            )
+        heapq.heapify(heap)
+
+        results = []
+        while heap and len(results) < k:
+            squared_distance, kind, payload = heapq.heappop(heap)
+            if kind == 0:
+                results.append((chord_to_meters(squared_distance), payload))
+            elif kind == 2:
+                if self.ids[payload] not in masked:
+                    results.append(
+                        (chord_to_meters(squared_distance), self.ids[payload])
+                    )
+            else:
+                low, high, axis, box = payload
+                if high - low <= LEAF_SIZE:
+                    for index in range(low, high):
+                        heapq.heappush(heap, (squared(index), 2, index))
+                    continue
+                middle = (low + high) // 2
+                split = self.axes[axis][middle]
+                heapq.heappush(heap, (squared(middle), 2, middle))
+                left, right = list(box), list(box)
+                left[axis + 3], right[axis] = split, split
+                next_axis = (axis + 1) % 3
+                for child_low, child_high, child_box in (
+                    (low, middle, left),
+                    (middle + 1, high, right),
+                ):
+                    if child_low < child_high:
+                        heapq.heappush(
+                            heap,
+                            (
+                                box_distance(child_box),
+                                1,
+                                (child_low, child_high, next_axis, child_box),
+                            ),
+                        )
+        return results
+
+
+class NearestRegistry:
+    """
+    PointIndex of the Accounts looked up, built in the background and
+    rebuilt after a TTL.
+
+    Accounts are built one at a time by a single thread, while lookups use
+    `nearest_sql` until their first index is ready, then their expired one.
+    Changes committed during a build are replayed onto the new index, as
+    its query may have missed them. The least recently used indexes are
+    dropped to keep NEAREST_MAX_POINTS points at most, and Accounts with
+    more than that are always looked up in the database.
+    """
+
+    def __init__(self):
+        # (index, built_at) by Account, least recently used first
+        self.indexes = OrderedDict()
+        self.lock = threading.Lock()
+        # changes seen while building, by Account
+        self.pending = {}
+        # when Accounts were found too large to index
+        self.oversized = {}
+        # bumped by invalidate(), so an index built meanwhile isn't kept
+        self.version = 0
+        self.executor = None
+
+    def expired(self, built_at: float) -> bool:
+        return time.monotonic() - built_at > settings.NEAREST_INDEX_TTL
+
+    def get(self, account_id: int) -> PointIndex | None:
+        """
+        The index of the Account, or None until it's first built. Missing
+        and expired indexes are scheduled to be built.
+        """
+        with self.lock:
+            entry = self.indexes.get(account_id)
+            if entry is not None:
+                self.indexes.move_to_end(account_id)
+            build = (
+                account_id not in self.pending
+                and (entry is None or self.expired(entry[1]) or entry[0].stale)
+                and not (
+                    account_id in self.oversized
+                    and not self.expired(self.oversized[account_id])
+                )
+            )
+            if build:
+                self.pending[account_id] = []
+        if build:
+            self.schedule(account_id)
+        return None if entry is None else entry[0]
+
+    def schedule(self, account_id: int):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='nearest'
+                )
+        self.executor.submit(self.build_in_background, account_id)
+
+    def build_in_background(self, account_id: int):
+        try:
+            self.build(account_id)
+        finally:
+            # opened by this thread only
+            connections.close_all()
+
+    def build(self, account_id: int) -> PointIndex | None:
+        """
+        Builds and keeps the index of the Account, unless it's too large.
+        """
+        with self.lock:
+            self.pending.setdefault(account_id, [])
+            version = self.version
+        built_at = time.monotonic()
+        try:
+            index = PointIndex(
+                PlantedTree.objects.live()
+                .filter(account_id=account_id)
+                .values_list('id', 'latitude', 'longitude')
+                .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+            )
+        except BaseException:
+            with self.lock:
+                self.pending.pop(account_id, None)
+            raise
+        with self.lock:
+            changes = self.pending.pop(account_id, [])
+            if version != self.version:
+                return None
+            if len(index) > settings.NEAREST_MAX_POINTS:
+                self.oversized[account_id] = built_at
+                self.indexes.pop(account_id, None)
+                return None
+            self.oversized.pop(account_id, None)
+            for change in changes:
+                change(index)
+            self.indexes[account_id] = (index, built_at)
+            self.indexes.move_to_end(account_id)
+            self.evict()
+        return index
+
+    def evict(self):
+        # least recently used first, under self.lock
+        points = sum(len(index) for index, _ in self.indexes.values())
+        while points > settings.NEAREST_MAX_POINTS:
+            _, (index, _) = self.indexes.popitem(last=False)
+            points -= len(index)
+
+    def apply(self, changes):
+        # `changes` are (account_id, change) pairs, None for every Account
+        with self.lock:
+            for account_id, change in changes:
+                if account_id is None:
+                    targets = [index for index, _ in self.indexes.values()]
+                    for pending in self.pending.values():
+                        pending.append(change)
+                else:
+                    entry = self.indexes.get(account_id)
+                    targets = [] if entry is None else [entry[0]]
+                    if account_id in self.pending:
+                        self.pending[account_id].append(change)
+                for index in targets:
+                    change(index)
+
+    def planted(self, planted_trees, created: bool = True):
+        """
+        Indexes `planted_trees` once their transaction commits, dropping
+        saved ones from the index of the Account they were moved from.
+        """
+        changes = []
+        for planted_tree in planted_trees:
+            pk = planted_tree.id
+            if not created:
+                counted = dict(
+                    zip(
+                        planted_tree.counted_fields,
+                        getattr(planted_tree, 'counted', None) or (),
+                    )
+                )
+                # None when the Account it was loaded with is unknown
+                before = counted.get('account_id')
+                if before != planted_tree.account_id:
+                    changes.append((before, partial(PointIndex.remove, pk=pk)))
+            changes.append(
+                (
+                    planted_tree.account_id,
+                    partial(
+                        PointIndex.add,
+                        pk=pk,
+                        latitude=planted_tree.latitude,
+                        longitude=planted_tree.longitude,
+                    ),
+                )
+            )
+        transaction.on_commit(partial(self.apply, changes))
+
+    def removed(self, planted_trees):
+        changes = [
+            (
+                planted_tree.account_id,
+                partial(PointIndex.remove, pk=planted_tree.id),
+            )
+            for planted_tree in planted_trees
+        ]
+        transaction.on_commit(partial(self.apply, changes))
+
+    def invalidate(self):
+        with self.lock:
+            self.version += 1
+            self.indexes.clear()
+            self.oversized.clear()
+
+    def nearest(self, account_ids, latitude, longitude, k: int):
+        candidates, unindexed = [], []
+        for account_id in account_ids:
+            index = self.get(account_id)
+            if index is None:
+                unindexed.append(account_id)
+            else:
+                candidates.extend(index.nearest(latitude, longitude, k))
+        if unindexed:
+            candidates.extend(nearest_sql(unindexed, latitude, longitude, k))
+        return heapq.nsmallest(k, candidates)
+
+
+registry = NearestRegistry()
+
+
+def nearest_sql(account_ids, latitude, longitude, k: int):
+    """
+    Database-only fallback: looks in growing boxes around the point,
+    through the indexed spatial cells, until the k-th closest tree found is
+    nearer than anything that could lie outside the box.
+    """
+    latitude, longitude = float(latitude), float(longitude)
+    queryset = PlantedTree.objects.live().filter(account_id__in=account_ids)
+    span = 0.01
+    while True:
+        whole_world = span >= 180
+        if whole_world:
+            candidates = queryset
+        else:
+            # wraps around the antimeridian, which within() understands
+            west = (longitude - span + 180) % 360 - 180
+            east = (longitude + span + 180) % 360 - 180
+            candidates = queryset.within(
+                max(latitude - span, -90), west, min(latitude + span, 90), east
+            )
+
+        found = heapq.nsmallest(
+            k,
+            (
+                (
+                    distance(
+                        (latitude, longitude), (pk_latitude, pk_longitude)
+                    ),
+                    pk,
+                )
+                for pk, pk_latitude, pk_longitude in candidates.values_list(
+                    'id', 'latitude', 'longitude'
+                )
+            ),
+        )
+        if whole_world:
+            return found
+
+        # anything outside the box is at least this far away, as its
+        # haversine is at least cos(lat)^2 times that of the longitude gap
+        highest = radians(min(abs(latitude) + span, 90))
+        reach = EARTH_RADIUS * min(
+            radians(span), 2 * asin(cos(highest) * sin(radians(span) / 2))
+        )
+        if len(found) == k and found[-1][0] <= reach:
+            return found
+        span *= 4
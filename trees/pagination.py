@@ -0,0 +1,158 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class PlantedTreeCursorPagination(BasePagination):
+    """
+    Keyset pagination of Planted Trees ordered by (planted_at, id).
+
+    Each page is fetched by seeking past the last seen row instead of using
+    an offset, and no COUNT is ever run, so every page costs the same.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    invalid_cursor_message = 'Invalid cursor'
+    # names of the settings bounding the page size
+    page_size_setting = 'PLANTED_TREE_PAGE_SIZE'
+    max_page_size_setting = 'PLANTED_TREE_MAX_PAGE_SIZE'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        rows = self.page_rows(queryset, request)
+        return self.set_page(list(rows))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        rows = self.page_rows(queryset, request)
+        return self.set_page([row async for row in rows])
+
+    def page_rows(self, queryset, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.cursor = self.decode_cursor(request)
+
+        if self.cursor is None:
+            rows = queryset.order_by('planted_at', 'id')
+        else:
+            planted_at, pk, reverse = self.cursor
+            if reverse:
+                rows = queryset.filter(
+                    Q(planted_at__lt=planted_at)
+                    | Q(planted_at=planted_at, id__lt=pk)
+                ).order_by('-planted_at', '-id')
+            else:
+                rows = queryset.filter(
+                    Q(planted_at__gt=planted_at)
+                    | Q(planted_at=planted_at, id__gt=pk)
+                ).order_by('planted_at', 'id')
+
+        # fetching one extra row tells if there is anything past this page
+        return rows[: self.page_size + 1]
+
+    def set_page(self, page):
+        has_more = len(page) > self.page_size
+        page = page[: self.page_size]
+        if self.reverse:
+            page.reverse()
+        self.set_links(has_more)
+        self.page = page
+        return page
+
+    def set_edges(self, fetched: int, first, last):
+        """
+        Like set_page, for a page only known by how many rows were fetched
+        for it and its `first` and `last` rows, in the order they were.
+        """
+        if self.reverse:
+            first, last = last, first
+        self.set_links(fetched > self.page_size)
+        self.page = [first, last] if fetched else []
+
+    @property
+    def reverse(self) -> bool:
+        return self.cursor is not None and self.cursor[2]
+
+    def set_links(self, has_more: bool):
+        continued = self.cursor is not None
+        self.has_next = continued if self.reverse else has_more
+        self.has_previous = has_more if self.reverse else continued
+
+    def get_page_size(self, request):
+        page_size = getattr(settings, self.page_size_setting)
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return page_size
+        if requested > 0:
+            page_size = requested
+        return min(page_size, getattr(settings, self.max_page_size_setting))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_link_header(self) -> str:
+        # for bodies with no room for the links, like binary ones
+        links = [
+            f'<{url}>; rel="{rel}"'
+            for url, rel in (
+                (self.get_next_link(), 'next'),
+                (self.get_previous_link(), 'prev'),
+            )
+            if url is not None
+        ]
+        return ', '.join(links)
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+
+    def encode_cursor(self, planted_tree, reverse):
+        position = [planted_tree.planted_at.isoformat(), planted_tree.id]
+        if reverse:
+            position.append(1)
+        cursor = urlsafe_b64encode(json.dumps(position).encode()).decode()
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(encoded.encode()))
+            planted_at, pk = datetime.fromisoformat(position[0]), int(
+                position[1]
+            )
+            reverse = len(position) > 2 and bool(position[2])
+        except (TypeError, ValueError, IndexError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        return planted_at, pk, reverse
+
+
+class PlantedTreePointsPagination(PlantedTreeCursorPagination):
+    """
+    Same keyset pagination, with the larger pages of the binary points
+    """
+
+    page_size_setting = 'PLANTED_TREE_POINTS_PAGE_SIZE'
+    max_page_size_setting = 'PLANTED_TREE_POINTS_MAX_PAGE_SIZE'
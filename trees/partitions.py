@@ -0,0 +1,328 @@
+"""
+Monthly range partitions of the Planted Trees table.
+
+Once `manage.py partition_plantings --convert` has run, which rewrites it
+outside of the migrations, the trees_plantedtree table is partitioned by
+planted_at, one partition per month plus a default one for plantings
+outside of them until their month gets its own, so the ORM keeps querying a single table while
+date-bounded queries only scan the months they cover. Its primary key
+becomes (id, planted_at), as a partitioned table requires, and its ids
+come from a sequence instead of an identity column.
+
+`manage.py partition_plantings` creates the partitions of the next
+PLANTINGS_PARTITIONS_AHEAD months and detaches those older than
+PLANTINGS_RETENTION_MONTHS, which is cheap however many plantings they
+hold. Detached partitions are left as plain tables, to be dumped or
+dropped. Their plantings leave the planting counters, the clusters and the
+versions of the listings with them, while the rollups keep their history.
+"""
+
+import re
+from datetime import date
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.timezone import now
+
+from trees import counters, heatmaps
+from trees.models import (
+    PlantedTree,
+    PlantedTreeCluster,
+    PlantedTreeVersion,
+    PlantingRollup,
+)
+from trees.nearest import registry
+from trees.spatial import CELL_BITS, CLUSTER_DETAIL, CLUSTER_MAX_ZOOM
+from trees.stats import bucket_start, shift
+
+TABLE = PlantedTree._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+MONTHLY_PARTITION = re.compile(rf'^{TABLE}_(\d{{4}})_(\d{{2}})$')
+# every column but the generated ones
+COLUMNS = ', '.join(
+    field.column
+    for field in PlantedTree._meta.concrete_fields
+    if not field.generated
+)
+
+# removes the plantings of {rows} from the clusters, like the triggers do
+REMOVE_CLUSTERS = f"""
+    UPDATE {PlantedTreeCluster._meta.db_table} AS cluster SET
+        count = cluster.count - removed.count,
+        latitude_sum = cluster.latitude_sum - removed.latitude_sum,
+        longitude_sum = cluster.longitude_sum - removed.longitude_sum
+    FROM (
+        SELECT
+            zoom,
+            planted.cell >> (2 * ({CELL_BITS} - zoom - {CLUSTER_DETAIL})) AS cell,
+            planted.account_id,
+            planted.tree_id,
+            count(*) AS count,
+            sum(planted.latitude)::float8 AS latitude_sum,
+            sum(planted.longitude)::float8 AS longitude_sum
+        FROM {{rows}} AS planted
+        CROSS JOIN generate_series(0, {CLUSTER_MAX_ZOOM}) AS zoom
+        GROUP BY 1, 2, 3, 4
+    ) AS removed
+    WHERE cluster.zoom = removed.zoom
+        AND cluster.cell = removed.cell
+        AND cluster.account_id = removed.account_id
+        AND cluster.tree_id = removed.tree_id;
+    DELETE FROM {PlantedTreeCluster._meta.db_table} WHERE count <= 0;
+"""
+
+BUMP_VERSIONS = f"""
+    INSERT INTO {PlantedTreeVersion._meta.db_table} (
+        scope, owner_id, version, modified
+    )
+    SELECT scope, owner_id, 1, now()
+    FROM (
+        SELECT '{PlantedTreeVersion.ACCOUNT}' AS scope, account_id AS owner_id
+        FROM {{rows}}
+        UNION
+        SELECT '{PlantedTreeVersion.USER}' AS scope, user_id AS owner_id
+        FROM {{rows}}
+    ) AS owners
+    ORDER BY scope, owner_id
+    ON CONFLICT (scope, owner_id) DO UPDATE SET
+        version = {PlantedTreeVersion._meta.db_table}.version + 1,
+        modified = EXCLUDED.modified
+"""
+
+REMOVE_COUNTS = f"""
+    WITH detached AS (SELECT account_id, tree_id, user_id FROM {{rows}}),
+    {counters.counted_sql('detached', '-')}
+    SELECT count(*) FROM detached
+"""
+
+
+def partition_name(month: date) -> str:
+    return f'{TABLE}_{month:%Y_%m}'
+
+
+def is_partitioned(cursor) -> bool:
+    cursor.execute(
+        'SELECT EXISTS (SELECT FROM pg_partitioned_table '
+        'WHERE partrelid = %s::regclass)',
+        [TABLE],
+    )
+    return cursor.fetchone()[0]
+
+
+def partitions(cursor) -> dict[date, str]:
+    """
+    Monthly partitions attached to the Planted Trees table, by month.
+    """
+    cursor.execute(
+        'SELECT child.relname FROM pg_inherits '
+        'JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid '
+        'WHERE pg_inherits.inhparent = %s::regclass',
+        [TABLE],
+    )
+    found = {}
+    for (name,) in cursor.fetchall():
+        if match := MONTHLY_PARTITION.match(name):
+            found[date(int(match[1]), int(match[2]), 1)] = name
+    return found
+
+
+def create_partition(cursor, month: date):
+    """
+    Creates the partition of `month`, moving into it the plantings the
+    default partition holds for that month, which would keep it from being
+    attached. Moving them leaves the counters, clusters and rollups alone,
+    as they neither enter nor leave the Planted Trees table.
+    """
+    name = partition_name(month)
+    bounds = [
+        month.isoformat(),
+        shift(PlantingRollup.MONTH, month, 1).isoformat(),
+    ]
+    cursor.execute(
+        'SELECT to_regclass(%s) IS NULL, to_regclass(%s) IS NOT NULL',
+        [name, DEFAULT_PARTITION],
+    )
+    missing, has_default = cursor.fetchone()
+    if not missing:
+        return
+    if has_default:
+        # no planting of the month may land in it meanwhile
+        cursor.execute(f'LOCK TABLE {DEFAULT_PARTITION} IN SHARE MODE')
+        cursor.execute(
+            f'SELECT EXISTS (SELECT FROM {DEFAULT_PARTITION} '
+            f'WHERE planted_at >= %s AND planted_at < %s)',
+            bounds,
+        )
+        (has_default,) = cursor.fetchone()
+    if not has_default:
+        cursor.execute(
+            f'CREATE TABLE {name} PARTITION OF {TABLE} '
+            f'FOR VALUES FROM (%s) TO (%s)',
+            bounds,
+        )
+        return
+
+    # statements on the partitions themselves fire none of the triggers of
+    # the Planted Trees table
+    cursor.execute(
+        f'CREATE TABLE {name} '
+        f'(LIKE {TABLE} INCLUDING DEFAULTS INCLUDING GENERATED)'
+    )
+    cursor.execute(
+        f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} '
+        f'WHERE planted_at >= %s AND planted_at < %s RETURNING {COLUMNS}) '
+        f'INSERT INTO {name} ({COLUMNS}) SELECT {COLUMNS} FROM moved',
+        bounds,
+    )
+    cursor.execute(
+        f'ALTER TABLE {TABLE} ATTACH PARTITION {name} '
+        f'FOR VALUES FROM (%s) TO (%s)',
+        bounds,
+    )
+
+
+def convert() -> bool:
+    """
+    Partitions the Planted Trees table by month, copying its plantings, and
+    returns whether it had to. Its indexes, foreign keys and triggers are
+    recreated under their names, so the migrations still find them.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        if is_partitioned(cursor):
+            return False
+        # deferred foreign key checks would keep the old table from going
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(f'LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE')
+
+        cursor.execute(
+            'SELECT indexdef FROM pg_indexes WHERE tablename = %s '
+            'AND indexname NOT IN (SELECT conname FROM pg_constraint '
+            "WHERE conrelid = %s::regclass AND contype = 'p')",
+            [TABLE, TABLE],
+        )
+        indexes = [definition for (definition,) in cursor.fetchall()]
+        cursor.execute(
+            'SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint '
+            "WHERE conrelid = %s::regclass AND contype = 'f'",
+            [TABLE],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(
+            'SELECT pg_get_triggerdef(oid) FROM pg_trigger '
+            'WHERE tgrelid = %s::regclass AND NOT tgisinternal',
+            [TABLE],
+        )
+        triggers = [definition for (definition,) in cursor.fetchall()]
+        cursor.execute(f'SELECT min(planted_at) FROM {TABLE}')
+        (oldest,) = cursor.fetchone()
+
+        copied = f'{TABLE}_unpartitioned'
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {copied}')
+        cursor.execute(
+            f'CREATE TABLE {TABLE} (LIKE {copied} INCLUDING DEFAULTS '
+            f'INCLUDING GENERATED) PARTITION BY RANGE (planted_at)'
+        )
+        cursor.execute(
+            f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT'
+        )
+        month = bucket_start(PlantingRollup.MONTH, (oldest or now()).date())
+        last = shift(
+            PlantingRollup.MONTH,
+            bucket_start(PlantingRollup.MONTH, now().date()),
+            settings.PLANTINGS_PARTITIONS_AHEAD,
+        )
+        while month <= last:
+            create_partition(cursor, month)
+            month = shift(PlantingRollup.MONTH, month, 1)
+
+        cursor.execute(
+            f'INSERT INTO {TABLE} ({COLUMNS}) SELECT {COLUMNS} FROM {copied}'
+        )
+        cursor.execute(f'DROP TABLE {copied}')
+
+        cursor.execute(
+            f'CREATE SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id; '
+            f"SELECT setval('{TABLE}_id_seq', "
+            f'coalesce(max(id), 0) + 1, false) FROM {TABLE}; '
+            f'ALTER TABLE {TABLE} ALTER COLUMN id '
+            f"SET DEFAULT nextval('{TABLE}_id_seq'); "
+            f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey '
+            f'PRIMARY KEY (id, planted_at)'
+        )
+        for definition in indexes:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(
+                f'ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}'
+            )
+        for definition in triggers:
+            cursor.execute(definition)
+    return True
+
+
+def create_ahead(months: int | None = None) -> list[str]:
+    """
+    Creates the partitions missing from the current month up to `months`
+    ahead, and returns their names.
+    """
+    if months is None:
+        months = settings.PLANTINGS_PARTITIONS_AHEAD
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        attached = partitions(cursor)
+        month = bucket_start(PlantingRollup.MONTH, now().date())
+        for ahead in range(months + 1):
+            upcoming = shift(PlantingRollup.MONTH, month, ahead)
+            if upcoming not in attached:
+                create_partition(cursor, upcoming)
+                created.append(partition_name(upcoming))
+    return created
+
+
+def detach_before(month: date) -> dict[str, int]:
+    """
+    Detaches the partitions of the months before `month`, returning how
+    many plantings each of them held.
+    """
+    detached = {}
+    with connection.cursor() as cursor:
+        old = sorted(
+            (partition_month, name)
+            for partition_month, name in partitions(cursor).items()
+            if partition_month < month
+        )
+    for _, name in old:
+        with transaction.atomic(), connection.cursor() as cursor:
+            # no planting may land in it until it's detached
+            cursor.execute(f'LOCK TABLE {name} IN SHARE MODE')
+            cursor.execute(REMOVE_COUNTS.format(rows=name))
+            (detached[name],) = cursor.fetchone()
+            if detached[name]:
+                cursor.execute(REMOVE_CLUSTERS.format(rows=name))
+                cursor.execute(BUMP_VERSIONS.format(rows=name))
+            cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {name}')
+
+    if any(detached.values()):
+        registry.invalidate()
+        heatmaps.cache.invalidate()
+    return detached
+
+
+def maintain() -> dict:
+    """
+    Creates the upcoming partitions and detaches the expired ones, if the
+    Planted Trees table is partitioned.
+    """
+    with connection.cursor() as cursor:
+        if not is_partitioned(cursor):
+            return {'created': [], 'detached': {}}
+    detached = {}
+    if settings.PLANTINGS_RETENTION_MONTHS:
+        detached = detach_before(
+            shift(
+                PlantingRollup.MONTH,
+                bucket_start(PlantingRollup.MONTH, now().date()),
+                -settings.PLANTINGS_RETENTION_MONTHS,
+            )
+        )
+    return {'created': create_ahead(), 'detached': detached}
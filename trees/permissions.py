@@ -12,8 +12,9 @@ class IsOwnerOrAdmin(permissions.BasePermission):
         if request.user and request.user.is_superuser:
             return True
 
+        # compares ids, so the owner never has to be loaded
         return (
-            obj == request.user
+            obj.pk == request.user.pk
             if isinstance(obj, User)
-            else obj.user == request.user
+            else obj.user_id == request.user.pk
         )
@@ -0,0 +1,100 @@
+"""
+Removal of deleted Accounts and Users with their Planted Trees.
+
+Deleting either through the API or the admin only marks it, inactive, so
+the request never waits on its plantings. `manage.py purge_deleted` then
+deletes the plantings PURGE_BATCH_SIZE at a time, archived ones included,
+each batch in its own short transaction, and the Account or User itself
+once none are left.
+
+Batches are raw DELETE statements, which skip signals, so they move the
+planting counters themselves, and the in-process caches of the worker are
+dropped. Other processes pick the deletes up once their caches expire.
+"""
+
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from trees import counters, heatmaps
+from trees.models import Account, ArchivedPlantedTree, PlantedTree, User
+from trees.nearest import registry
+
+PURGE_BATCH = f"""
+    WITH deleted AS (
+        DELETE FROM {PlantedTree._meta.db_table}
+        WHERE id IN (
+            SELECT id FROM {PlantedTree._meta.db_table}
+            WHERE {{field}} = %(owner_id)s
+            ORDER BY id
+            LIMIT %(batch_size)s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING account_id, tree_id, user_id
+    ),
+    {counters.counted_sql('deleted', '-')}
+    SELECT count(*) FROM deleted
+"""
+
+
+PURGE_ARCHIVED_BATCH = f"""
+    DELETE FROM {ArchivedPlantedTree._meta.db_table}
+    WHERE id IN (
+        SELECT id FROM {ArchivedPlantedTree._meta.db_table}
+        WHERE {{field}} = %(owner_id)s
+        ORDER BY id
+        LIMIT %(batch_size)s
+    )
+"""
+
+
+def purge_batch(field: str, owner_id: int, batch_size: int) -> int:
+    # returns how many Planted Trees were deleted
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            PURGE_BATCH.format(field=field),
+            {'owner_id': owner_id, 'batch_size': batch_size},
+        )
+        (deleted,) = cursor.fetchone()
+        if not deleted:
+            # archived trees aren't counted, so they go once the rest is gone
+            cursor.execute(
+                PURGE_ARCHIVED_BATCH.format(field=field),
+                {'owner_id': owner_id, 'batch_size': batch_size},
+            )
+            deleted = cursor.rowcount
+    return deleted
+
+
+def purge_owner(owner, field: str, batch_size: int) -> int:
+    purged = 0
+    while deleted := purge_batch(field, owner.pk, batch_size):
+        purged += deleted
+        time.sleep(settings.PURGE_BATCH_PAUSE)
+    # what is left to cascade is small, and plantings made meanwhile
+    owner.delete()
+    return purged
+
+
+def purge(batch_size: int | None = None) -> dict[str, int]:
+    """
+    Removes every deleted Account and User, returning how many of them and
+    of their Planted Trees were removed.
+    """
+    batch_size = batch_size or settings.PURGE_BATCH_SIZE
+    purged = {'accounts': 0, 'users': 0, 'planted_trees': 0}
+    for model, field, key in [
+        (Account, 'account_id', 'accounts'),
+        (User, 'user_id', 'users'),
+    ]:
+        for owner in model.objects.filter(deleted_at__isnull=False).order_by(
+            'deleted_at'
+        ):
+            purged['planted_trees'] += purge_owner(owner, field, batch_size)
+            purged[key] += 1
+
+    if purged['planted_trees']:
+        registry.invalidate()
+        heatmaps.cache.invalidate()
+    return purged
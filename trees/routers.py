@@ -0,0 +1,126 @@
+"""
+Sends the reads of the trees views to the replicas in DATABASE_REPLICAS.
+
+Only reads made while ReplicaMiddleware allows it go to a replica: those of
+GET, HEAD and OPTIONS requests to the trees views, until the request writes
+anything, and unless the client wrote within the last PRIMARY_PIN_SECONDS.
+Everything else, including management commands and the shell, stays on the
+primary. AuthTokens are always read from the primary, so a token works as
+soon as it's issued.
+
+The lag of each replica is checked at most every REPLICA_LAG_CHECK_INTERVAL
+seconds per process; replicas further than REPLICA_MAX_LAG seconds behind,
+or that can't be reached, are left out until they catch up.
+"""
+
+import random
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+PRIMARY = 'default'
+PRIMARY_ONLY = {'trees.authtoken'}
+
+# a primary with nothing left to replay is not behind, however long ago it
+# last received a transaction
+LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery()
+        OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(
+        EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0
+    )
+END
+"""
+
+
+@dataclass
+class Routing:
+    # set by ReplicaMiddleware for the duration of a request
+    replica_reads: bool = False
+    wrote: bool = False
+
+
+routing: ContextVar[Routing | None] = ContextVar('routing', default=None)
+
+
+class ReplicaLag:
+    """
+    Last measured lag of each replica, None when it couldn't be measured
+    """
+
+    def __init__(self):
+        self.lags = {}
+        self.lock = threading.Lock()
+
+    def get(self, alias: str) -> float | None:
+        now = time.monotonic()
+        with self.lock:
+            lag, checked_at = self.lags.get(alias, (None, None))
+            if checked_at is not None and (
+                now - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL
+            ):
+                return lag
+            # the other threads keep the previous value meanwhile
+            self.lags[alias] = (lag, now)
+
+        lag = self.measure(alias)
+        with self.lock:
+            self.lags[alias] = (lag, now)
+        return lag
+
+    def measure(self, alias: str) -> float | None:
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute(LAG_QUERY)
+                return float(cursor.fetchone()[0])
+        except DatabaseError:
+            return None
+
+    def available(self) -> list[str]:
+        return [
+            alias
+            for alias in settings.DATABASE_REPLICAS
+            if (lag := self.get(alias)) is not None
+            and lag <= settings.REPLICA_MAX_LAG
+        ]
+
+    def invalidate(self):
+        with self.lock:
+            self.lags.clear()
+
+
+lag = ReplicaLag()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = routing.get()
+        if (
+            state is None
+            or not state.replica_reads
+            or state.wrote
+            or model._meta.app_label != 'trees'
+            or model._meta.label_lower in PRIMARY_ONLY
+        ):
+            return PRIMARY
+        replicas = lag.available()
+        return random.choice(replicas) if replicas else PRIMARY
+
+    def db_for_write(self, model, **hints):
+        state = routing.get()
+        if state is not None:
+            # later reads must see this write
+            state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
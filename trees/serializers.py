@@ -1,17 +1,157 @@
+import copy
+
+from django.core.exceptions import FieldDoesNotExist
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 
+from trees import catalog
 from trees.models import Account, PlantedTree, Profile, Tree, User
 
 
-class AccountSerializer(serializers.ModelSerializer):
+def related_paths(serializer, model, prefix='', prefetching=False):
+    """
+    Walks the nested serializers of `serializer` and returns the lookups
+    that must be given to `select_related` and `prefetch_related` so that
+    serializing a queryset of `model` takes a constant number of queries.
+    """
+    select, prefetch = [], []
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+        many = isinstance(field, serializers.ListSerializer)
+        if isinstance(field, serializers.ManyRelatedField):
+            # primary keys of a relation left collapsed
+            prefetch.append(f'{prefix}{field.source}')
+            continue
+        if not many and not isinstance(field, serializers.BaseSerializer):
+            continue
+        try:
+            relation = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            continue
+        if not relation.is_relation:
+            continue
+
+        path = f'{prefix}{field.source}'
+        nested = field.child if many else field
+        prefetch_nested = (
+            prefetching
+            or many
+            or relation.many_to_many
+            or relation.one_to_many
+        )
+        if prefetch_nested:
+            prefetch.append(path)
+        else:
+            select.append(path)
+
+        nested_select, nested_prefetch = related_paths(
+            nested,
+            relation.related_model,
+            prefix=f'{path}__',
+            prefetching=prefetch_nested,
+        )
+        select.extend(nested_select)
+        prefetch.extend(nested_prefetch)
+
+    return select, prefetch
+
+
+def optimize_queryset(queryset, serializer):
+    # joins and prefetches everything the serializer is going to render
+    select, prefetch = related_paths(serializer, queryset.model)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
+
+
+def requested_names(request, parameter: str, path: str) -> set[str] | None:
+    """
+    Names the comma-separated `parameter` of `request` asks for at the
+    nested `path`, where `user.accounts` asks for `accounts` at `user`, or
+    None when it doesn't narrow that level down.
+    """
+    value = request.query_params.get(parameter)
+    if value is None:
+        return None
+    prefix = f'{path}.' if path else ''
+    names = [
+        name.strip()[len(prefix) :]
+        for name in value.split(',')
+        if name.strip().startswith(prefix)
+    ]
+    if parameter == 'fields' and not any(names):
+        # ?fields=user renders the whole of user
+        return None
+    return {name.split('.')[0] for name in names if name}
+
+
+def collapsed(name: str, field):
+    # primary keys in place of the nested serializer, fetched without joins
+    options = {'read_only': True}
+    if field.source not in (None, name):
+        options['source'] = field.source
+    if isinstance(field, serializers.ListSerializer):
+        options['many'] = True
+    return serializers.PrimaryKeyRelatedField(**options)
+
+
+class SparseFieldsMixin:
+    """
+    Renders only the ?fields= asked by GET requests, and the nested
+    serializers left out of ?expand= as primary keys. Dotted names reach
+    into nested serializers, like ?fields=id,user.username&expand=user.
+
+    Without either parameter everything is rendered and expanded.
+    `optimize_queryset` walks the narrowed fields, so only what is rendered
+    gets joined or prefetched.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return fields
+
+        path = '.'.join(self.field_path())
+        only = requested_names(request, 'fields', path)
+        expand = requested_names(request, 'expand', path)
+        for name, field in list(fields.items()):
+            if field.write_only:
+                continue
+            if only is not None and name not in only:
+                del fields[name]
+            elif (
+                expand is not None
+                and name not in expand
+                and isinstance(field, serializers.BaseSerializer)
+            ):
+                fields[name] = collapsed(name, field)
+        return fields
+
+    def field_path(self) -> list[str]:
+        # names of the fields nesting this serializer, from the root
+        path, serializer = [], self
+        while serializer.parent is not None:
+            if serializer.field_name:
+                path.append(serializer.field_name)
+            serializer = serializer.parent
+        return path[::-1]
+
+
+class AccountSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Account
-        fields = '__all__'
+        # deactivated_at and deleted_at are bookkeeping of the archive and
+        # the purge
+        fields = ['id', 'planted_count', 'name', 'created', 'active']
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     account_ids = serializers.PrimaryKeyRelatedField(
-        queryset=Account.objects.all(),
+        queryset=Account.objects.filter(active=True),
         source='accounts',
         write_only=True,
         many=True,
@@ -28,7 +168,10 @@ class UserSerializer(serializers.ModelSerializer):
             'account_ids',
             'accounts',
             'date_joined',
+            'planted_count',
         ]
+        # can't leave password exposed
+        extra_kwargs = {'password': {'write_only': True}}
         depth = 1
 
     def create(self, validated_data):
@@ -46,14 +189,8 @@ class UserSerializer(serializers.ModelSerializer):
             instance.save()
         return super().update(instance, validated_data)
 
-    def to_representation(self, instance):
-        response = super().to_representation(instance)
-        # can't leave password exposed
-        response.pop('password')
-        return response
-
 
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user_id = serializers.PrimaryKeyRelatedField(
         queryset=User.objects.all(), source='user', write_only=True
     )
@@ -72,15 +209,50 @@ class TreeSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class PlantedTreeSerializer(serializers.ModelSerializer):
-    tree_id = serializers.PrimaryKeyRelatedField(
+class TreeCatalogSerializer(TreeSerializer):
+    # planting counts change with every planting, the catalog only with Trees
+    class Meta(TreeSerializer.Meta):
+        fields = ['id', 'name', 'scientific_name']
+
+
+class CatalogTreeField(serializers.PrimaryKeyRelatedField):
+    """
+    Resolves Trees from the in-process catalog instead of querying them,
+    handing out copies so callers never change the cached ones
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        tree = catalog.catalog.get().trees.get(pk)
+        if tree is not None:
+            return copy.copy(tree)
+        # might have been created by another process since
+        tree = self.get_queryset().filter(pk=pk).first()
+        if tree is None:
+            self.fail('does_not_exist', pk_value=data)
+        return tree
+
+
+class PlantedTreeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    tree_id = CatalogTreeField(
         queryset=Tree.objects.all(), source='tree', write_only=True
     )
+    # nothing is planted by inactive or deleted Users, nor in inactive
+    # Accounts
     user_id = serializers.PrimaryKeyRelatedField(
-        queryset=User.objects.all(), source='user', write_only=True
+        queryset=User.objects.filter(is_active=True, deleted_at__isnull=True),
+        source='user',
+        write_only=True,
     )
     account_id = serializers.PrimaryKeyRelatedField(
-        queryset=Account.objects.all(), source='account', write_only=True
+        queryset=Account.objects.filter(active=True),
+        source='account',
+        write_only=True,
     )
     tree = TreeSerializer(read_only=True)
     user = UserSerializer(read_only=True)
@@ -91,5 +263,37 @@ class PlantedTreeSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = PlantedTree
-        fields = '__all__'
+        # cell and account_active only serve the indexes
+        fields = [
+            'id',
+            'tree_id',
+            'user_id',
+            'account_id',
+            'tree',
+            'user',
+            'account',
+            'age',
+            'location',
+            'planted_at',
+            'latitude',
+            'longitude',
+        ]
         depth = 1
+
+
+class PlantedTreeBulkSerializer(serializers.Serializer):
+    """
+    Validates a single item of a bulk planting without touching the database,
+    so that related objects can be resolved for the whole batch at once.
+    """
+
+    tree_id = serializers.IntegerField()
+    user_id = serializers.IntegerField()
+    account_id = serializers.IntegerField()
+    latitude = serializers.DecimalField(
+        max_digits=9, decimal_places=6, required=False, default=0
+    )
+    longitude = serializers.DecimalField(
+        max_digits=9, decimal_places=6, required=False, default=0
+    )
+    planted_at = serializers.DateTimeField(required=False)
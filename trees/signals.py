@@ -0,0 +1,80 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from trees import authentication, catalog, counters, heatmaps, memberships
+from trees.models import (
+    Account,
+    AuthToken,
+    PlantedTree,
+    Tree,
+    User,
+    bulk_planted,
+)
+from trees.nearest import registry
+
+
+@receiver(post_save, sender=PlantedTree)
+def index_planted_tree(sender, instance, created, **kwargs):
+    registry.planted([instance], created=created)
+    if created:
+        counters.planted([instance])
+        heatmaps.cache.planted([instance])
+    else:
+        counters.moved(instance)
+        # where the tree used to be is unknown, so any grid may be stale
+        heatmaps.cache.invalidate()
+
+
+@receiver(bulk_planted, sender=PlantedTree)
+def index_bulk_planted_trees(sender, instances, **kwargs):
+    counters.planted(instances)
+    registry.planted(instances)
+    heatmaps.cache.planted(instances)
+
+
+@receiver(post_delete, sender=PlantedTree)
+def unindex_planted_tree(sender, instance, **kwargs):
+    counters.removed([instance])
+    registry.removed([instance])
+    heatmaps.cache.removed([instance])
+
+
+@receiver(post_delete, sender=AuthToken)
+def revoke_auth_token(sender, instance, **kwargs):
+    authentication.cache.revoke(instance.digest)
+
+
+@receiver(post_save, sender=User)
+def revoke_cached_user(sender, instance, **kwargs):
+    # tokens hold on to their User, which may have been deactivated
+    authentication.cache.revoke_user(instance.id)
+
+
+@receiver(m2m_changed, sender=User.accounts.through)
+def forget_memberships(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        user_ids = [instance.pk]
+    elif pk_set is None:
+        # an Account was cleared of its users, who aren't known anymore
+        user_ids = None
+    else:
+        user_ids = list(pk_set)
+    memberships.cache.invalidate(user_ids)
+    # readers may have cached the old memberships until this commits
+    transaction.on_commit(lambda: memberships.cache.invalidate(user_ids))
+
+
+@receiver([post_save, post_delete], sender=Account)
+def forget_account_memberships(sender, **kwargs):
+    # names may have changed, and deletes don't send m2m_changed
+    memberships.cache.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Tree)
+def refresh_tree_catalog(sender, **kwargs):
+    catalog.catalog.invalidate()
+    # the catalog may be reloaded before this commits
+    transaction.on_commit(catalog.catalog.invalidate)
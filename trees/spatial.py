@@ -0,0 +1,182 @@
+"""
+Integer grid cells used to index Planted Trees by location.
+
+Latitude and longitude are each quantized to CELL_BITS bits and interleaved
+into a Z-order (Morton) code, like a geohash stored as a bigint. Nearby
+points share long prefixes, so any bounding box is covered by a handful of
+contiguous cell ranges that an ordinary B-tree index can answer.
+
+The database computes the cell of each row with the `trees_spatial_cell`
+function created in the migrations, which mirrors `cell` below.
+"""
+
+from decimal import Decimal
+from math import asinh, atan, degrees, floor, pi, radians, sinh, tan
+
+from django.db import models
+
+CELL_BITS = 24
+CELL_COUNT = 1 << CELL_BITS
+MAX_RANGES = 32
+
+# clusters are precomputed for tiles of zoom 0 to CLUSTER_MAX_ZOOM, each
+# tile split into 2^CLUSTER_DETAIL by 2^CLUSTER_DETAIL cluster cells
+CLUSTER_MAX_ZOOM = 12
+CLUSTER_DETAIL = 3
+
+# masks used to spread the bits of a coordinate into every other bit
+_SPREAD_MASKS = [
+    (16, 0x0000FFFF0000FFFF),
+    (8, 0x00FF00FF00FF00FF),
+    (4, 0x0F0F0F0F0F0F0F0F),
+    (2, 0x3333333333333333),
+    (1, 0x5555555555555555),
+]
+
+
+class SpatialCell(models.Func):
+    function = 'trees_spatial_cell'
+    output_field = models.BigIntegerField()
+
+
+def _quantize(value, offset: int, span: int) -> int:
+    position = floor((Decimal(str(value)) + offset) * CELL_COUNT / span)
+    return min(max(position, 0), CELL_COUNT - 1)
+
+
+def quantize_latitude(latitude) -> int:
+    return _quantize(latitude, 90, 180)
+
+
+def quantize_longitude(longitude) -> int:
+    return _quantize(longitude, 180, 360)
+
+
+def spread_bits(value: int) -> int:
+    for shift, mask in _SPREAD_MASKS:
+        value = (value | (value << shift)) & mask
+    return value
+
+
+def morton(x: int, y: int) -> int:
+    return spread_bits(x) | (spread_bits(y) << 1)
+
+
+def cell(latitude, longitude) -> int:
+    return morton(quantize_longitude(longitude), quantize_latitude(latitude))
+
+
+def cell_ranges(
+    min_latitude,
+    min_longitude,
+    max_latitude,
+    max_longitude,
+    max_ranges: int = MAX_RANGES,
+) -> list[tuple[int, int]]:
+    """
+    Returns inclusive (start, end) cell ranges covering the bounding box.
+
+    The box is split like a quadtree, one level at a time, for as long as
+    the cover stays within `max_ranges` nodes. The cover may reach a little
+    outside the box, so rows must still be filtered by their coordinates.
+    """
+    # one cell of slack absorbs rounding differences with the database
+    x0 = max(quantize_longitude(min_longitude) - 1, 0)
+    x1 = min(quantize_longitude(max_longitude) + 1, CELL_COUNT - 1)
+    y0 = max(quantize_latitude(min_latitude) - 1, 0)
+    y1 = min(quantize_latitude(max_latitude) + 1, CELL_COUNT - 1)
+
+    covered, partial = [], [(0, 0, 0)]
+    for level in range(1, CELL_BITS + 1):
+        size = 1 << (CELL_BITS - level)
+        contained, crossing = [], []
+        for _, x, y in partial:
+            for child_x in (2 * x, 2 * x + 1):
+                for child_y in (2 * y, 2 * y + 1):
+                    left, bottom = child_x * size, child_y * size
+                    right, top = left + size - 1, bottom + size - 1
+                    if right < x0 or left > x1 or top < y0 or bottom > y1:
+                        continue
+                    node = (level, child_x, child_y)
+                    if (
+                        x0 <= left
+                        and right <= x1
+                        and y0 <= bottom
+                        and top <= y1
+                    ):
+                        contained.append(node)
+                    else:
+                        crossing.append(node)
+
+        if len(covered) + len(contained) + len(crossing) > max_ranges:
+            break
+        covered.extend(contained)
+        partial = crossing
+        if not partial:
+            break
+
+    ranges = []
+    for level, x, y in sorted(
+        covered + partial,
+        key=lambda node: morton(node[1], node[2]) << 2 * (CELL_BITS - node[0]),
+    ):
+        shift = 2 * (CELL_BITS - level)
+        start = morton(x, y) << shift
+        end = ((morton(x, y) + 1) << shift) - 1
+        if ranges and ranges[-1][1] + 1 >= start:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def cluster_cell(cell: int, zoom: int) -> int:
+    return cell >> 2 * (CELL_BITS - zoom - CLUSTER_DETAIL)
+
+
+def tile_bounds(zoom: int, x: int, y: int) -> tuple[float, ...]:
+    """
+    (min_latitude, min_longitude, max_latitude, max_longitude) of the Web
+    Mercator tile (x, y) of `zoom`, counting tiles from the north-west
+    corner of the map like XYZ map clients. The top and bottom rows reach
+    the poles, which Web Mercator leaves out.
+    """
+    tiles = 1 << zoom
+
+    def latitude(row: int) -> float:
+        return degrees(atan(sinh(pi * (1 - 2 * row / tiles))))
+
+    return (
+        -90.0 if y == tiles - 1 else latitude(y + 1),
+        x * 360 / tiles - 180,
+        90.0 if y == 0 else latitude(y),
+        (x + 1) * 360 / tiles - 180,
+    )
+
+
+def tile_row(latitude, zoom: int) -> int:
+    """
+    Row of the Web Mercator tiles of `zoom` holding `latitude`, the top and
+    bottom ones holding the poles as well.
+    """
+    tiles = 1 << zoom
+    mercator = asinh(
+        tan(radians(min(max(float(latitude), -89.9999), 89.9999)))
+    )
+    return min(max(floor((1 - mercator / pi) / 2 * tiles), 0), tiles - 1)
+
+
+def tile_cluster_cells(zoom: int, x: int, y: int) -> list[int]:
+    """
+    Cluster cells of `zoom` overlapping the Web Mercator tile (x, y), in
+    the 2^CLUSTER_DETAIL columns spanning its width. Cells crossing its top
+    or bottom edge are shared with the tiles next to it.
+    """
+    min_latitude, _, max_latitude, _ = tile_bounds(zoom, x, y)
+    shift = CELL_BITS - zoom - CLUSTER_DETAIL
+    rows = range(
+        quantize_latitude(min_latitude) >> shift,
+        (quantize_latitude(max_latitude) >> shift) + 1,
+    )
+    columns = range(x << CLUSTER_DETAIL, (x + 1) << CLUSTER_DETAIL)
+    return [morton(column, row) for column in columns for row in rows]
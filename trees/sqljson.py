@@ -0,0 +1,295 @@
+"""
+JSON of Planted Tree listings rendered by the database.
+
+With PLANTED_TREE_SQL_JSON on, the JSON pages of the Planted Tree listings
+are built by PostgreSQL. Each row comes back as the text its serializer
+would render, and Django only joins the rows into the page envelope.
+No model instance, serializer or dict is built per row.
+
+The SQL is generated by walking the serializer itself, so its fields,
+their order and their nested serializers stay the same on both paths,
+narrowed down by ?fields= and ?expand= alike. Every
+value is written exactly like DRF's JSONRenderer writes it, compact and
+with Unicode left unescaped. Model properties are rendered by the
+expressions of PROPERTIES. Any field it can't translate raises TypeError,
+and the contract test in tests/unit_tests/trees compares both paths byte
+for byte.
+"""
+
+import itertools
+import json
+import threading
+
+from django.conf import settings
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+from trees.models import PlantedTree
+
+# only in DRF 3.16 and later, like the COERCE_BIGINT_TO_STRING setting
+BIG_INTEGER_FIELD = getattr(serializers, 'BigIntegerField', ())
+
+INTEGER_TYPES = {
+    'AutoField',
+    'BigAutoField',
+    'BigIntegerField',
+    'IntegerField',
+    'PositiveBigIntegerField',
+    'PositiveIntegerField',
+    'PositiveSmallIntegerField',
+    'SmallAutoField',
+    'SmallIntegerField',
+}
+
+
+def quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def nullable(column: str, sql: str) -> str:
+    return f"CASE WHEN {column} IS NULL THEN 'null' ELSE {sql} END"
+
+
+def integer_sql(column: str) -> str:
+    return nullable(column, f'{column}::text')
+
+
+def boolean_sql(column: str) -> str:
+    return nullable(column, f"CASE WHEN {column} THEN 'true' ELSE 'false' END")
+
+
+def string_sql(column: str) -> str:
+    return nullable(column, f'to_json({column}::text)::text')
+
+
+def float_sql(column: str) -> str:
+    # repr() of a float, which keeps the '.0' of integral values
+    return nullable(
+        column,
+        f'CASE WHEN {column} = trunc({column}) '
+        f"THEN trunc({column})::bigint::text || '.0' "
+        f'ELSE {column}::float8::text END',
+    )
+
+
+def decimal_sql(column: str) -> str:
+    # numeric columns already print with as many places as the field has
+    return nullable(column, f"'\"' || {column}::text || '\"'")
+
+
+def datetime_sql(column: str, zone: str) -> str:
+    # datetime.isoformat() in the current time zone, with Z for UTC
+    local = f'({column} AT TIME ZONE {quote(zone)})'
+    offset = f"({local} - ({column} AT TIME ZONE 'UTC'))"
+    absolute = (
+        f"(CASE WHEN {offset} < interval '0' THEN -{offset} ELSE {offset} END)"
+    )
+    return nullable(
+        column,
+        f"""'"' || to_char({local}, 'YYYY-MM-DD"T"HH24:MI:SS')
+        || CASE WHEN to_char({local}, 'US') = '000000' THEN ''
+            ELSE '.' || to_char({local}, 'US') END
+        || CASE WHEN {offset} = interval '0' THEN 'Z'
+            ELSE CASE WHEN {offset} < interval '0' THEN '-' ELSE '+' END
+                || to_char({absolute}, 'HH24:MI')
+                || CASE WHEN to_char({absolute}, 'SS') = '00' THEN ''
+                    ELSE ':' || to_char({absolute}, 'SS') END
+            END
+        || '"'""",
+    )
+
+
+def utc(column: str) -> str:
+    return f"({column} AT TIME ZONE 'UTC')"
+
+
+# model properties rendered by serializers, by model and name, as SQL of
+# the table alias
+PROPERTIES = {
+    # whole years since planted_at, both taken in UTC like PlantedTree.age
+    (PlantedTree, 'age'): lambda alias: (
+        f"(date_part('year', {utc('now()')}) "
+        f"- date_part('year', {utc(f'{alias}.planted_at')}) "
+        f"- CASE WHEN to_char({utc('now()')}, 'MMDD') "
+        f"< to_char({utc(f'{alias}.planted_at')}, 'MMDD') "
+        f'THEN 1 ELSE 0 END)::int::text'
+    ),
+    (PlantedTree, 'location'): lambda alias: (
+        f"'[' || {float_sql(f'{alias}.latitude')} || ',' "
+        f"|| {float_sql(f'{alias}.longitude')} || ']'"
+    ),
+}
+
+
+def value_sql(field, model_field, column: str, zone: str) -> str:
+    if model_field.get_internal_type() == 'GeneratedField':
+        model_field = model_field.output_field
+    if isinstance(field, serializers.BooleanField):
+        return boolean_sql(column)
+    if isinstance(field, BIG_INTEGER_FIELD) and getattr(
+        field,
+        'coerce_to_string',
+        getattr(api_settings, 'COERCE_BIGINT_TO_STRING', False),
+    ):
+        return nullable(column, f"'\"' || {column}::text || '\"'")
+    if isinstance(field, serializers.IntegerField):
+        return integer_sql(column)
+    if isinstance(field, serializers.CharField):
+        return string_sql(column)
+    if isinstance(field, serializers.DateTimeField):
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        if output_format is None or (output_format.lower() != ISO_8601):
+            raise TypeError(f'{field.field_name} is not rendered in ISO 8601')
+        return datetime_sql(column, zone)
+    if isinstance(field, serializers.DecimalField):
+        if getattr(
+            field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING
+        ):
+            return decimal_sql(column)
+        return float_sql(column)
+    if isinstance(field, serializers.ModelField):
+        internal_type = model_field.get_internal_type()
+        if internal_type in INTEGER_TYPES:
+            return integer_sql(column)
+        if internal_type == 'BooleanField':
+            return boolean_sql(column)
+    raise TypeError(f"Can't render {field.field_name} in SQL")
+
+
+def object_sql(serializer, model, alias: str, zone: str, aliases) -> str:
+    """
+    SQL rendering the JSON object `serializer` would render for the row of
+    `model` in `alias`.
+    """
+    members = []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if (model, field.source) in PROPERTIES:
+            value = PROPERTIES[model, field.source](alias)
+        else:
+            value = field_sql(field, model, alias, zone, aliases)
+        key = json.dumps(name, ensure_ascii=False)
+        members.append(f'{quote(key + ":")} || ({value})')
+    return "'{' || " + " || ',' || ".join(members) + " || '}'"
+
+
+def field_sql(field, model, alias: str, zone: str, aliases) -> str:
+    many = isinstance(
+        field, (serializers.ListSerializer, serializers.ManyRelatedField)
+    )
+    model_field = model._meta.get_field(field.source)
+    if isinstance(field, serializers.PrimaryKeyRelatedField):
+        # a relation collapsed to its primary key, stored on the row
+        return integer_sql(f'{alias}.{model_field.column}')
+    if not many and not isinstance(field, serializers.BaseSerializer):
+        return value_sql(
+            field, model_field, f'{alias}.{model_field.column}', zone
+        )
+
+    related = model_field.related_model
+    related_alias = next(aliases)
+    pk = related._meta.pk.column
+    if not many and model_field.many_to_one:
+        return nullable(
+            f'{alias}.{model_field.column}',
+            f'(SELECT {object_sql(field, related, related_alias, zone, aliases)} '
+            f'FROM {related._meta.db_table} AS {related_alias} '
+            f'WHERE {related_alias}.{pk} = {alias}.{model_field.column})',
+        )
+    if many and model_field.many_to_many and not model_field.auto_created:
+        through = next(aliases)
+        ordering = ', '.join(
+            f'{related_alias}.{related._meta.get_field(name.lstrip("-")).column}'
+            + (' DESC' if name.startswith('-') else '')
+            for name in [*related._meta.ordering, related._meta.pk.name]
+        )
+        if isinstance(field, serializers.ManyRelatedField):
+            rendered = integer_sql(f'{related_alias}.{pk}')
+        else:
+            rendered = object_sql(
+                field.child, related, related_alias, zone, aliases
+            )
+        return (
+            f"(SELECT '[' || coalesce(string_agg({rendered}, ',' "
+            f"ORDER BY {ordering}), '') || ']' "
+            f'FROM {related._meta.db_table} AS {related_alias} '
+            f'JOIN {model_field.m2m_db_table()} AS {through} '
+            f'ON {through}.{model_field.m2m_reverse_name()} '
+            f'= {related_alias}.{pk} '
+            f'WHERE {through}.{model_field.m2m_column_name()} '
+            f'= {alias}.{model._meta.pk.column})'
+        )
+    raise TypeError(f"Can't render {field.field_name} in SQL")
+
+
+# generated SQL, kept for as many shapes of the listings as this
+RENDERED_SQL_MAX = 256
+
+_lock = threading.Lock()
+_rendered_sql = {}
+
+
+def rendered_sql(serializer, model) -> str:
+    # by serializer, the fields it was narrowed down to, and time zone
+    request = serializer.context.get('request')
+    zone = timezone.get_current_timezone_name()
+    key = (
+        type(serializer),
+        model,
+        zone,
+        None if request is None else request.method,
+        None if request is None else request.query_params.get('fields'),
+        None if request is None else request.query_params.get('expand'),
+    )
+    with _lock:
+        if key not in _rendered_sql:
+            if len(_rendered_sql) >= RENDERED_SQL_MAX:
+                _rendered_sql.clear()
+            _rendered_sql[key] = object_sql(
+                serializer,
+                model,
+                model._meta.db_table,
+                zone,
+                (f'rendered_{number}' for number in itertools.count()),
+            )
+        return _rendered_sql[key]
+
+
+def enabled(request) -> bool:
+    """
+    Whether the listing asked by `request` can be rendered by the database,
+    which only writes compact JSON with Unicode left unescaped.
+    """
+    return (
+        settings.PLANTED_TREE_SQL_JSON
+        and type(getattr(request, 'accepted_renderer', None)) is JSONRenderer
+        and api_settings.COMPACT_JSON
+        and api_settings.UNICODE_JSON
+    )
+
+
+def rendered(queryset, serializer):
+    """
+    Rows of `queryset` with their id, planted_at and `rendered` JSON, which
+    the keyset pagination takes like Planted Trees.
+    """
+    sql = rendered_sql(serializer, queryset.model)
+    return queryset.annotate(rendered=RawSQL(sql, ())).values_list(
+        'id', 'planted_at', 'rendered', named=True
+    )
+
+
+def render_page(paginator, page) -> bytes:
+    # the envelope as DRF renders it, with the rows where its results go
+    envelope = JSONRenderer().render(paginator.get_paginated_data([]))
+    # escaped by the renderer for JavaScript, as rendered strings may hold them
+    results = (
+        ','.join(row.rendered for row in page)
+        .replace('\u2028', '\\u2028')
+        .replace('\u2029', '\\u2029')
+    )
+    return b''.join([envelope[: -len(b'[]}')], b'[', results.encode(), b']}'])
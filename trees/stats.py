@@ -0,0 +1,80 @@
+"""
+Planting series for the charts of the dashboards.
+
+Series are read from the PlantingRollup table only, so the cost of a chart
+depends on how many buckets, Accounts and Trees it covers, never on how
+many trees were planted.
+"""
+
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db.models import Sum
+
+from trees.models import PlantingRollup
+
+PERIODS = [PlantingRollup.DAY, PlantingRollup.WEEK, PlantingRollup.MONTH]
+GROUPS = {'account': 'account_id', 'tree': 'tree_id'}
+
+
+def bucket_start(period: str, day: date) -> date:
+    # like date_trunc in the triggers
+    if period == PlantingRollup.WEEK:
+        return day - timedelta(days=day.weekday())
+    if period == PlantingRollup.MONTH:
+        return day.replace(day=1)
+    return day
+
+
+def shift(period: str, bucket: date, buckets: int) -> date:
+    if period == PlantingRollup.WEEK:
+        return bucket + timedelta(weeks=buckets)
+    if period == PlantingRollup.MONTH:
+        months = bucket.year * 12 + bucket.month - 1 + buckets
+        return date(months // 12, months % 12 + 1, 1)
+    return bucket + timedelta(days=buckets)
+
+
+def buckets(period: str, since: date, until: date) -> list[date]:
+    bucket, last = bucket_start(period, since), bucket_start(period, until)
+    found = []
+    while bucket <= last:
+        if len(found) == settings.STATS_MAX_BUCKETS:
+            raise ValueError(
+                f'A series has at most {settings.STATS_MAX_BUCKETS} buckets'
+            )
+        found.append(bucket)
+        bucket = shift(period, bucket, 1)
+    if not found:
+        raise ValueError('since must not be after until')
+    return found
+
+
+def series(queryset, period: str, since: date, until: date, group=None):
+    """
+    Counts of the rollups in `queryset` for every bucket from `since` to
+    `until`, in one series per Account or Tree when grouped by either.
+    """
+    dates = buckets(period, since, until)
+    positions = {bucket: position for position, bucket in enumerate(dates)}
+    fields = ['bucket'] if group is None else [GROUPS[group], 'bucket']
+
+    counts = {}
+    rows = (
+        queryset.filter(period=period, bucket__range=(dates[0], dates[-1]))
+        .values(*fields)
+        .annotate(total=Sum('count'))
+        .order_by(*fields)
+    )
+    for row in rows:
+        key = None if group is None else row[GROUPS[group]]
+        counts.setdefault(key, [0] * len(dates))[
+            positions[row['bucket']]
+        ] = row['total']
+
+    if group is None:
+        return dates, [{'counts': counts.get(None, [0] * len(dates))}]
+    return dates, [
+        {group: key, 'counts': key_counts}
+        for key, key_counts in counts.items()
+    ]
@@ -1,7 +1,7 @@
-from django.urls import include, path
+from django.urls import include, path, re_path
 from rest_framework.routers import SimpleRouter
 
-from trees import views
+from trees import async_views, views
 
 router = SimpleRouter()
 router.register(r'accounts', viewset=views.AccountViewSet)
@@ -10,6 +10,31 @@ router.register(r'profiles', viewset=views.ProfileViewSet)
 router.register(r'trees', viewset=views.TreeViewSet)
 router.register(r'planted', viewset=views.PlantedTreeViewSet)
 
+# async views taking over some of the router's URLs, so they go first
+async_urlpatterns = [
+    path(
+        'planted/own/',
+        async_views.OwnPlantedTreesView.as_view(),
+        name='plantedtree-own',
+    ),
+    path(
+        'planted/account/',
+        async_views.AccountPlantedTreesView.as_view(),
+        name='plantedtree-account',
+    ),
+    re_path(
+        r'^users/(?P<pk>[^/.]+)/planted/$',
+        async_views.UserPlantedTreesView.as_view(),
+        name='user-planted',
+    ),
+    re_path(
+        r'^profiles/(?P<pk>[^/.]+)/$',
+        async_views.ProfileDetailView.as_view(),
+        name='profile-detail',
+    ),
+]
+
 urlpatterns = [
+    *async_urlpatterns,
     path('', include(router.urls)),
 ]
@@ -1,48 +1,326 @@
+import hashlib
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
-from rest_framework import permissions, status, viewsets
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, urlencode
+from django.utils.timezone import now
+from rest_framework import permissions, serializers, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
-from trees.models import Account, PlantedTree, Profile, Tree, User
+from trees import catalog, heatmaps, memberships, sqljson, stats
+from trees.exports import CONTENT_TYPES, aiter_export, iter_export
+from trees.models import (
+    Account,
+    AuthToken,
+    PlantedTree,
+    PlantedTreeCluster,
+    PlantedTreeVersion,
+    PlantingRollup,
+    Profile,
+    Tree,
+    User,
+)
+from trees.nearest import nearest_sql, registry
+from trees.pagination import (
+    PlantedTreeCursorPagination,
+    PlantedTreePointsPagination,
+)
 from trees.permissions import IsOwnerOrAdmin
+from trees.points import PointsRenderer, render_points
 from trees.serializers import (
     AccountSerializer,
+    PlantedTreeBulkSerializer,
     PlantedTreeSerializer,
     ProfileSerializer,
     TreeSerializer,
     UserSerializer,
+    optimize_queryset,
 )
+from trees.spatial import CLUSTER_MAX_ZOOM, tile_cluster_cells, tile_row
+
+BBOX_FORMAT = 'bbox must be min_lon,min_lat,max_lon,max_lat'
+
+
+def parse_bbox(value: str) -> list[Decimal]:
+    # longitudes may wrap around the antimeridian, latitudes may not
+    try:
+        bbox = [Decimal(coordinate) for coordinate in value.split(',')]
+    except ArithmeticError:
+        raise ValueError(BBOX_FORMAT)
+    if len(bbox) != 4 or not all(
+        coordinate.is_finite() for coordinate in bbox
+    ):
+        raise ValueError(BBOX_FORMAT)
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if not (
+        -90 <= min_lat <= max_lat <= 90
+        and -180 <= min_lon <= 180
+        and -180 <= max_lon <= 180
+    ):
+        raise ValueError('bbox is outside of the valid coordinates')
+    return bbox
+
+
+def planted_trees_listing(request, queryset):
+    """
+    How a page of Planted Trees is listed for `request`: its paginator, the
+    rows to page through, and what renders a page of them into a response.
+    """
+    paginator = PlantedTreeCursorPagination()
+    # narrowed down by ?fields= and ?expand=
+    context = {'request': request}
+    if sqljson.enabled(request):
+        rows = sqljson.rendered(
+            queryset, PlantedTreeSerializer(context=context)
+        )
+        return (
+            paginator,
+            rows,
+            lambda page: HttpResponse(
+                sqljson.render_page(paginator, page),
+                content_type=JSONRenderer.media_type,
+            ),
+        )
+
+    rows = optimize_queryset(queryset, PlantedTreeSerializer(context=context))
+    return (
+        paginator,
+        rows,
+        lambda page: paginator.get_paginated_response(
+            PlantedTreeSerializer(page, many=True, context=context).data
+        ),
+    )
+
+
+def paginated_planted_trees(request, queryset, view=None):
+    # map clients get larger pages, packed in binary
+    if isinstance(getattr(request, 'accepted_renderer', None), PointsRenderer):
+        paginator = PlantedTreePointsPagination()
+        response = Response(render_points(paginator, queryset, request))
+        return set_links(response, paginator)
+
+    paginator, rows, render = planted_trees_listing(request, queryset)
+    return render(paginator.paginate_queryset(rows, request, view=view))
+
+
+# query parameters picking the page and the shape of a listing
+LISTING_VARIANT_PARAMS = ['cursor', 'limit', 'fields', 'expand']
+
+
+# sums of the change counters a listing follows, which only ever go up
+CURRENT_VERSION = {'version': Sum('version'), 'modified': Max('modified')}
+
+
+def renders_related(request) -> bool:
+    # whether the Trees, Users or Accounts of the listing are nested in it
+    if isinstance(getattr(request, 'accepted_renderer', None), PointsRenderer):
+        return False
+    fields = PlantedTreeSerializer(context={'request': request}).fields
+    return any(
+        isinstance(field, serializers.BaseSerializer)
+        for field in fields.values()
+    )
+
+
+def listing_versions(request, versions):
+    """
+    The change counters in `versions`, and the RELATED one when the listing
+    renders the Trees, Users or Accounts of its Planted Trees, which change
+    without them.
+    """
+    if renders_related(request):
+        versions = versions | PlantedTreeVersion.objects.filter(
+            scope=PlantedTreeVersion.RELATED
+        )
+    return versions
+
+
+def listing_validators(request, current) -> tuple[str, int | None]:
+    """
+    ETag and Last-Modified of a listing from the CURRENT_VERSION of its
+    change counters, which are None when nothing was ever planted in it.
+
+    The ETag is weak, as the listing isn't rendered byte for byte the same
+    by every path. It also tells apart every page and projection of it.
+    """
+    version, modified = current['version'] or 0, current['modified']
+    renderer = getattr(request, 'accepted_renderer', None)
+    variant = urlencode(
+        [
+            (param, value)
+            for param in LISTING_VARIANT_PARAMS
+            for value in request.GET.getlist(param)
+        ]
+    )
+    etag = 'W/"{}-{}-{}-{}"'.format(
+        version,
+        modified.timestamp() if modified else 0,
+        getattr(renderer, 'format', 'json'),
+        hashlib.sha256(variant.encode()).hexdigest()[:16],
+    )
+    last_modified = int(modified.timestamp()) if modified else None
+    return etag, last_modified
+
+
+def not_a_member():
+    return Response(
+        {
+            'error': "Can't access Planted Trees from accounts you are not part of"
+        },
+        status=status.HTTP_403_FORBIDDEN,
+    )
+
+
+def own_planted_trees(request):
+    return PlantedTree.objects.live().filter(user_id=request.user.id)
 
 
-class AccountViewSet(viewsets.ModelViewSet):
+def account_planted_trees(request, account_id: int | None):
+    """
+    Planted Trees of the Account named by ?account=, any of them for
+    superusers, otherwise the one `account_id` of the user's memberships,
+    or None when they aren't part of it.
+    """
+    if request.user.is_superuser:
+        return PlantedTree.objects.live().filter(
+            account__name=request.GET.get('account')
+        )
+    if account_id is None:
+        return None
+    return PlantedTree.objects.live().filter(account_id=account_id)
+
+
+def account_versions(request):
+    return PlantedTreeVersion.objects.filter(
+        scope=PlantedTreeVersion.ACCOUNT,
+        owner_id__in=Account.objects.filter(
+            name=request.GET.get('account')
+        ).values('id'),
+    )
+
+
+def user_planted_trees(pk):
+    return PlantedTree.objects.live().filter(user_id=pk)
+
+
+def user_versions(pk):
+    return PlantedTreeVersion.objects.filter(
+        scope=PlantedTreeVersion.USER, owner_id=pk
+    )
+
+
+def set_links(response, paginator):
+    links = paginator.get_link_header()
+    if links:
+        response['Link'] = links
+    return response
+
+
+def set_validators(response, etag: str, last_modified: int | None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def conditional_planted_trees(request, queryset, versions, view=None):
+    """
+    Paginated Planted Trees with the validators of the change counter in
+    `versions`, answering 304 when the client is current.
+    """
+    etag, last_modified = listing_validators(
+        request,
+        listing_versions(request, versions).aggregate(**CURRENT_VERSION),
+    )
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        response = paginated_planted_trees(request, queryset, view=view)
+    return set_validators(response, etag, last_modified)
+
+
+class OptimizedQuerysetMixin:
+    """
+    Selects and prefetches every relation rendered by the serializer
+    """
+
+    def get_queryset(self):
+        return optimize_queryset(super().get_queryset(), self.get_serializer())
+
+
+class DeleteLaterMixin:
+    """
+    Only marks deleted objects, whose Planted Trees can take long to delete,
+    and leaves their removal to trees.purge
+    """
+
+    def destroy(self, request, *args, **kwargs):
+        self.get_object().delete_later()
+        return Response(status=status.HTTP_202_ACCEPTED)
+
+
+# renderers of the actions listing Planted Trees
+PLANTED_TREE_RENDERERS = [
+    *api_settings.DEFAULT_RENDERER_CLASSES,
+    PointsRenderer,
+]
+
+
+class AccountViewSet(DeleteLaterMixin, viewsets.ModelViewSet):
     """
     Lists, creates, retrieves, updates and deletes Accounts
     """
 
-    queryset = Account.objects.all()
+    queryset = Account.objects.filter(deleted_at__isnull=True)
     serializer_class = AccountSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    def get_queryset(self):
+        # ?active=true or ?active=false narrows the listing down
+        queryset = super().get_queryset()
+        active = self.request.GET.get('active')
+        if self.action == 'list' and active in ('true', 'false'):
+            queryset = queryset.filter(active=active == 'true')
+        return queryset
+
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(
+    DeleteLaterMixin, OptimizedQuerysetMixin, viewsets.ModelViewSet
+):
     """
     Lists, creates, retrieves, updates and deletes Users
     """
 
-    queryset = User.objects.all()
+    queryset = User.objects.filter(deleted_at__isnull=True)
     serializer_class = UserSerializer
     permission_classes = [
         permissions.IsAuthenticatedOrReadOnly,
         IsOwnerOrAdmin,
     ]
 
-    @action(detail=True, methods=['get'])
+    @action(
+        detail=True, methods=['get'], renderer_classes=PLANTED_TREE_RENDERERS
+    )
     def planted(self, request, pk=None, *args, **kwargs):
-        self.check_object_permissions(request, User.objects.get(pk=pk))
-        trees_queryset = PlantedTree.objects.filter(user_id=pk)
-        serializer = PlantedTreeSerializer(trees_queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        self.check_object_permissions(
+            request, get_object_or_404(self.queryset, pk=pk)
+        )
+        return conditional_planted_trees(
+            request, user_planted_trees(pk), user_versions(pk), view=self
+        )
 
 
 class TreeViewSet(viewsets.ModelViewSet):
@@ -54,8 +332,27 @@ class TreeViewSet(viewsets.ModelViewSet):
     serializer_class = TreeSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    def perform_authentication(self, request):
+        # the catalog is public, so its users are only looked up if needed
+        if self.action != 'list':
+            super().perform_authentication(request)
+
+    def list(self, request, *args, **kwargs):
+        # served from memory, or not at all if the client has it already
+        trees_catalog = catalog.catalog.get()
+        response = get_conditional_response(request, etag=trees_catalog.etag)
+        if response is None:
+            response = HttpResponse(
+                trees_catalog.content, content_type='application/json'
+            )
+        response['ETag'] = trees_catalog.etag
+        response[
+            'Cache-Control'
+        ] = f'public, max-age={settings.TREE_CATALOG_MAX_AGE}'
+        return response
+
 
-class ProfileViewSet(viewsets.ModelViewSet):
+class ProfileViewSet(OptimizedQuerysetMixin, viewsets.ModelViewSet):
     """
     Lists, creates, retrieves, updates and deletes Profiles
     """
@@ -69,17 +366,17 @@ class ProfileViewSet(viewsets.ModelViewSet):
 
     def retrieve(self, request, pk=None):
         # retrieves profile based on user
-        profile = Profile.objects.get(user__id=pk)
-        serializer = ProfileSerializer(profile)
+        profile = get_object_or_404(self.get_queryset(), user__id=pk)
+        serializer = self.get_serializer(profile)
         return Response(serializer.data)
 
 
-class PlantedTreeViewSet(viewsets.ModelViewSet):
+class PlantedTreeViewSet(OptimizedQuerysetMixin, viewsets.ModelViewSet):
     """
     Creates, retrieves, updates and deletes PlantedTrees
     """
 
-    queryset = PlantedTree.objects.all()
+    queryset = PlantedTree.objects.live()
     serializer_class = PlantedTreeSerializer
     permission_classes = [
         permissions.IsAuthenticatedOrReadOnly,
@@ -99,28 +396,460 @@ class PlantedTreeViewSet(viewsets.ModelViewSet):
         )
         return super().create(request, *args, **kwargs)
 
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['post'])
+    def bulk(self, request, *args, **kwargs):
+        # plants many trees at once, answering with one status per item
+        if not isinstance(request.data, list):
+            return Response(
+                {'error': 'Expected a list of Planted Trees'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        partial = request.GET.get('partial', '').lower() in ('1', 'true')
+
+        items, results = [], []
+        for data in request.data:
+            serializer = PlantedTreeBulkSerializer(data=data)
+            if serializer.is_valid():
+                items.append(serializer.validated_data)
+                results.append(None)
+            else:
+                items.append(None)
+                results.append(
+                    {'status': 'failed', 'errors': serializer.errors}
+                )
+
+        valid = [item for item in items if item is not None]
+        # Trees come from the catalog, unless created by another process since
+        tree_ids = {item['tree_id'] for item in valid}
+        missing = tree_ids - catalog.catalog.get().trees.keys()
+        if missing:
+            tree_ids -= missing - set(
+                Tree.objects.filter(pk__in=missing).values_list(
+                    'pk', flat=True
+                )
+            )
+        user_ids = set(
+            User.objects.filter(
+                pk__in={item['user_id'] for item in valid},
+                is_active=True,
+                deleted_at__isnull=True,
+            ).values_list('pk', flat=True)
+        )
+        account_ids = set(
+            Account.objects.filter(
+                pk__in={item['account_id'] for item in valid}, active=True
+            ).values_list('pk', flat=True)
+        )
+        member_pairs = set(
+            User.accounts.through.objects.filter(
+                user_id__in=user_ids, account_id__in=account_ids
+            ).values_list('user_id', 'account_id')
+        )
+
+        planted_trees = []
+        for index, item in enumerate(items):
+            if item is None:
+                continue
+            errors = {}
+            if item['tree_id'] not in tree_ids:
+                errors['tree_id'] = ['This Tree does not exist.']
+            if item['user_id'] not in user_ids:
+                errors['user_id'] = ['This User does not exist.']
+            elif (
+                not request.user.is_superuser
+                and item['user_id'] != request.user.id
+            ):
+                errors['user_id'] = [
+                    "Can't plant trees on behalf of another User."
+                ]
+            if item['account_id'] not in account_ids:
+                errors['account_id'] = ['This Account does not exist.']
+            elif (item['user_id'], item['account_id']) not in member_pairs:
+                errors['account_id'] = [
+                    'This Account is not associated with this User.'
+                ]
+            if errors:
+                results[index] = {'status': 'failed', 'errors': errors}
+            else:
+                planted_trees.append((index, PlantedTree(**item)))
+
+        failed = len(planted_trees) < len(items)
+        if failed and not partial:
+            for index, _ in planted_trees:
+                results[index] = {'status': 'skipped'}
+            return Response(results, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            PlantedTree.objects.bulk_create(
+                [planted_tree for _, planted_tree in planted_trees],
+                batch_size=settings.BULK_BATCH_SIZE,
+            )
+        for index, planted_tree in planted_trees:
+            results[index] = {'status': 'created', 'id': planted_tree.id}
+
+        return Response(
+            results,
+            status=status.HTTP_207_MULTI_STATUS
+            if failed
+            else status.HTTP_201_CREATED,
+        )
+
+    @action(
+        detail=False, methods=['get'], renderer_classes=PLANTED_TREE_RENDERERS
+    )
     def own(self, request, *args, **kwargs):
-        user = request.user
-        trees_queryset = PlantedTree.objects.filter(user_id=user.id)
-        serializer = PlantedTreeSerializer(trees_queryset, many=True)
-        return Response(serializer.data)
+        return paginated_planted_trees(
+            request, own_planted_trees(request), view=self
+        )
 
-    @action(detail=False, methods=['get'])
+    def account_planted_trees(self, request):
+        account_id = None
+        if not request.user.is_superuser:
+            account_id = memberships.account_id(
+                request.user, request.GET.get('account')
+            )
+        return account_planted_trees(request, account_id)
+
+    @action(
+        detail=False, methods=['get'], renderer_classes=PLANTED_TREE_RENDERERS
+    )
     def account(self, request, *args, **kwargs):
+        trees_queryset = self.account_planted_trees(request)
+        if trees_queryset is None:
+            return not_a_member()
+        return conditional_planted_trees(
+            request, trees_queryset, account_versions(request), view=self
+        )
+
+    @action(
+        detail=False, methods=['get'], renderer_classes=PLANTED_TREE_RENDERERS
+    )
+    def within(self, request, *args, **kwargs):
+        # Planted Trees inside ?bbox=min_lon,min_lat,max_lon,max_lat
+        try:
+            min_lon, min_lat, max_lon, max_lat = parse_bbox(
+                request.GET.get('bbox', '')
+            )
+        except ValueError as error:
+            return Response(
+                {'error': str(error)},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        trees_queryset = PlantedTree.objects.live().within(
+            min_lat, min_lon, max_lat, max_lon
+        )
+        if not request.user.is_authenticated:
+            trees_queryset = trees_queryset.none()
+        elif not request.user.is_superuser:
+            trees_queryset = trees_queryset.filter(
+                account_id__in=memberships.account_ids(request.user)
+            )
+        return paginated_planted_trees(request, trees_queryset, view=self)
+
+    @action(detail=False, methods=['get'])
+    def heatmap(self, request, *args, **kwargs):
+        # density grid of the user's Planted Trees, optionally narrowed down
+        # to ?bbox=, ?account= and ?tree=, with ?resolution= cells per side
+        try:
+            min_lon, min_lat, max_lon, max_lat = parse_bbox(
+                request.GET.get('bbox', '-180,-90,180,90')
+            )
+        except ValueError as error:
+            return Response(
+                {'error': str(error)}, status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            resolution = int(
+                request.GET.get('resolution', settings.HEATMAP_RESOLUTION)
+            )
+            tree_id = request.GET.get('tree')
+            tree_id = None if tree_id is None else int(tree_id)
+        except ValueError:
+            return Response(
+                {'error': 'resolution and tree must be integers'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not 1 <= resolution <= settings.HEATMAP_MAX_RESOLUTION:
+            return Response(
+                {
+                    'error': f'resolution goes from 1 to {settings.HEATMAP_MAX_RESOLUTION}'
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
         account_name = request.GET.get('account')
-        current_user = request.user
-        if not current_user.is_superuser:
-            if not current_user.accounts.filter(name=account_name).exists():
-                return Response(
-                    {
-                        'error': "Can't access Planted Trees from accounts you are not part of"
-                    },
-                    status=status.HTTP_403_FORBIDDEN,
+        if account_name is None:
+            account_ids = (
+                None
+                if request.user.is_superuser
+                else tuple(sorted(memberships.account_ids(request.user)))
+            )
+        elif request.user.is_superuser:
+            account_ids = tuple(
+                Account.objects.filter(name=account_name).values_list(
+                    'id', flat=True
                 )
-        trees_queryset = PlantedTree.objects.filter(account__name=account_name)
-        serializer = PlantedTreeSerializer(trees_queryset, many=True)
-        return Response(serializer.data)
+            )
+        else:
+            account_id = memberships.account_id(request.user, account_name)
+            if account_id is None:
+                return not_a_member()
+            account_ids = (account_id,)
+
+        grid = heatmaps.cache.get(
+            heatmaps.HeatmapKey(
+                account_ids,
+                tree_id,
+                float(min_lat),
+                float(min_lon),
+                float(max_lat),
+                float(max_lon),
+                resolution,
+            )
+        )
+        return Response(
+            {
+                'bbox': [min_lon, min_lat, max_lon, max_lat],
+                'resolution': resolution,
+                'total': int(grid.sum()),
+                'max': int(grid.max()),
+                # rows from south to north, columns from west to east
+                'counts': grid.tolist(),
+            }
+        )
+
+    @action(detail=False, methods=['get'])
+    def stats(self, request, *args, **kwargs):
+        # plantings per ?period= from ?since= to ?until=, optionally narrowed
+        # down to ?account= and ?tree=, and split by ?group=account|tree
+        period = request.GET.get('period', PlantingRollup.DAY)
+        group = request.GET.get('group') or None
+        if period not in stats.PERIODS or (
+            group is not None and group not in stats.GROUPS
+        ):
+            return Response(
+                {
+                    'error': f'period must be one of {", ".join(stats.PERIODS)}, group one of {", ".join(stats.GROUPS)}'
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            until = (
+                date.fromisoformat(request.GET['until'])
+                if 'until' in request.GET
+                else now().date()
+            )
+            since = (
+                date.fromisoformat(request.GET['since'])
+                if 'since' in request.GET
+                else stats.shift(
+                    period,
+                    stats.bucket_start(period, until),
+                    1 - settings.STATS_DEFAULT_BUCKETS,
+                )
+            )
+            tree_id = request.GET.get('tree')
+            tree_id = None if tree_id is None else int(tree_id)
+        except (ValueError, OverflowError):
+            return Response(
+                {
+                    'error': 'since and until must be YYYY-MM-DD dates, tree an integer'
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        rollups = PlantingRollup.objects.filter(account__active=True)
+        account_name = request.GET.get('account')
+        if account_name is not None and request.user.is_superuser:
+            rollups = rollups.filter(account__name=account_name)
+        elif account_name is not None:
+            account_id = memberships.account_id(request.user, account_name)
+            if account_id is None:
+                return not_a_member()
+            rollups = rollups.filter(account_id=account_id)
+        elif not request.user.is_superuser:
+            rollups = rollups.filter(
+                account_id__in=memberships.account_ids(request.user)
+            )
+        if tree_id is not None:
+            rollups = rollups.filter(tree_id=tree_id)
+
+        try:
+            buckets, series = stats.series(
+                rollups, period, since, until, group
+            )
+        except (ValueError, OverflowError) as error:
+            return Response(
+                {'error': str(error)}, status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(
+            {
+                'period': period,
+                'since': since,
+                'until': until,
+                'buckets': buckets,
+                'series': series,
+            }
+        )
+
+    @action(detail=False, methods=['get'])
+    def nearest(self, request, *args, **kwargs):
+        # the k Planted Trees closest to ?lat=&lon=, from the user's accounts
+        try:
+            latitude = float(request.GET['lat'])
+            longitude = float(request.GET['lon'])
+            k = int(request.GET.get('k', 20))
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'lat and lon are required, k must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return Response(
+                {'error': 'lat and lon are outside of the valid coordinates'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        k = min(max(k, 1), settings.NEAREST_MAX_K)
+
+        if request.user.is_superuser:
+            account_ids = list(
+                Account.objects.filter(active=True).values_list(
+                    'id', flat=True
+                )
+            )
+        else:
+            account_ids = list(memberships.account_ids(request.user))
+
+        if settings.NEAREST_BACKEND == 'sql':
+            found = nearest_sql(account_ids, latitude, longitude, k)
+        else:
+            found = registry.nearest(account_ids, latitude, longitude, k)
+
+        # narrowed down by ?fields= and ?expand=
+        planted_trees = optimize_queryset(
+            PlantedTree.objects.live().filter(id__in=[pk for _, pk in found]),
+            self.get_serializer(),
+        ).in_bulk()
+        # might have been deleted by another process in the meantime
+        found = [(meters, pk) for meters, pk in found if pk in planted_trees]
+        results = self.get_serializer(
+            [planted_trees[pk] for _, pk in found], many=True
+        ).data
+        for (meters, _), data in zip(found, results):
+            data['distance'] = round(meters, 2)
+        return Response({'results': results})
+
+    @action(detail=False, methods=['get'])
+    def clusters(self, request, *args, **kwargs):
+        # clusters of the user's Planted Trees inside Web Mercator map tile
+        # ?zoom=&x=&y=, counted from the north-west like XYZ tiles
+        try:
+            zoom, x, y = (int(request.GET[key]) for key in ('zoom', 'x', 'y'))
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'zoom, x and y must be integers'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not (
+            0 <= zoom <= CLUSTER_MAX_ZOOM
+            and 0 <= x < 2**zoom
+            and 0 <= y < 2**zoom
+        ):
+            return Response(
+                {
+                    'error': f'zoom goes up to {CLUSTER_MAX_ZOOM}, x and y up to 2^zoom'
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        clusters_queryset = PlantedTreeCluster.objects.filter(
+            zoom=zoom,
+            cell__in=tile_cluster_cells(zoom, x, y),
+            account__active=True,
+        )
+        if not request.user.is_authenticated:
+            clusters_queryset = clusters_queryset.none()
+        elif not request.user.is_superuser:
+            clusters_queryset = clusters_queryset.filter(
+                account_id__in=memberships.account_ids(request.user)
+            )
+
+        clusters = {}
+        for row in clusters_queryset.values('cell', 'tree').annotate(
+            total=Sum('count'),
+            latitude_total=Sum('latitude_sum'),
+            longitude_total=Sum('longitude_sum'),
+        ):
+            cluster = clusters.setdefault(
+                row['cell'],
+                {'count': 0, 'latitude': 0.0, 'longitude': 0.0, 'trees': {}},
+            )
+            cluster['count'] += row['total']
+            cluster['latitude'] += row['latitude_total']
+            cluster['longitude'] += row['longitude_total']
+            cluster['trees'][row['tree']] = row['total']
+
+        # cells crossing the edge of the tile belong to the tile holding
+        # their centroid, so that every cluster shows in a single tile
+        clusters = {
+            cell: cluster
+            for cell, cluster in clusters.items()
+            if tile_row(cluster['latitude'] / cluster['count'], zoom) == y
+        }
+        dominant = {
+            cell: max(cluster['trees'], key=cluster['trees'].get)
+            for cell, cluster in clusters.items()
+        }
+        trees = Tree.objects.in_bulk(set(dominant.values()))
+        return Response(
+            {
+                'zoom': zoom,
+                'x': x,
+                'y': y,
+                'clusters': [
+                    {
+                        'count': cluster['count'],
+                        'location': (
+                            cluster['latitude'] / cluster['count'],
+                            cluster['longitude'] / cluster['count'],
+                        ),
+                        'tree': TreeSerializer(trees[dominant[cell]]).data,
+                    }
+                    for cell, cluster in sorted(clusters.items())
+                ],
+            }
+        )
+
+    @action(detail=False, methods=['get'])
+    def export(self, request, *args, **kwargs):
+        # streams every Planted Tree of an account as NDJSON or CSV
+        output = request.GET.get('output', 'ndjson')
+        if output not in CONTENT_TYPES:
+            return Response(
+                {'error': f'Output must be one of {", ".join(CONTENT_TYPES)}'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        trees_queryset = self.account_planted_trees(request)
+        if trees_queryset is None:
+            return not_a_member()
+        # the rows are read once the request has returned, when the router
+        # would no longer send them to a replica
+        trees_queryset = trees_queryset.using(trees_queryset.db)
+
+        # ASGI servers need an async iterator, or the whole export would be
+        # collected into a list before the first byte is sent
+        if isinstance(request._request, ASGIRequest):
+            content = aiter_export(trees_queryset, output)
+        else:
+            content = iter_export(trees_queryset, output)
+        response = StreamingHttpResponse(
+            content, content_type=CONTENT_TYPES[output]
+        )
+        response[
+            'Content-Disposition'
+        ] = f'attachment; filename="planted-trees.{output}"'
+        return response
 
 
 class LoginView(APIView):
@@ -142,3 +871,55 @@ class LoginView(APIView):
     def delete(self, request):
         logout(request)
         return Response({'logout': 'success'}, status=status.HTTP_200_OK)
+
+
+class TokenView(APIView):
+    """
+    Issues, rotates and revokes the API tokens of the current User
+    """
+
+    def post(self, request):
+        # issues a token to the logged in user, or to the given credentials
+        user = request.user
+        if not user.is_authenticated:
+            user = authenticate(
+                request,
+                username=request.data.get('username'),
+                password=request.data.get('password'),
+            )
+        if user is None:
+            return Response(
+                {'token': 'failed'}, status=status.HTTP_401_UNAUTHORIZED
+            )
+        _, key = AuthToken.issue(user)
+        return Response({'token': key}, status=status.HTTP_201_CREATED)
+
+    def put(self, request):
+        # swaps the token of this request for a new one
+        if not isinstance(request.auth, AuthToken):
+            return Response(
+                {'error': 'Rotating needs a token'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        with transaction.atomic():
+            request.auth.delete()
+            _, key = AuthToken.issue(request.user)
+        return Response({'token': key}, status=status.HTTP_201_CREATED)
+
+    def delete(self, request):
+        # revokes the token of this request, or every token with ?all=true
+        if not request.user.is_authenticated:
+            return Response(
+                {'error': 'Authentication credentials were not provided.'},
+                status=status.HTTP_401_UNAUTHORIZED,
+            )
+        if request.GET.get('all', '').lower() in ('1', 'true'):
+            AuthToken.objects.filter(user_id=request.user.id).delete()
+        elif isinstance(request.auth, AuthToken):
+            request.auth.delete()
+        else:
+            return Response(
+                {'error': 'Revoking needs a token, or ?all=true'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response({'token': 'revoked'}, status=status.HTTP_200_OK)